@@ -253,6 +253,9 @@ RABBITMQ_CONF = {
     'vhost': '/local',
     'username': 'username',
     'password': 'password',
+    # The seconds of heartbeat negotiated with the broker, disabled if 0. The blocking connection only sends
+    # heartbeats while processing data events, so an idle producer or a consumer running a handler longer than
+    # two intervals is closed by the broker, only enable it if neither happens
     'heartbeat': 0,
     #
     'exchange_map': {
@@ -267,8 +270,57 @@ RABBITMQ_CONF = {
                     'queue': 'task',
                     'routing_keys': ['task.#'],
                     'count': 3,
+                    'prefetch': 1,
+                    'workers': 1,
                 },
             ]
         }
     }
 }
+
+# Task
+TASK_CONF = {
+    # The task modules imported when the executor starts, such as: ['app.tasks']
+    'modules': [],
+    # Task engine: mysql, redis(use the redis of `REDIS_CONF`)
+    'engine': 'mysql',
+    # Claim waiting tasks by `SELECT ... FOR UPDATE SKIP LOCKED`, fallback to the optimistic lock
+    # if the database doesn't support it (MySQL < 8.0.1)
+    'skip_locked': True,
+    # Wake up the idle executors by redis pub/sub when tasks are added or updated, each add publishes to redis
+    'wakeup': False,
+    # The max idle sleep of executors, the idle sleep is doubled from 2 seconds
+    'idle_sleep_seconds_max': 10,
+    # Prefetch the tasks due within the next `lookahead_seconds` and fire them at their run_at exactly (thread
+    # mode), disabled if 0. The prefetched tasks are pending, `update_task`/`upsert_task` of waiting tasks skip
+    # them until fired, so enable it only for the tasks not updated shortly before their run_at.
+    'lookahead_seconds': 0,
+    'lookahead_max_tasks': 100,
+    # Delete the successful tasks in batches, flushed when the batch is full or every 1 second.
+    # The successful task is kept in `running` until flushed, set 1 to delete each task at once.
+    'complete_batch_size': 100,
+    'complete_flush_seconds': 1,
+    # Each claimed task has a lease renewed by the heartbeat of the worker. The pending/running tasks with
+    # expired lease (the worker is crashed) are set waiting again, or failed after claimed `max_attempts` times.
+    'lease_seconds': 60,
+    'heartbeat_seconds': 10,
+    'max_attempts': 3,
+    # The task over the `max_concurrency` of its task name is put back (run_at is kept), and the task name is not
+    # claimed by the worker for the seconds
+    'concurrency_defer_seconds': 1,
+    # Export the lag, run time and results of tasks by task name to redis every heartbeat, read by the
+    # `taskmetrics` command and the `task/metrics` endpoint (Prometheus text format)
+    'metrics': True,
+    # Each node claims only the tasks in its shard range (the shard of task is crc32(task_name:task_attr) %
+    # shard_count), the ranges are rebalanced by the live nodes in redis every heartbeat (mysql engine)
+    'sharding': False,
+    'shard_count': 64,
+    # The task_args/task_kwargs JSON not less than the bytes is compressed, or offloaded to `utils_task_payload`
+    # (stored once by digest), disabled if 0. The payload is not loaded by the poll, only when executed.
+    'payload_compress_bytes': 4096,
+    'payload_offload_bytes': 0,
+    # The count of offloaded payloads cached by digest in each process
+    'payload_cache_size': 128,
+    # The pending member count of task group in redis expires after 7 days since the last member finished
+    'group_expire_seconds': 7 * 24 * 3600,
+}
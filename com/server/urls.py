@@ -15,6 +15,8 @@ Including another URLconf
 """
 from django.urls import path
 
+from utils.task.views import task_metrics_view
+
 
 def welcome(request):
     return 'Welcome'
@@ -22,4 +24,5 @@ def welcome(request):
 
 urlpatterns = [
     path('', welcome),
+    path('task/metrics', task_metrics_view),
 ]
@@ -12,6 +12,13 @@ class DuplicateEntryForMySQL(DjangoORMError):
     code = 1062
 
 
+class DuplicateTask(Exception):
+    """
+    Task already exists, (task_name, task_attr) is unique
+    """
+    pass
+
+
 class CodeError(Exception):
     """
     Code error
@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...rabbitmq import producer
+from ...rabbitmq.client import mq_client
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the publishes per second of the producer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=1000, help='The count of messages to publish',
+        )
+        parser.add_argument(
+            '--size', type=int, default=100, help='The bytes of message body',
+        )
+        parser.add_argument(
+            '--exchange', default=None, help='The exchange to publish, default is the first one of RABBITMQ_CONF',
+        )
+        parser.add_argument(
+            '--routing_key', default='bench.benchmq', help='The routing key, no queue is bound by default',
+        )
+        parser.add_argument(
+            '--ping', action='store_true',
+            help='Ping the broker before each publish, the same as the producer pinged before',
+        )
+        parser.add_argument(
+            '--window', type=int, default=0,
+            help='Publish in batch by `publish_many` with the confirm window, publish one by one if 0',
+        )
+
+    def handle(self, *args, **options):
+        exchange = options['exchange'] or next(iter(settings.RABBITMQ_CONF['exchange_map']))
+        message = 'x' * options['size']
+        count = options['count']
+        # Connect before measuring
+        mq_client.get_channel(producer=True)
+
+        started_at = time.perf_counter()
+        if options['window']:
+            publisher = producer.publish_many(
+                exchange, (message for _ in range(count)), routing_key=options['routing_key'],
+                window=options['window'],
+            )
+            # No queue is bound to the routing key by default, the messages are returned
+            self.stdout.write(f'Acked: {publisher.acked}, nacked: {len(publisher.nacked)}, '
+                              f'returned: {len(publisher.returned)}')
+        else:
+            for _ in range(count):
+                if options['ping']:
+                    mq_client.is_alive()
+                producer.publish(exchange, message, routing_key=options['routing_key'])
+        seconds = time.perf_counter() - started_at
+        self.stdout.write(f'Published {count} messages of {options["size"]} bytes in {seconds:.3f}s, '
+                          f'{count / seconds:.1f} publishes/s, ping: {options["ping"]}, window: {options["window"]}')
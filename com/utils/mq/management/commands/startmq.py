@@ -1,28 +1,49 @@
 import logging
-from threading import Thread
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from ...rabbitmq.consumer import Consumer
+from ...rabbitmq.async_consumer import run_with_asyncio
+from ...rabbitmq.consumer import run_with_processes, run_with_threads
 
 #
 logger = logging.getLogger(__name__)
 
 
+def get_queue_info_list():
+    """
+    The queue info of all exchanges in `RABBITMQ_CONF`
+    """
+    queue_info_list = []
+    for exchange, info in settings.RABBITMQ_CONF['exchange_map'].items():
+        for queue_info in info.get('queue_info_list') or [dict(queue=exchange)]:
+            queue_info_list.append(dict(queue_info, exchange=exchange, count=queue_info.get('count', 2)))
+    return queue_info_list
+
+
 class Command(BaseCommand):
     help = 'Start mq consumer command'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', default='thread', choices=['thread', 'asyncio'],
+            help='Run a connection per consumer on threads, or all consumers over one connection on an event loop',
+        )
+        parser.add_argument(
+            '--thread_count', type=int, default=4, help='The count of thread for sync functions in asyncio mode',
+        )
+        parser.add_argument(
+            '--processes', type=int, default=0,
+            help='The count of worker process, the consumers are spread across them, run in this process if 0',
+        )
+
     def handle(self, *args, **options):
-        logger.info('Start mq consumer...')
-        for exchange, info in settings.RABBITMQ_CONF['exchange_map'].items():
-            queue_info_list = info.get('queue_info_list') or [
-                dict(queue=exchange, count=2)
-            ]
-            for queue_info in queue_info_list:
-                queue = queue_info['queue']
-                count = queue_info.get('count', 2)
-                for i in range(count):
-                    Thread(target=Consumer(queue).run).start()
-                    logger.info(f'Consumer(exchange:{exchange}, queue:{queue}, count:{i + 1}/{count}) start...')
-        logger.info('Start all mq consumer successfully.')
+        queue_info_list = get_queue_info_list()
+        if options['processes'] > 0:
+            run_with_processes(
+                queue_info_list, options['processes'], mode=options['mode'], thread_count=options['thread_count'],
+            )
+        elif options['mode'] == 'asyncio':
+            run_with_asyncio(queue_info_list, thread_count=options['thread_count'])
+        else:
+            run_with_threads(queue_info_list)
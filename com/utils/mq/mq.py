@@ -20,18 +20,28 @@ def run_with_mq(priority: int = None):
     exchange = settings.RABBITMQ_CONF['exchange_map']['task']['exchange_info']['exchange']
 
     def out_wrapper(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            message = dict(
+        def make_message(args, kwargs):
+            return dict(
                 module_name=func.__module__,
                 func_name=func.__name__,
                 args=args,
                 kwargs=kwargs,
             )
-            producer.publish(exchange=exchange, message=message, priority=priority)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            producer.publish(exchange=exchange, message=make_message(args, kwargs), priority=priority)
             return
 
+        def publish_many(calls):
+            """
+            Publish the calls in batch, each call is (args, kwargs), return the publisher
+            """
+            messages = (make_message(args, kwargs) for args, kwargs in calls)
+            return producer.publish_many(exchange=exchange, messages=messages, priority=priority)
+
         wrapper.original = func
+        wrapper.publish_many = publish_many
         return wrapper
 
     return out_wrapper
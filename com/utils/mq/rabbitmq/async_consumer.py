@@ -0,0 +1,208 @@
+import asyncio
+import functools
+import inspect
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from .client import mq_client
+from .consumer import UnackedDeliveries, parse_message
+from utils.serializers import json_decode
+
+#
+logger = logging.getLogger(__name__)
+
+# The seconds to wait before reconnecting after the connection is lost, or reopening a closed channel
+RECONNECT_DELAY_SECONDS = 5
+
+
+class QueueChannel:
+    """
+    A channel consuming the queue on the shared connection
+
+    Up to `prefetch` messages are handled concurrently, the finished messages are acked by `UnackedDeliveries`.
+    The channel closed alone (such as by the broker) is reopened after `RECONNECT_DELAY_SECONDS`, the channels of
+    a lost connection are reopened with the connection.
+    """
+
+    def __init__(self, consumer, queue, prefetch: int = 1):
+        self.consumer = consumer
+        self.queue = queue
+        self.prefetch = prefetch
+        #
+        self.channel = None
+        self.consumer_tag = None
+        self._opening = False
+        self._unacked = UnackedDeliveries()
+
+    def open(self, connection):
+        self._opening = True
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        self._opening = False
+        self.channel = channel
+        # The unacked messages of the closed channel are redelivered
+        self._unacked.clear()
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.basic_qos(prefetch_count=self.prefetch, callback=self._on_qos_ok)
+
+    def _on_qos_ok(self, _):
+        self.consumer_tag = self.channel.basic_consume(
+            queue=self.queue, on_message_callback=self._on_message, auto_ack=False,
+        )
+        logger.info(f'Consumer(queue:{self.queue}, prefetch:{self.prefetch}, channel:{self.channel.channel_number}) '
+                    f'start...')
+
+    def _on_channel_closed(self, channel, reason):
+        if channel is not self.channel:
+            return
+        self.channel = None
+        self.consumer_tag = None
+        if self.consumer.stopped:
+            return
+        logger.warning(f'Consumer(queue:{self.queue}) channel is closed, reopen in {RECONNECT_DELAY_SECONDS}s. '
+                       f'reason: {reason!r}')
+        self.consumer.call_later(RECONNECT_DELAY_SECONDS, self._reopen)
+
+    def _reopen(self):
+        connection = self.consumer.connection
+        # The lost connection reopens all its channels after reconnected
+        if self.channel is not None or self._opening or self.consumer.stopped or connection is None \
+                or not connection.is_open:
+            return
+        self.open(connection)
+
+    def _on_message(self, channel, method, properties, body):
+        self._unacked.add(method.delivery_tag)
+        self.consumer.submit(self.queue, method, body, functools.partial(self._on_done, channel, method.delivery_tag))
+
+    def _on_done(self, channel, delivery_tag, _):
+        # The channel is closed, the message is redelivered
+        if channel is not self.channel or not channel.is_open:
+            return
+        for ack_delivery_tag, multiple in self._unacked.finish([delivery_tag]):
+            channel.basic_ack(delivery_tag=ack_delivery_tag, multiple=multiple)
+
+    def cancel(self):
+        if self.channel is not None and self.channel.is_open and self.consumer_tag:
+            self.channel.basic_cancel(self.consumer_tag)
+
+
+class AsyncConsumer:
+    """
+    Asyncio consumer runtime
+
+    All the queues are consumed over one connection, a channel per consumer (the `count` of each queue).
+    The `async def` functions run on the event loop natively, the sync functions run on a bounded thread pool.
+    The connection is reopened after it's lost. Stopping cancels the consumers, waits for the messages in flight
+    and closes the connection.
+    """
+
+    def __init__(self, queue_info_list: list, thread_count: int = 4):
+        self.thread_pool = ThreadPoolExecutor(max_workers=thread_count, thread_name_prefix='MQ-consumer')
+        self.queue_channels = [
+            QueueChannel(self, queue_info['queue'], prefetch=queue_info.get('prefetch', 1))
+            for queue_info in queue_info_list for _ in range(queue_info.get('count', 1))
+        ]
+        self.connection = None
+        # Running futures
+        self._futures = set()
+        self._loop = None
+        self._stopped = False
+        self._stop_event = None
+        self._closed_event = None
+
+    def connect(self):
+        if self._stopped:
+            return
+        self.connection = AsyncioConnection(
+            mq_client.parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._loop,
+        )
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def call_later(self, delay, callback):
+        self._loop.call_later(delay, callback)
+
+    def _on_connection_open(self, connection):
+        logger.info(f'MQ async connection is opened, channel count: {len(self.queue_channels)}')
+        for queue_channel in self.queue_channels:
+            queue_channel.open(connection)
+
+    def _on_connection_open_error(self, connection, error):
+        logger.error(f'Open MQ async connection failed, reconnect in {RECONNECT_DELAY_SECONDS}s. error: {error!r}')
+        self._loop.call_later(RECONNECT_DELAY_SECONDS, self.connect)
+
+    def _on_connection_closed(self, connection, reason):
+        if self._stopped:
+            self._closed_event.set()
+            return
+        logger.warning(f'MQ async connection is closed, reconnect in {RECONNECT_DELAY_SECONDS}s. reason: {reason!r}')
+        self._loop.call_later(RECONNECT_DELAY_SECONDS, self.connect)
+
+    def submit(self, queue, method, body, callback):
+        future = asyncio.ensure_future(self.handle(queue, method, body))
+        future.add_done_callback(self._futures.discard)
+        future.add_done_callback(callback)
+        self._futures.add(future)
+
+    async def handle(self, queue, method, body):
+        queue_info = f'[{method.exchange}->{queue}->{method.routing_key}]'
+        message = body.decode()
+        try:
+            message = json_decode(message)
+
+            func, args, kwargs = parse_message(message)
+            if inspect.iscoroutinefunction(func):
+                await func(*args, **kwargs)
+            else:
+                await self._loop.run_in_executor(self.thread_pool, functools.partial(func, *args, **kwargs))
+        except Exception as _:
+            logger.exception(f'{queue_info} Consuming failed. message:{message}')
+        else:
+            logger.info(f'{queue_info} Consumeing successfully. message:{message}')
+
+    def stop(self):
+        logger.info('Stop mq async consumer...')
+        self._stopped = True
+        for queue_channel in self.queue_channels:
+            queue_channel.cancel()
+        self._stop_event.set()
+
+    async def run(self):
+        """
+        Consume until stopped, return after the messages in flight are done
+        """
+        logger.info('Start mq async consumer...')
+        self._loop = asyncio.get_event_loop()
+        self._stop_event = asyncio.Event()
+        self._closed_event = asyncio.Event()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            self._loop.add_signal_handler(signum, self.stop)
+        self.connect()
+
+        await self._stop_event.wait()
+        # The messages delivered before the consumers were cancelled are handled as well
+        while self._futures:
+            await asyncio.wait(set(self._futures))
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+            await self._closed_event.wait()
+        self.thread_pool.shutdown()
+        logger.info('MQ async consumer is stopped')
+
+
+def run_with_asyncio(queue_info_list: list, thread_count: int = 4):
+    """
+    Start the asyncio consumer runtime, and wait until stopped
+    """
+    asyncio.run(AsyncConsumer(queue_info_list, thread_count=thread_count).run())
@@ -59,9 +59,19 @@ class MQClient:
 
     def connect(self):
         connection = pika.BlockingConnection(self.parameters)
+        connection.add_on_connection_blocked_callback(self._on_connection_blocked)
+        connection.add_on_connection_unblocked_callback(self._on_connection_unblocked)
         mq_thread_ctx.set('connection', connection)
         return connection
 
+    @staticmethod
+    def _on_connection_blocked(connection, method_frame):
+        logger.warning(f'MQ connection is blocked by broker. reason: {method_frame.method.reason}')
+
+    @staticmethod
+    def _on_connection_unblocked(connection, method_frame):
+        logger.info('MQ connection is unblocked by broker.')
+
     def ping_ok(self, connection):
         try:
             if connection and connection.process_data_events():
@@ -78,32 +88,70 @@ class MQClient:
 
     @property
     def connection(self):
+        """
+        The connection of current thread, reconnect if it's closed
+
+        `is_open` is the state tracked by pika (closed by the broker, heartbeat timeout or I/O error), no broker
+        round trip.
+        """
         connection = mq_thread_ctx.get('connection')
-        if not self.ping_ok(connection):
+        if not connection or not connection.is_open:
             connection = self.connect()
         return connection
 
     def close(self):
         connection = mq_thread_ctx.get('connection')
-        if self.ping_ok(connection):
-            connection.close()
+        try:
+            if connection and connection.is_open:
+                connection.close()
+        except pika_exceptions.AMQPError:
+            logger.warning('Close MQ connection failed, it may be closed already.')
         mq_thread_ctx.clear()
 
-    def _make_channel(self):
+    def _make_channel(self, key):
         channel = self.connection.channel()
-        mq_thread_ctx.set('channel', channel)
+        mq_thread_ctx.set(key, channel)
         return channel
 
-    def get_channel(self, producer: bool = False):
-        channel = mq_thread_ctx.get('channel')
-        if not self.is_alive() or not channel:
-            channel = self._make_channel()
+    def get_channel(self, producer: bool = False, prefetch_count: int = 1):
+        """
+        Get the long-lived channel of current thread, the producer channel is apart from the consumer channel
+
+        The cached channel is reused while pika tracks it open, without pinging the broker on every call.
+        The producer calls `reset_channel` if the channel failed, or `reset` to reconnect if the connection failed.
+        The `prefetch_count` of the consumer channel is set when the channel is opened.
+        """
+        key = 'producer_channel' if producer else 'channel'
+        channel = mq_thread_ctx.get(key)
+        if not channel or not channel.is_open or not channel.connection.is_open:
+            channel = self._make_channel(key)
             if producer:
                 channel.confirm_delivery()
             else:
-                channel.basic_qos(prefetch_count=1)
+                channel.basic_qos(prefetch_count=prefetch_count)
         return channel
 
+    def reset(self):
+        """
+        Drop the connection and channels of current thread, the next `get_channel` reconnects
+        """
+        self.close()
+
+    def reset_channel(self, producer: bool = False):
+        """
+        Drop the channel of current thread only, the next `get_channel` opens a new one on the same connection
+
+        A channel closed by the broker (such as publishing to a missing exchange) doesn't break the connection,
+        which is shared with the other channel of current thread.
+        """
+        key = 'producer_channel' if producer else 'channel'
+        channel = mq_thread_ctx.get(key)
+        mq_thread_ctx.set(key, None)
+        try:
+            if channel and channel.is_open:
+                channel.close()
+        except pika_exceptions.AMQPError:
+            logger.warning('Close MQ channel failed, it may be closed already.')
 
 """
 ### MQ client config example:
@@ -114,6 +162,9 @@ class MQClient:
     'vhost': '/local',
     'username': 'username',
     'password': 'password',
+    # The seconds of heartbeat negotiated with the broker, disabled if 0. The blocking connection only sends
+    # heartbeats while processing data events, so an idle producer or a consumer running a handler longer than
+    # two intervals is closed by the broker, only enable it if neither happens
     'heartbeat': 0,
     #
     'exchange_map': {
@@ -127,7 +178,12 @@ class MQClient:
                 {
                     'queue': 'task',
                     'routing_keys': ['task.#'],
+                    # The consumer connections of the queue
                     'count': 3,
+                    # The unacked messages delivered to each consumer
+                    'prefetch': 1,
+                    # The worker threads handling the messages of each consumer
+                    'workers': 1,
                 },
             ]
         }
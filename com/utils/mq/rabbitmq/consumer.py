@@ -1,7 +1,14 @@
+import asyncio
+import collections
+import inspect
 import logging
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 
 from .client import mq_client
+from utils.processutils import ProcessSupervisor
 from utils.serializers import json_decode
 
 #
@@ -10,44 +17,261 @@ logger = logging.getLogger(__name__)
 functions_cache = {}
 
 
+def get_func(module_name, func_name):
+    func_key = module_name + "." + func_name
+    if func_key in functions_cache:
+        func = functions_cache.get(func_key)
+    else:
+        module = import_module(module_name)
+        func = getattr(module, func_name)
+        functions_cache[func_key] = func
+    return func
+
+
+class UnackedDeliveries:
+    """
+    The unacked delivery tags of a channel, in delivery order
+
+    The finished messages are acked without waiting for the messages before them. The run of finished messages
+    from the oldest unacked one is acked by one ack with multiple=True, the other finished messages are acked one by
+    one, so a slow message doesn't hold the acks (and the prefetch) of the messages after it.
+    """
+
+    def __init__(self):
+        self._unacked = collections.deque()
+        # The delivery tags acked one by one, popped when they become the oldest
+        self._acked = set()
+
+    def add(self, delivery_tag):
+        self._unacked.append(delivery_tag)
+
+    def clear(self):
+        self._unacked.clear()
+        self._acked.clear()
+
+    def finish(self, delivery_tags):
+        """
+        Mark the messages finished, return the acks to send [(delivery_tag, multiple), ...]
+        """
+        finished = set(delivery_tags)
+        acks = []
+        # The run of finished messages from the oldest unacked one
+        last_delivery_tag = None
+        while self._unacked and (self._unacked[0] in finished or self._unacked[0] in self._acked):
+            delivery_tag = self._unacked.popleft()
+            if delivery_tag in self._acked:
+                self._acked.discard(delivery_tag)
+            else:
+                finished.discard(delivery_tag)
+                last_delivery_tag = delivery_tag
+        if last_delivery_tag is not None:
+            acks.append((last_delivery_tag, True))
+        for delivery_tag in sorted(finished):
+            self._acked.add(delivery_tag)
+            acks.append((delivery_tag, False))
+        return acks
+
+
+def parse_message(message: dict):
+    """
+    The (func, args, kwargs) of the message published by `run_with_mq`, the func is the original function
+    """
+    func = get_func(message["module_name"], message["func_name"])
+    return func.original, message['args'], message['kwargs']
+
+
 class Consumer:
-    def __init__(self, queue):
-        self.queue = queue
+    """
+    Consume the messages of the queue
 
-    def get_func(self, module_name, func_name):
-        func_key = module_name + "." + func_name
-        if func_key in functions_cache:
-            func = functions_cache.get(func_key)
-        else:
-            module = import_module(module_name)
-            func = getattr(module, func_name)
-            functions_cache[func_key] = func
-        return func
+    With `workers` > 1, the deliveries are handled by a thread pool, up to `prefetch` messages are in flight.
+    Pika is not thread safe, so the finished delivery tags are passed back to the connection thread by
+    `add_callback_threadsafe`, and acked by `UnackedDeliveries`.
+    """
 
-    def on_message_callback(self, ch, method, properties, body):
+    def __init__(self, queue, prefetch: int = 1, workers: int = 1):
+        self.queue = queue
+        self.prefetch = max(prefetch, workers)
+        self.workers = workers
+        #
+        self.channel = None
+        self.thread_pool = None
+        # Used by the connection thread only
+        self._unacked = UnackedDeliveries()
+        # The delivery tags finished by the workers, to ack by the connection thread
+        self._lock = threading.Lock()
+        self._finished_tags = []
+        self._stopped = False
+
+    def handle(self, method, body):
         queue_info = f'[{method.exchange}->{self.queue}->{method.routing_key}]'
         message = body.decode()
         try:
             message = json_decode(message)
 
-            module_name, func_name = message["module_name"], message["func_name"]
-            func = self.get_func(module_name, func_name)
-            args, kwargs = message['args'], message['kwargs']
-            func.original(*args, **kwargs)
+            func, args, kwargs = parse_message(message)
+            result = func(*args, **kwargs)
+            # The async def function
+            if inspect.iscoroutine(result):
+                asyncio.run(result)
         except:
             logger.exception(f'{queue_info} Consuming failed. message:{message}')
         else:
             logger.info(f'{queue_info} Consumeing successfully. message:{message}')
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def on_message_callback(self, ch, method, properties, body):
+        if self.thread_pool is None:
+            self.handle(method, body)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        self._unacked.add(method.delivery_tag)
+        self.thread_pool.submit(self._handle_in_worker, method, body)
+
+    def _handle_in_worker(self, method, body):
+        try:
+            self.handle(method, body)
+        finally:
+            with self._lock:
+                self._finished_tags.append(method.delivery_tag)
+                # One callback for the tags finished before it runs
+                schedule = len(self._finished_tags) == 1
+            if schedule:
+                try:
+                    self.channel.connection.add_callback_threadsafe(self._ack_finished)
+                except:
+                    logger.exception(f'[{self.queue}] Schedule ack failed, the message will be redelivered.')
+
+    def _ack_finished(self):
+        """
+        Ack the finished messages in the connection thread
+        """
+        with self._lock:
+            finished_tags, self._finished_tags = self._finished_tags, []
+        for delivery_tag, multiple in self._unacked.finish(finished_tags):
+            if self.channel.is_open:
+                self.channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+
+    def stop(self):
+        """
+        Stop consuming, called by other threads. The messages in flight are finished and acked before `run` returns
+        """
+        self._stopped = True
+        channel = self.channel
+        if channel is None:
+            return
+        try:
+            channel.connection.add_callback_threadsafe(channel.stop_consuming)
+        except:
+            logger.exception(f'[{self.queue}] Stop consumer failed.')
 
     def run(self):
-        channel = mq_client.get_channel()
         try:
+            channel = mq_client.get_channel(prefetch_count=self.prefetch)
+            self.channel = channel
+            if self.workers > 1:
+                self.thread_pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=f'MQ-consumer-{self.queue}'
+                )
             channel.basic_consume(
                 queue=self.queue,
                 auto_ack=False,
                 on_message_callback=self.on_message_callback
             )
-            channel.start_consuming()
+            if not self._stopped:
+                channel.start_consuming()
         except:
             logger.exception('Run consumer failed.')
+        finally:
+            if self.thread_pool is not None:
+                self.thread_pool.shutdown(wait=True)
+                # The acks scheduled after consuming stopped
+                if self.channel.is_open:
+                    self._ack_finished()
+            mq_client.close()
+
+
+def run_with_threads(queue_info_list: list):
+    """
+    Start the consumers on threads, a connection per consumer, and wait until all consumers stopped
+
+    The stop signal stops consuming, the messages in flight are finished and acked before exit.
+    """
+    logger.info('Start mq consumer...')
+    consumers, threads = [], []
+    for queue_info in queue_info_list:
+        exchange, queue, count = queue_info['exchange'], queue_info['queue'], queue_info['count']
+        prefetch, workers = queue_info.get('prefetch', 1), queue_info.get('workers', 1)
+        for i in range(count):
+            consumer = Consumer(queue, prefetch=prefetch, workers=workers)
+            consumers.append(consumer)
+            threads.append(threading.Thread(target=consumer.run))
+            logger.info(f'Consumer(exchange:{exchange}, queue:{queue}, count:{i + 1}/{count}, '
+                        f'prefetch:{prefetch}, workers:{workers}) start...')
+
+    def stop_consumer_handler(signum, _):
+        logger.info('Receive a stop signal, signum:{}'.format(signum))
+        for _consumer in consumers:
+            _consumer.stop()
+
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, stop_consumer_handler)
+    for thread in threads:
+        thread.start()
+    logger.info('Start all mq consumer successfully.')
+    for thread in threads:
+        thread.join()
+    logger.info('All mq consumer are stopped.')
+
+
+def _run_worker_process(queue_info_list, mode, thread_count):
+    """
+    Run the consumers in a worker process, return after all consumers stopped
+    """
+    # Only the supervisor forwards stop signal, the consumers register their own handlers
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, signal.SIG_DFL)
+    if mode == 'asyncio':
+        from .async_consumer import run_with_asyncio
+        run_with_asyncio(queue_info_list, thread_count=thread_count)
+    else:
+        run_with_threads(queue_info_list)
+
+
+def spread_queue_info_list(queue_info_list: list, process_count: int):
+    """
+    Spread the consumers (the `count` of each queue) across the worker processes round-robin,
+    fewer worker processes than `process_count` if not enough consumers, none if no consumer
+    """
+    consumers = [dict(queue_info, count=1) for queue_info in queue_info_list for _ in range(queue_info['count'])]
+    shares = (consumers[i::process_count] for i in range(process_count))
+    return [share for share in shares if share]
+
+
+def run_with_processes(queue_info_list: list, process_count: int, mode: str = 'thread', thread_count: int = 4):
+    """
+    Start the consumers in prefork worker processes, and wait until all worker processes exited
+
+    Each worker process runs its share of consumers with its own connections, and is restarted if it exited
+    before stopping. The stop signal is forwarded to the worker processes to drain.
+    """
+    logger.info(f'Prepare mq consumer worker processes, count: {process_count}')
+    args_list = [
+        (worker_queue_info_list, mode, thread_count)
+        for worker_queue_info_list in spread_queue_info_list(queue_info_list, process_count)
+    ]
+    if not args_list:
+        logger.warning('No mq consumer to run')
+        return
+    supervisor = ProcessSupervisor(
+        _run_worker_process, len(args_list), name='MQ-worker', args_list=args_list, restart=True,
+    )
+
+    def stop_supervisor_handler(signum, _):
+        logger.info('Receive a stop signal, signum:{}'.format(signum))
+        supervisor.stop(signum)
+
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, stop_supervisor_handler)
+    supervisor.start()
+    supervisor.join()
+    logger.info('All mq consumer worker processes are stopped')
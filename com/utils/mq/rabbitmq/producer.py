@@ -1,31 +1,306 @@
 import logging
+import time
+
 import pika
 
+from pika import exceptions as pika_exceptions
+
 from .client import mq_client
 from utils.serializers import json_encode
 
 #
 logger = logging.getLogger(__name__)
 
+# The errors of a broken connection, the message is published again on a new connection once
+RECONNECT_ERRORS = (
+    pika_exceptions.AMQPConnectionError,
+    pika_exceptions.ConnectionWrongStateError,
+)
+# The errors of a broken channel (such as closed by the broker), the message is published again on a new channel
+# of the same connection once
+REOPEN_CHANNEL_ERRORS = (
+    pika_exceptions.ChannelClosed,
+    pika_exceptions.ChannelWrongStateError,
+)
+
+
+# The count of unconfirmed messages published in batch before waiting for confirms
+DEFAULT_CONFIRM_WINDOW = 1000
+# The seconds to wait for confirms
+DEFAULT_CONFIRM_TIMEOUT = 30
+
+
+def _make_properties(priority, message_id: str = None):
+    return pika.BasicProperties(
+        delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+        priority=min(priority, mq_client.max_priority) if priority else None,
+        message_id=message_id,
+    )
+
+
+def _basic_publish(exchange, routing_key, message, priority):
+    channel = mq_client.get_channel(producer=True)
+    channel.basic_publish(
+        exchange=exchange,
+        routing_key=routing_key,
+        body=message,
+        properties=_make_properties(priority),
+        mandatory=True
+    )
+
 
 def publish(exchange, message, routing_key: str = None, priority: int = None):
+    """
+    Publish a message on the cached producer channel of current thread
+
+    If the channel is broken, reopen the channel and publish again once, if the connection is broken, reconnect
+    and publish again once. The message may be delivered twice if the broker received it but the confirm was lost.
+    """
     routing_key = routing_key or f'{exchange}.default'
     publish_info = dict(exchange=exchange, routing_key=routing_key, message=message)
     try:
         if not isinstance(message, str):
             message = json_encode(message)
-        channel = mq_client.get_channel(producer=True)
-        channel.basic_publish(
-            exchange=exchange,
+        try:
+            _basic_publish(exchange, routing_key, message, priority)
+        except REOPEN_CHANNEL_ERRORS as e:
+            logger.warning(f'Publish mq message failed, reopen the channel and retry. error: {e!r}')
+            mq_client.reset_channel(producer=True)
+            _basic_publish(exchange, routing_key, message, priority)
+        except RECONNECT_ERRORS as e:
+            logger.warning(f'Publish mq message failed, reconnect and retry. error: {e!r}')
+            mq_client.reset()
+            _basic_publish(exchange, routing_key, message, priority)
+    except:
+        logger.exception(f'Publish mq message failed, unexpected error. {publish_info}')
+    else:
+        logger.info(f'Publish mq message successfully. {publish_info}')
+
+
+class Publisher:
+    """
+    Publish messages in batch on a confirm channel of its own, waiting for the confirms in a sliding window
+    instead of one by one
+
+    Up to `window` messages are unconfirmed at a time, the confirms (multiple=True acks as well) are handled by
+    callbacks while processing the data events of the connection. The messages not delivered are reported after
+    the batch:
+
+    - `acked`: the count of messages acked and not returned
+    - `nacked`: the messages nacked by the broker
+    - `returned`: the unroutable messages returned by the broker (mandatory=True)
+    - `unconfirmed`: the messages not confirmed in time, or when the connection broke
+
+    Example:
+        with Publisher('task') as publisher:
+            for message in messages:
+                publisher.publish(message)
+        failed = publisher.nacked + publisher.returned
+    """
+
+    def __init__(
+            self,
+            exchange,
+            routing_key: str = None,
+            priority: int = None,
+            window: int = DEFAULT_CONFIRM_WINDOW,
+            timeout: float = DEFAULT_CONFIRM_TIMEOUT,
+    ):
+        self.exchange = exchange
+        self.routing_key = routing_key or f'{exchange}.default'
+        self.priority = priority
+        self.window = window
+        self.timeout = timeout
+        #
+        self.channel = None
+        self.nacked = []
+        self.returned = []
+        # delivery_tag: publish_info, in the order of publishing
+        self._pending = {}
+        # delivery_tag: publish_info of the acked messages, the message returned after acked is moved to `returned`
+        self._acked = {}
+        self._delivery_tag = 0
+        # The delivery tags of the returned messages not acked yet
+        self._returned_tags = set()
+        # Wake up the waiting when no more than the count of messages are unconfirmed
+        self._wait_count = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.wait_confirms()
+        finally:
+            self.close()
+            if exc_type is not None and issubclass(exc_type, RECONNECT_ERRORS):
+                mq_client.reset()
+
+    def open(self):
+        """
+        Open the channel on the connection of current thread, and turn on the confirm mode with callbacks
+
+        `BlockingChannel.confirm_delivery` makes each `basic_publish` block on the confirm of the message, so the
+        confirm mode is turned on the underlying channel with `ack_nack_callback`, the only private API used here
+        (`BlockingChannel._impl` of the pinned pika 1.2). The I/O is processed by `process_data_events`.
+        """
+        channel = mq_client.connection.channel()
+        self.channel = channel
+        selected = []
+
+        def on_select_ok(method_frame):
+            selected.append(method_frame)
+            self._wakeup()
+
+        try:
+            channel._impl.confirm_delivery(ack_nack_callback=self._on_confirm, callback=on_select_ok)
+            if not self._process_data_events(lambda: selected, self.timeout):
+                raise TimeoutError('Turn on MQ confirm mode timeout')
+        except Exception as _:
+            self.close()
+            raise
+        channel.add_on_return_callback(self._on_return)
+
+    def close(self):
+        channel, self.channel = self.channel, None
+        try:
+            if channel and channel.is_open:
+                channel.close()
+        except pika_exceptions.AMQPError:
+            logger.warning('Close MQ publisher channel failed, it may be closed already.')
+
+    @property
+    def acked(self):
+        return len(self._acked)
+
+    @property
+    def unconfirmed(self):
+        return list(self._pending.values())
+
+    def publish(self, message, routing_key: str = None, priority: int = None):
+        """
+        Publish the message without waiting for its confirm, wait only if the window is full
+        """
+        if len(self._pending) >= self.window:
+            self.wait_confirms(self.window - 1)
+
+        routing_key = routing_key or self.routing_key
+        priority = priority or self.priority
+        publish_info = dict(exchange=self.exchange, routing_key=routing_key, message=message)
+        if not isinstance(message, str):
+            message = json_encode(message)
+
+        self._delivery_tag += 1
+        self._pending[self._delivery_tag] = publish_info
+        # The message id is the delivery tag, to match the returned message
+        self.channel.basic_publish(
+            exchange=self.exchange,
             routing_key=routing_key,
             body=message,
-            properties=pika.BasicProperties(
-                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
-                priority=priority or max([priority, mq_client.max_priority]),
-            ),
+            properties=_make_properties(priority, message_id=str(self._delivery_tag)),
             mandatory=True
         )
-    except:
-        logger.exception(f'Publish mq message failed, unexpected error. {publish_info}')
+
+    def wait_confirms(self, count: int = 0):
+        """
+        Wait until no more than `count` messages are unconfirmed, raise TimeoutError after `timeout` seconds
+        """
+        if len(self._pending) <= count:
+            return
+        self._wait_count = count
+        try:
+            confirmed = self._process_data_events(lambda: len(self._pending) <= count, self.timeout)
+        finally:
+            self._wait_count = None
+        if not confirmed:
+            raise TimeoutError(f'Wait for MQ confirms timeout, unconfirmed: {len(self._pending)}')
+
+    def _process_data_events(self, predicate, timeout):
+        """
+        Process the data events of the connection until the predicate is true, return False after `timeout` seconds
+
+        `process_data_events` returns early only on the events dispatched by BlockingConnection, the callbacks of
+        the underlying channel wake it up by `_wakeup`.
+        """
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            time_limit = deadline - time.monotonic()
+            if time_limit <= 0:
+                return False
+            self.channel.connection.process_data_events(time_limit=time_limit)
+        return True
+
+    def _wakeup(self):
+        self.channel.connection.call_later(0, lambda: None)
+
+    def _on_confirm(self, method_frame):
+        method = method_frame.method
+        if method.multiple:
+            delivery_tags = [delivery_tag for delivery_tag in self._pending if delivery_tag <= method.delivery_tag]
+        else:
+            delivery_tags = [method.delivery_tag]
+
+        is_ack = isinstance(method, pika.spec.Basic.Ack)
+        for delivery_tag in delivery_tags:
+            publish_info = self._pending.pop(delivery_tag, None)
+            if publish_info is None:
+                continue
+            if delivery_tag in self._returned_tags:
+                self._returned_tags.discard(delivery_tag)
+            elif is_ack:
+                self._acked[delivery_tag] = publish_info
+            else:
+                self.nacked.append(publish_info)
+        if self._wait_count is not None and len(self._pending) <= self._wait_count:
+            self._wakeup()
+
+    def _on_return(self, channel, method, properties, body):
+        # The returned message is acked by the broker after returned, but the return is dispatched by
+        # `process_data_events` later than the ack, it's reported as returned not acked either way
+        delivery_tag = int(properties.message_id or 0)
+        publish_info = self._pending.get(delivery_tag)
+        if publish_info is not None:
+            self.returned.append(publish_info)
+            self._returned_tags.add(delivery_tag)
+        else:
+            publish_info = self._acked.pop(delivery_tag, None)
+            if publish_info is not None:
+                self.returned.append(publish_info)
+        logger.warning(f'MQ message returned. exchange: {method.exchange}, routing_key: {method.routing_key}, '
+                       f'reply: {method.reply_code} {method.reply_text}')
+
+
+def publish_many(
+        exchange,
+        messages,
+        routing_key: str = None,
+        priority: int = None,
+        window: int = DEFAULT_CONFIRM_WINDOW,
+        timeout: float = DEFAULT_CONFIRM_TIMEOUT,
+):
+    """
+    Publish the messages in batch, return the publisher to check the messages not delivered
+
+    The confirm timeout and the broken connection or channel are logged, the messages published but not confirmed
+    are `publisher.unconfirmed`, the messages after them are not published.
+    """
+    publisher = Publisher(exchange, routing_key=routing_key, priority=priority, window=window, timeout=timeout)
+    try:
+        with publisher:
+            for message in messages:
+                publisher.publish(message)
+    except (TimeoutError,) + RECONNECT_ERRORS + REOPEN_CHANNEL_ERRORS as e:
+        logger.error(f'Publish mq messages failed. exchange: {exchange}, acked: {publisher.acked}, '
+                     f'nacked: {len(publisher.nacked)}, returned: {len(publisher.returned)}, '
+                     f'unconfirmed: {len(publisher.unconfirmed)}, error: {e!r}')
+        if isinstance(e, RECONNECT_ERRORS):
+            mq_client.reset()
+        return publisher
+    if publisher.nacked or publisher.returned:
+        logger.warning(f'Publish mq messages partially failed. exchange: {exchange}, acked: {publisher.acked}, '
+                       f'nacked: {len(publisher.nacked)}, returned: {len(publisher.returned)}')
     else:
-        logger.info(f'Publish mq message successfully. {publish_info}')
+        logger.info(f'Publish mq messages successfully. exchange: {exchange}, count: {publisher.acked}')
+    return publisher
@@ -0,0 +1,93 @@
+from unittest import mock
+
+import pika
+from django.test import SimpleTestCase
+from pika.adapters.blocking_connection import BlockingChannel
+
+# The MQ client connects to the broker and declares the exchanges when imported
+with mock.patch('pika.BlockingConnection'):
+    from .rabbitmq import producer
+    from .rabbitmq.consumer import spread_queue_info_list
+
+
+class FakeBroker:
+    """
+    The underlying channel in confirm mode, acks all the published messages when the data events are processed
+    """
+
+    def __init__(self, ack=True):
+        self.ack = ack
+        self.published = []
+        self.ack_nack_callback = None
+        self.channel_impl = mock.MagicMock(is_open=True, is_closed=False)
+        self.channel_impl.confirm_delivery.side_effect = self.confirm_delivery
+        self.channel_impl.basic_publish.side_effect = lambda **kwargs: self.published.append(kwargs)
+        self.connection = mock.MagicMock()
+        self.connection.channel.side_effect = lambda: BlockingChannel(self.channel_impl, self.connection)
+        self.connection.process_data_events.side_effect = self.process_data_events
+
+    def confirm_delivery(self, ack_nack_callback, callback):
+        self.ack_nack_callback = ack_nack_callback
+        callback(mock.Mock(method=pika.spec.Confirm.SelectOk()))
+
+    def process_data_events(self, time_limit=0):
+        if self.ack and self.published:
+            method = pika.spec.Basic.Ack(delivery_tag=len(self.published), multiple=True)
+            self.ack_nack_callback(mock.Mock(method=method))
+
+
+class PublisherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.broker = FakeBroker()
+        patcher = mock.patch.object(type(producer.mq_client), 'connection', new_callable=mock.PropertyMock,
+                                    return_value=self.broker.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_publish_in_window(self):
+        with producer.Publisher('test', window=2) as publisher:
+            for i in range(5):
+                publisher.publish({'i': i})
+        self.broker.channel_impl.confirm_delivery.assert_called_once()
+        self.assertEqual(len(self.broker.published), 5)
+        # Waited when the window was full, and for the last messages
+        self.assertEqual(self.broker.connection.process_data_events.call_count, 3)
+        self.assertEqual(publisher.acked, 5)
+        self.assertEqual(publisher.unconfirmed, [])
+
+    def test_returned_after_acked(self):
+        with producer.Publisher('test') as publisher:
+            publisher.publish({'i': 0})
+            publisher.publish({'i': 1})
+        # The return is dispatched after the ack of the message
+        publisher._on_return(None, mock.Mock(), self.broker.published[0]['properties'], b'')
+        self.assertEqual(publisher.acked, 1)
+        self.assertEqual([publish_info['message'] for publish_info in publisher.returned], [{'i': 0}])
+
+    def test_confirm_timeout(self):
+        self.broker.ack = False
+        publisher = producer.publish_many('test', [{'i': 0}], timeout=0.01)
+        self.assertEqual(publisher.acked, 0)
+        self.assertEqual(len(publisher.unconfirmed), 1)
+
+
+class SpreadQueueInfoListTest(SimpleTestCase):
+
+    def test_total_consumer_count(self):
+        queue_info_list = [
+            dict(queue='a', routing_keys=['a.#'], count=3),
+            dict(queue='b', routing_keys=['b.#'], count=2),
+        ]
+        for process_count in (1, 2, 5, 8):
+            worker_queue_info_lists = spread_queue_info_list(queue_info_list, process_count)
+            self.assertEqual(len(worker_queue_info_lists), min(process_count, 5))
+            self.assertTrue(all(worker_queue_info_lists))
+            counts = {}
+            for worker_queue_info_list in worker_queue_info_lists:
+                for queue_info in worker_queue_info_list:
+                    counts[queue_info['queue']] = counts.get(queue_info['queue'], 0) + queue_info['count']
+            self.assertEqual(counts, {'a': 3, 'b': 2})
+
+    def test_no_consumer(self):
+        self.assertEqual(spread_queue_info_list([dict(queue='a', routing_keys=['a.#'], count=0)], 4), [])
@@ -0,0 +1,111 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+
+from django.db import connections
+
+#
+logger = logging.getLogger(__name__)
+
+# The crashed worker process is restarted at least the seconds after it started last time
+RESTART_DELAY_SECONDS = 1
+
+
+class ProcessSupervisor:
+    """
+    Prefork worker processes
+
+    Each worker process runs `target(*args)` with its own database connection, or `target(*args_list[i])` for
+    the i-th worker process if `args_list` is given.
+    The stop signal received by supervisor will be forwarded to all the worker processes.
+    If `restart`, the worker process exited before stopping is restarted.
+    """
+
+    def __init__(
+            self,
+            target,
+            count: int,
+            name: str = 'Worker',
+            args: tuple = (),
+            args_list: list = None,
+            restart: bool = False,
+    ):
+        self.target = target
+        self.count = count
+        self.name = name
+        self.args = args
+        self.args_list = args_list
+        self.restart = restart
+        #
+        self.processes = []
+        self.stopped = False
+        self._stop_signum = signal.SIGTERM
+        self._started_at = []
+
+    def _run_worker(self, args):
+        logger.info(f'{multiprocessing.current_process().name} start ..., pid: {os.getpid()}')
+        try:
+            self.target(*args)
+        finally:
+            connections.close_all()
+        logger.info(f'{multiprocessing.current_process().name} is stopped')
+
+    def _start_worker(self, index):
+        args = self.args_list[index] if self.args_list is not None else self.args
+        ctx = multiprocessing.get_context('fork')
+        process = ctx.Process(target=self._run_worker, args=(args,), name=f'{self.name}-{index + 1}')
+        process.start()
+        return process
+
+    def start(self):
+        # The connections can't be shared with the worker processes, close them before fork
+        connections.close_all()
+        for i in range(self.count):
+            self.processes.append(self._start_worker(i))
+            self._started_at.append(time.monotonic())
+        logger.info(f'Start all worker processes successfully, count: {self.count}')
+
+    def stop(self, signum=signal.SIGTERM):
+        """
+        Forward the stop signal to worker processes
+        """
+        self.stopped = True
+        self._stop_signum = signum
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def _restart_exited(self):
+        for i, process in enumerate(self.processes):
+            if self.stopped:
+                return
+            if process.exitcode is None or time.monotonic() - self._started_at[i] < RESTART_DELAY_SECONDS:
+                continue
+            logger.warning(f'{process.name} exited unexpectedly, exitcode: {process.exitcode}, restart it')
+            connections.close_all()
+            self.processes[i] = self._start_worker(i)
+            self._started_at[i] = time.monotonic()
+            # The stop signal received while forking was not forwarded to the new worker process
+            if self.stopped:
+                os.kill(self.processes[i].pid, self._stop_signum)
+                return
+
+    def join(self):
+        """
+        Wait until all worker processes exited, the exited ones are restarted until stopped if `restart`
+        """
+        while self.restart and not self.stopped:
+            # The exited worker processes waiting for restart are not waited
+            sentinels = [process.sentinel for process in self.processes if process.exitcode is None]
+            if sentinels:
+                multiprocessing.connection.wait(sentinels, timeout=RESTART_DELAY_SECONDS)
+            else:
+                time.sleep(RESTART_DELAY_SECONDS)
+            self._restart_exited()
+
+        for process in self.processes:
+            process.join()
+            logger.info(f'{process.name} exited, exitcode: {process.exitcode}')
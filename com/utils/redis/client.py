@@ -75,6 +75,37 @@ class Client:
         _name = '{}{}:{}'.format(self._make_key(''), '_shared_lock', name)
         return Lock(self._redis, _name, timeout=timeout)
 
+    def register_script(self, script):
+        """
+        Register a lua script
+
+        The keys passed to the script will be added prefix and version
+        """
+        _script = self._redis.register_script(script)
+
+        def execute(keys=None, args=None, version=None):
+            _keys = [self._make_key(key, version) for key in keys or []]
+            return _script(keys=_keys, args=args)
+
+        return execute
+
+    def publish(self, channel, message, version=None):
+        """
+        Post a message to a channel
+        """
+        _channel = self._make_key(channel, version)
+        return self._redis.publish(_channel, self._encode(message))
+
+    def pubsub(self, *channels, version=None):
+        """
+        Subscribe to channels, return a `PubSub` object
+
+        Use `PubSub.get_message(timeout=...)` to receive messages, the data of message is not decoded.
+        """
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(*[self._make_key(channel, version) for channel in channels])
+        return pubsub
+
     def set(self, key, value, ex=None, nx=False, version=None):
         """
         Set the string value of a key
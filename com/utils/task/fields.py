@@ -0,0 +1,174 @@
+import base64
+import datetime
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import models
+
+# Task config
+task_conf = getattr(settings, 'TASK_CONF', {})
+
+# The payload (JSON) not less than the bytes is compressed, disabled if 0
+payload_compress_bytes = task_conf.get('payload_compress_bytes', 0)
+# The payload not less than the bytes is offloaded to `utils_task_payload`, disabled if 0
+payload_offload_bytes = task_conf.get('payload_offload_bytes', 0)
+# The count of offloaded payloads cached by digest, the payload of a digest never changes
+payload_cache_size = task_conf.get('payload_cache_size', 128)
+
+# The stored value of the compressed payload: {"$zlib": base64(zlib(json))}
+COMPRESSED_KEY = '$zlib'
+# The stored value of the offloaded payload: {"$blob": sha1(json)}
+OFFLOADED_KEY = '$blob'
+
+
+def _get_marker_key(value):
+    if isinstance(value, dict) and len(value) == 1:
+        key = next(iter(value))
+        if key in (COMPRESSED_KEY, OFFLOADED_KEY):
+            return key
+    return None
+
+
+# The compressed data of the offloaded payloads {digest: data}, least recently used first
+_payload_cache = OrderedDict()
+_payload_cache_lock = threading.Lock()
+
+
+def _cache_payloads(payloads: dict):
+    with _payload_cache_lock:
+        for digest, data in payloads.items():
+            _payload_cache[digest] = data
+            _payload_cache.move_to_end(digest)
+        while len(_payload_cache) > payload_cache_size:
+            _payload_cache.popitem(last=False)
+
+
+def prefetch_payloads(digests):
+    """
+    Load the offloaded payloads not cached by one query, so the fields referring to them are decoded without queries
+    """
+    from .models import TaskPayload
+    with _payload_cache_lock:
+        digests = {digest for digest in digests if digest and digest not in _payload_cache}
+    if digests:
+        _cache_payloads(dict(TaskPayload.objects.filter(digest__in=digests).values_list('digest', 'data')))
+
+
+def store_payloads(payloads: dict):
+    """
+    Store the offloaded payloads {digest: data}, by one query for each of touching the existing ones (so they're not
+    purged as unreferenced) and inserting the others
+    """
+    from .models import TaskPayload
+    if not payloads:
+        return
+    existing = set(TaskPayload.objects.filter(digest__in=payloads).values_list('digest', flat=True))
+    if existing:
+        TaskPayload.objects.filter(digest__in=existing).update(referenced_at=datetime.datetime.now())
+    TaskPayload.objects.bulk_create([
+        TaskPayload(digest=digest, data=data) for digest, data in payloads.items() if digest not in existing
+    ], ignore_conflicts=True)
+    _cache_payloads(payloads)
+
+
+def offload_payloads(model, rows: list):
+    """
+    Offload the large payloads of the rows ({field name: value}) to create or update `model` in place, the payload
+    is replaced by `{"$blob": <digest>}` and the digest field is set. The payloads of all rows are stored by one batch
+    """
+    payloads = {}
+    for field in model._meta.concrete_fields:
+        if not isinstance(field, PayloadField):
+            continue
+        for row in rows:
+            if field.name not in row:
+                continue
+            row[field.name], digest, data = field.offload(row[field.name])
+            if field.digest_field:
+                row[field.digest_field] = digest
+            if data is not None:
+                payloads[digest] = data
+    store_payloads(payloads)
+
+
+class PayloadField(models.JSONField):
+    """
+    JSON field of task payload (task_args/task_kwargs), the large payload is compressed or offloaded transparently
+
+    - The JSON not less than `payload_compress_bytes` is stored as `{"$zlib": ...}`
+    - The JSON not less than `payload_offload_bytes` is stored in `utils_task_payload` by its digest, so the same
+      payload of many tasks is stored once, and the field is `{"$blob": <digest>}`. The digest is also set to
+      `digest_field` (an indexed column declared after this field), which refers the payload
+
+    The payloads are offloaded in batch by `offload_payloads` before creating or updating the rows, otherwise one by
+    one when the instance is saved. The value is decoded when loaded, the offloaded payload is read from a cache by
+    digest, `prefetch_payloads` before loading many rows. Defer the field in the queries not using it.
+    """
+
+    def __init__(self, *args, digest_field: str = None, **kwargs):
+        self.digest_field = digest_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.digest_field:
+            kwargs['digest_field'] = self.digest_field
+        return name, path, args, kwargs
+
+    def offload(self, value):
+        """
+        :return: (The value to store, the digest of the offloaded payload, the data to store in `utils_task_payload`)
+        """
+        key = _get_marker_key(value)
+        if key == OFFLOADED_KEY:
+            return value, value[key], None
+        if key or value is None or not payload_offload_bytes:
+            return value, None, None
+        data = json.dumps(value, cls=self.encoder).encode()
+        if len(data) < payload_offload_bytes:
+            return value, None, None
+        digest = hashlib.sha1(data).hexdigest()
+        return {OFFLOADED_KEY: digest}, digest, zlib.compress(data)
+
+    def pre_save(self, model_instance, add):
+        value, digest, data = self.offload(super().pre_save(model_instance, add))
+        if data is not None:
+            store_payloads({digest: data})
+        if self.digest_field:
+            setattr(model_instance, self.digest_field, digest)
+        return value
+
+    def get_prep_value(self, value):
+        # The stored value used in lookups
+        if _get_marker_key(value):
+            return super().get_prep_value(value)
+        prep_value = super().get_prep_value(value)
+        if prep_value is None:
+            return prep_value
+        data = prep_value.encode()
+        if payload_compress_bytes and len(data) >= payload_compress_bytes:
+            compressed = base64.b64encode(zlib.compress(data)).decode()
+            if len(compressed) < len(data):
+                return json.dumps({COMPRESSED_KEY: compressed})
+        return prep_value
+
+    def from_db_value(self, value, expression, connection):
+        value = super().from_db_value(value, expression, connection)
+        key = _get_marker_key(value)
+        if key == COMPRESSED_KEY:
+            return json.loads(zlib.decompress(base64.b64decode(value[key])), cls=self.decoder)
+        if key == OFFLOADED_KEY:
+            prefetch_payloads([value[key]])
+            with _payload_cache_lock:
+                data = _payload_cache.get(value[key])
+                if data is not None:
+                    _payload_cache.move_to_end(value[key])
+            if data is None:
+                from .models import TaskPayload
+                raise TaskPayload.DoesNotExist(f'Task payload {value[key]} does not exist')
+            return json.loads(zlib.decompress(data), cls=self.decoder)
+        return value
@@ -0,0 +1,55 @@
+import datetime
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ..task.constants import TaskStatus
+from ..task.engines import DEFAULT_ARCHIVE_BATCH_SIZE, MySQLTaskEngine, engine
+
+#
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Move the finished/failed tasks from utils_task into utils_task_history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--status', nargs='+', default=[TaskStatus.SUCCESS.value, TaskStatus.FAILED.value],
+            choices=[TaskStatus.SUCCESS.value, TaskStatus.FAILED.value],
+            help='The status of tasks to archive',
+        )
+        parser.add_argument(
+            '--days', type=float, default=7, help='Archive the tasks not updated within the days',
+        )
+        parser.add_argument(
+            '--batch_size', type=int, default=DEFAULT_ARCHIVE_BATCH_SIZE, help='The count of tasks of one batch',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0, help='The seconds to sleep between batches',
+        )
+        parser.add_argument(
+            '--purge_payloads', action='store_true',
+            help='Also delete the offloaded payloads not stored within the days and referred by no task',
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(engine, MySQLTaskEngine):
+            raise CommandError('Only the mysql task engine supports archiving tasks')
+
+        updated_at_lte = datetime.datetime.now() - datetime.timedelta(days=options['days'])
+        logger.info(f'Archive tasks, status: {options["status"]}, updated_at_lte: {updated_at_lte}')
+        archived_task_count = engine.archive_tasks(
+            statuses=options['status'],
+            updated_at_lte=updated_at_lte,
+            batch_size=options['batch_size'],
+            sleep_seconds=options['sleep'],
+        )
+        logger.info(f'Archive tasks end. archived_task_count: {archived_task_count}')
+        self.stdout.write(f'Archived {archived_task_count} tasks')
+
+        if options['purge_payloads']:
+            purged_payload_count = engine.purge_payloads(referenced_at_lte=updated_at_lte,
+                                                         batch_size=options['batch_size'])
+            logger.info(f'Purge task payloads end. purged_payload_count: {purged_payload_count}')
+            self.stdout.write(f'Purged {purged_payload_count} payloads')
@@ -0,0 +1,105 @@
+import datetime
+import logging
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...models import Task, TaskHistory
+from ..task.constants import TaskStatus
+from ..task.engines import DEFAULT_CREATE_CHUNK_SIZE, DEFAULT_WAITING_TASK_COUNT
+
+#
+logger = logging.getLogger(__name__)
+
+# The task name of the rows created by the benchmark, deleted when finished
+BENCH_TASK_NAME = 'benchpoll:task'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the poll latency of waiting tasks as utils_task grows with failed tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000', help='The table sizes to measure, separated by comma',
+        )
+        parser.add_argument(
+            '--waiting', type=int, default=1000, help='The count of waiting tasks, the others are failed',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=200, help='The count of polls of each size',
+        )
+        parser.add_argument(
+            '--archive', action='store_true', help='Measure again after the failed tasks archived',
+        )
+        parser.add_argument(
+            '--explain', action='store_true', help='Print the query plan of the poll',
+        )
+
+    @staticmethod
+    def create_tasks(start, count, status, run_at):
+        for i in range(start, start + count, DEFAULT_CREATE_CHUNK_SIZE):
+            Task.objects.bulk_create([
+                Task(task_name=BENCH_TASK_NAME, task_attr=str(j), run_at=run_at, status=status)
+                for j in range(i, min(i + DEFAULT_CREATE_CHUNK_SIZE, start + count))
+            ])
+
+    @staticmethod
+    def poll_queryset():
+        return Task.objects.filter(
+            status=TaskStatus.WAITING.value, run_at__lte=datetime.datetime.now()
+        ).order_by('-priority', 'run_at')[:DEFAULT_WAITING_TASK_COUNT]
+
+    def measure(self, repeat):
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(self.poll_queryset())
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        return dict(
+            p50=statistics.median(latencies),
+            p99=latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            mean=statistics.mean(latencies),
+        )
+
+    def report(self, label, rows, result):
+        self.stdout.write('{:<10} {:>10} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            label, rows, result['p50'], result['p99'], result['mean']
+        ))
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        waiting = options['waiting']
+        repeat = options['repeat']
+        self.stdout.write(f'Database: {connection.vendor} {connection.settings_dict["NAME"]}, '
+                          f'waiting tasks: {waiting}, polls per size: {repeat}')
+        self.stdout.write('{:<10} {:>10} {:>10} {:>10} {:>10}'.format('', 'rows', 'p50(ms)', 'p99(ms)', 'mean(ms)'))
+
+        now = datetime.datetime.now()
+        try:
+            self.create_tasks(0, waiting, TaskStatus.WAITING.value, now)
+            rows = waiting
+            for size in sizes:
+                if size > rows:
+                    self.create_tasks(rows, size - rows, TaskStatus.FAILED.value, now)
+                    rows = size
+                self.report('grown', rows, self.measure(repeat))
+            if options['explain']:
+                self.stdout.write(self.poll_queryset().explain())
+
+            if options['archive']:
+                archived = self.archive()
+                self.report('archived', rows - archived, self.measure(repeat))
+        finally:
+            Task.objects.filter(task_name=BENCH_TASK_NAME).delete()
+            TaskHistory.objects.filter(task_name=BENCH_TASK_NAME).delete()
+
+    @staticmethod
+    def archive():
+        """
+        Remove the failed tasks of the benchmark from utils_task, the same as archived by `archivetask`
+        """
+        deleted, _ = Task.objects.filter(task_name=BENCH_TASK_NAME, status=TaskStatus.FAILED.value).delete()
+        return deleted
@@ -0,0 +1,160 @@
+import datetime
+import logging
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...models import Task
+from ...task import cron_task
+from ..task import api as taskapi
+from ..task import executor
+from ..task.engines import MySQLTaskEngine, engine
+from ..task.metrics import task_metrics
+from ..task.sharding import get_shard_range
+from ..task.wakeup import task_wakeup
+
+#
+logger = logging.getLogger(__name__)
+
+# The dispatch lag (seconds) of the executed benchmark tasks
+_lags = []
+
+
+@cron_task
+def bench_noop(run_at):
+    _lags.append(time.time() - run_at)
+
+
+@cron_task
+def bench_sleep(run_at, seconds):
+    _lags.append(time.time() - run_at)
+    time.sleep(seconds)
+
+
+BENCH_TASK_FUNCS = dict(noop=bench_noop, sleep=bench_sleep)
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the throughput of the task executor with the mysql task engine (MySQL or SQLite)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tasks', type=int, default=1000, help='The count of tasks of each run',
+        )
+        parser.add_argument(
+            '--kind', default='noop', choices=sorted(BENCH_TASK_FUNCS), help='The task func of the tasks',
+        )
+        parser.add_argument(
+            '--sleep_ms', type=float, default=10, help='The milliseconds slept by each task of kind sleep',
+        )
+        parser.add_argument(
+            '--threads', default='1,4,8', help='The thread counts of each node to measure, separated by comma',
+        )
+        parser.add_argument(
+            '--nodes', default='1,2', help='The counts of nodes (dispatchers polling concurrently) to measure, '
+                                           'separated by comma',
+        )
+        parser.add_argument(
+            '--spread', type=float, default=0,
+            help='Spread the run_at of tasks over the seconds, all tasks are due at once if 0',
+        )
+        parser.add_argument(
+            '--sharding', action='store_true', help='Each node claims only the tasks in its shard range',
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=300, help='Give up a run after the seconds',
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(engine, MySQLTaskEngine):
+            raise CommandError('Only the mysql task engine is benchmarked')
+
+        task_func = BENCH_TASK_FUNCS[options['kind']]
+        thread_counts = [int(count) for count in options['threads'].split(',')]
+        node_counts = [int(count) for count in options['nodes'].split(',')]
+        claim = 'skip locked' if engine.skip_locked and connection.features.has_select_for_update_skip_locked \
+            else 'optimistic lock'
+        self.stdout.write(f'Database: {connection.vendor} {connection.settings_dict["NAME"]}, claim: {claim}, '
+                          f'tasks: {options["tasks"]}, kind: {options["kind"]}, spread: {options["spread"]}s, '
+                          f'sharding: {options["sharding"]}')
+        self.stdout.write('{:>6} {:>8} {:>10} {:>10} {:>12} {:>12} {:>8}'.format(
+            'nodes', 'threads', 'seconds', 'tasks/s', 'lag_p50(ms)', 'lag_p99(ms)', 'wasted'
+        ))
+
+        # The tasks are due before the dispatchers start, and the nodes of the process share one worker id,
+        # their shard ranges are assigned here, not to depend on redis
+        wakeup_enabled, task_wakeup.enabled = task_wakeup.enabled, False
+        sharding_enabled, executor.sharding_enabled = executor.sharding_enabled, False
+        try:
+            for node_count in node_counts:
+                for thread_count in thread_counts:
+                    try:
+                        result = self.run_once(task_func, node_count, thread_count, options)
+                    finally:
+                        Task.objects.filter(task_name=task_func.task_name).delete()
+                    self.stdout.write('{:>6} {:>8} {:>10.3f} {:>10.1f} {:>12.2f} {:>12.2f} {:>8.2%}'.format(
+                        node_count, thread_count, result['seconds'], result['throughput'],
+                        result['lag_p50'], result['lag_p99'], result['wasted']
+                    ))
+        finally:
+            task_wakeup.enabled = wakeup_enabled
+            executor.sharding_enabled = sharding_enabled
+
+    @staticmethod
+    def create_tasks(task_func, count, kind, sleep_ms, spread):
+        now = datetime.datetime.now()
+        tasks = []
+        for i in range(count):
+            run_at = now + datetime.timedelta(seconds=spread * i / count)
+            task_args = [run_at.timestamp()]
+            if kind == 'sleep':
+                task_args.append(sleep_ms / 1000)
+            tasks.append(dict(task_name=task_func.task_name, task_attr=str(i), run_at=run_at, task_args=task_args))
+        taskapi.add_tasks(tasks)
+
+    def run_once(self, task_func, node_count, thread_count, options):
+        """
+        Execute the tasks by `node_count` dispatchers of `thread_count` threads, until all tasks are executed
+        """
+        count = options['tasks']
+        self.create_tasks(task_func, count, options['kind'], options['sleep_ms'], options['spread'])
+        _lags.clear()
+        task_metrics.reset()
+
+        started_at = time.perf_counter()
+        dispatchers = [
+            executor.TaskDispatcher(thread_count, name=f'Task-dispatcher-{i + 1}') for i in range(node_count)
+        ]
+        if options['sharding']:
+            for i, dispatcher in enumerate(dispatchers):
+                dispatcher.shards = get_shard_range(i, node_count, engine.shard_count)
+        for dispatcher in dispatchers:
+            dispatcher.start()
+        try:
+            while len(_lags) < count:
+                if time.perf_counter() - started_at > options['timeout']:
+                    raise CommandError(f'Timeout, executed tasks: {len(_lags)}/{count}')
+                time.sleep(0.01)
+            seconds = time.perf_counter() - started_at
+        finally:
+            for dispatcher in dispatchers:
+                dispatcher.stop()
+            for dispatcher in dispatchers:
+                dispatcher.join()
+
+        # The claims lost to the other nodes
+        contention = task_metrics.snapshot().get(task_func.task_name, {}).get('contention', 0)
+        lags = sorted(lag * 1000 for lag in _lags)
+        return dict(
+            seconds=seconds,
+            throughput=count / seconds,
+            lag_p50=statistics.median(lags),
+            lag_p99=_percentile(lags, 0.99),
+            wasted=contention / (count + contention),
+        )
@@ -1,7 +1,7 @@
 import logging
 import signal
 
-from ..task.executor import run, stop_task_executor
+from ..task.executor import preload_task_funcs, run, run_with_asyncio, run_with_processes, stop_task_executor
 from django.core.management.base import BaseCommand
 
 #
@@ -26,10 +26,31 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument(
-            '--thread_count', default=4, help='The count of thread',
+            '--thread_count', type=int, default=4,
+            help='The count of thread (per worker process in process mode, for sync task funcs in asyncio mode)',
+        )
+        parser.add_argument(
+            '--mode', default='thread', choices=['thread', 'process', 'asyncio'],
+            help='Run tasks on threads, processes or an event loop',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None, help='The count of worker process, default is the count of CPU',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=100, help='The max count of tasks in flight in asyncio mode',
         )
 
     def handle(self, *args, **options):
         thread_count = options['thread_count']
+        # Import before executing, the worker processes inherit the imported task funcs. The tasks of the
+        # unknown task names (such as left by a removed task func) fail when executed, not blocking the others
+        unresolved_task_names = preload_task_funcs()
+        if unresolved_task_names:
+            logger.warning(f'Task func of waiting tasks not found: {", ".join(unresolved_task_names)}')
         register_signal()
-        run(thread_count=thread_count)
+        if options['mode'] == 'process':
+            run_with_processes(worker_count=options['workers'], thread_count=thread_count)
+        elif options['mode'] == 'asyncio':
+            run_with_asyncio(concurrency=options['concurrency'], thread_count=thread_count)
+        else:
+            run(thread_count=thread_count)
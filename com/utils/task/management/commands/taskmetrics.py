@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from ..task.metrics import (
+    DURATION_BUCKETS, LAG_BUCKETS, estimate_quantile, merge_snapshots, render_prometheus, task_metrics,
+)
+
+
+def _format_seconds(value):
+    return '-' if value is None else '{:.3f}'.format(value)
+
+
+class Command(BaseCommand):
+    help = 'Show the lag, run time and results of tasks by task name, merged from the metrics of all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prometheus', action='store_true', help='Output in the Prometheus text format',
+        )
+
+    def handle(self, *args, **options):
+        snapshots = task_metrics.collect()
+        if options['prometheus']:
+            self.stdout.write(render_prometheus(snapshots), ending='')
+            return
+        snapshot = merge_snapshots(snapshots.values())
+        if not snapshot:
+            self.stdout.write('No task metrics, the executors export them every heartbeat')
+            return
+
+        header = ('task_name', 'success', 'failure', 'retry', 'contention',
+                  'lag_p50', 'lag_p99', 'duration_p50', 'duration_p99')
+        rows = []
+        for task_name, metrics in sorted(snapshot.items()):
+            rows.append((
+                task_name, metrics['success'], metrics['failure'], metrics['retry'], metrics['contention'],
+                *(_format_seconds(estimate_quantile(metrics['lag'], LAG_BUCKETS, q)) for q in (0.5, 0.99)),
+                *(_format_seconds(estimate_quantile(metrics['duration'], DURATION_BUCKETS, q)) for q in (0.5, 0.99)),
+            ))
+        widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+        for row in [header] + rows:
+            self.stdout.write('  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip())
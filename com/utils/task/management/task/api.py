@@ -1,15 +1,18 @@
 import datetime
 import logging
 
-from utils.exceptions import DuplicateEntryForMySQL
-from ...constants import TaskStatus
-from .engines import engine
+from utils.exceptions import DuplicateTask
+from .constants import DEFAULT_TASK_PRIORITY, TaskStatus, UpsertResult
+from .engines import DEFAULT_CREATE_CHUNK_SIZE, engine
+from .groups import GROUP_CALLBACK_RUN_AT, GROUP_EXTRA_KEY, get_group, task_groups
+from .wakeup import task_wakeup
 
 #
 logger = logging.getLogger(__name__)
 
 
-def add_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None, extra=None, remark=None):
+def add_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None, extra=None, remark=None,
+             priority=DEFAULT_TASK_PRIORITY, max_concurrency=None):
     """
     Add new task
     :param task_name:
@@ -19,6 +22,8 @@ def add_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None, ext
     :param task_kwargs:
     :param extra:
     :param remark:
+    :param priority: The higher priority task is claimed first
+    :param max_concurrency: The max count of running tasks of the task name, no limit if None
     :return:
     """
     logger.info(f'Add task, task_name:{task_name}, task_attr:{task_attr}, run_at:{run_at}, '
@@ -36,17 +41,59 @@ def add_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None, ext
             task_args=task_args or [],
             task_kwargs=task_kwargs or {},
             extra=extra or {},
-            remark=remark
+            remark=remark,
+            priority=priority,
+            max_concurrency=max_concurrency
         )
-    except Exception as e:
-        if e.args and isinstance(e.args, tuple) and e.args[0] == DuplicateEntryForMySQL.code:
-            logger.warning('Add task failed, task already exists')
-        else:
-            logger.exception('Add task error')
+    except DuplicateTask:
+        logger.warning('Add task failed, task already exists')
+    except Exception as _:
+        logger.exception('Add task error')
     else:
+        task_wakeup.notify(run_at)
         logger.info(f'Add task successfully. {task.to_dict()}')
 
 
+def add_tasks(tasks: list, chunk_size=None):
+    """
+    Add new tasks in bulk, the existing tasks are skipped
+    :param tasks: [{task_name, task_attr, run_at, task_args, task_kwargs, extra, remark, priority,
+        max_concurrency}, ...]
+    :param chunk_size: The count of tasks of one INSERT
+    :return: The count of inserted and skipped tasks
+    """
+    logger.info(f'Add tasks, count: {len(tasks)}')
+    if not tasks:
+        return 0, 0
+
+    status = TaskStatus.WAITING.value
+    now = datetime.datetime.now()
+    tasks = [
+        dict(
+            task_name=task['task_name'],
+            task_attr=task['task_attr'],
+            # If not set run_at, task will run immediately
+            run_at=task.get('run_at') or now,
+            status=status,
+            task_args=task.get('task_args') or [],
+            task_kwargs=task.get('task_kwargs') or {},
+            extra=task.get('extra') or {},
+            remark=task.get('remark'),
+            priority=task.get('priority', DEFAULT_TASK_PRIORITY),
+            max_concurrency=task.get('max_concurrency'),
+        ) for task in tasks
+    ]
+    try:
+        inserted, skipped = engine.create_tasks(tasks, chunk_size=chunk_size or DEFAULT_CREATE_CHUNK_SIZE)
+    except Exception as _:
+        logger.exception('Add tasks error')
+        raise
+    if inserted:
+        task_wakeup.notify(min(task['run_at'] for task in tasks))
+    logger.info(f'Add tasks successfully. inserted: {inserted}, skipped: {skipped}')
+    return inserted, skipped
+
+
 def update_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None, extra=None, remark=None):
     """
     Update an eixsting task
@@ -81,16 +128,145 @@ def update_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None,
         filter_kwargs=filter_kwargs,
         update_kwargs=update_kwargs
     )
+    if updated_task_count and run_at:
+        task_wakeup.notify(run_at)
     logger.info(f'Update task end. updated_task_count:{updated_task_count}')
 
 
+def upsert_task(task_name, task_attr, run_at, task_args=None, task_kwargs=None, extra=None, remark=None,
+                priority=DEFAULT_TASK_PRIORITY, max_concurrency=None):
+    """
+    Add new task, or update it if it exists and its status is `waiting`
+
+    The fields with value None are not updated
+    :param task_name:
+    :param task_attr:
+    :param run_at:
+    :param task_args:
+    :param task_kwargs:
+    :param extra:
+    :param remark:
+    :param priority:
+    :param max_concurrency:
+    :return: UpsertResult, SKIPPED if the task exists but is not waiting
+    """
+    logger.info(f'Upsert task, task_name:{task_name}, task_attr:{task_attr}, run_at:{run_at}, '
+                f'task_args:{task_args}, task_kwargs:{task_kwargs}, extra:{extra}, remark:{remark}')
+    # If not set run_at, task will run immediately
+    if not run_at:
+        run_at = datetime.datetime.now()
+    update_fields = ['run_at']
+    for key, value in dict(extra=extra, remark=remark, task_args=task_args, task_kwargs=task_kwargs).items():
+        if value is not None:
+            update_fields.append(key)
+
+    result = engine.upsert_task(
+        task_name,
+        task_attr,
+        update_fields=update_fields,
+        run_at=run_at,
+        status=TaskStatus.WAITING.value,
+        task_args=task_args or [],
+        task_kwargs=task_kwargs or {},
+        extra=extra or {},
+        remark=remark,
+        priority=priority,
+        max_concurrency=max_concurrency
+    )
+    if result != UpsertResult.SKIPPED:
+        task_wakeup.notify(run_at)
+    logger.info(f'Upsert task end. result:{result.name}')
+    return result
+
+
+def add_group(tasks: list, callback: dict, chunk_size=None):
+    """
+    Add the member tasks of a group and its callback task, the callback task runs once after all the members
+    finished (successful or failed)
+
+    The group is identified by the callback task. The callback task waits until the last member finished,
+    then runs as the other tasks. The member retried by returning a datetime is not finished.
+    :param tasks: The member tasks, the same as `add_tasks`
+    :param callback: {task_name, task_attr, task_args, task_kwargs, extra, remark, priority, max_concurrency}
+    :param chunk_size: The count of tasks of one INSERT
+    :return: The count of inserted and skipped member tasks
+    """
+    group = (callback['task_name'], callback['task_attr'])
+    logger.info(f'Add group, group: {group}, member count: {len(tasks)}')
+    try:
+        engine.create_task(
+            callback['task_name'],
+            callback['task_attr'],
+            run_at=GROUP_CALLBACK_RUN_AT,
+            status=TaskStatus.WAITING.value,
+            task_args=callback.get('task_args') or [],
+            task_kwargs=callback.get('task_kwargs') or {},
+            extra=callback.get('extra') or {},
+            remark=callback.get('remark'),
+            priority=callback.get('priority', DEFAULT_TASK_PRIORITY),
+            max_concurrency=callback.get('max_concurrency'),
+        )
+    except DuplicateTask:
+        logger.warning('Add group failed, group already exists')
+        return 0, len(tasks)
+
+    try:
+        now = datetime.datetime.now()
+        task_groups.start(group, len(tasks), last_run_at=max([task.get('run_at') or now for task in tasks] or [now]))
+        tasks = [dict(task, extra={**(task.get('extra') or {}), GROUP_EXTRA_KEY: list(group)}) for task in tasks]
+        inserted, skipped = add_tasks(tasks, chunk_size=chunk_size) if tasks else (0, 0)
+    except Exception as _:
+        # The callback task never runs without the counter, the members added finish no group
+        logger.exception('Add group error, delete the callback task')
+        engine.delete_task(*group)
+        raise
+    # The skipped members (already exist) are not of the group
+    if task_groups.skip(group, skipped):
+        run_group_callback(group)
+    logger.info(f'Add group successfully. inserted: {inserted}, skipped: {skipped}')
+    return inserted, skipped
+
+
+def run_group_callback(group):
+    """
+    Set the callback task of the finished group to run now
+    """
+    task_name, task_attr = group
+    now = datetime.datetime.now()
+    updated_task_count = engine.update_task(
+        task_name, task_attr,
+        filter_kwargs=dict(status=TaskStatus.WAITING.value),
+        update_kwargs=dict(run_at=now)
+    )
+    if updated_task_count:
+        task_wakeup.notify(now)
+    logger.info(f'Run group callback, group: {group}, updated_task_count: {updated_task_count}')
+
+
+def finish_group_member(task):
+    """
+    Count down the group of the finished member task, run the callback task after the last member finished
+    """
+    group = get_group(task)
+    if group is None:
+        return
+    try:
+        if task_groups.finish(group, task):
+            run_group_callback(group)
+    except Exception as _:
+        logger.exception(f'Finish group member failed. task_id: {task.pk}, group: {group}')
+
+
 def cancel_task(task_name, task_attr):
     """
-    Cancel task
+    Cancel task, the canceled member finishes its group
     :param task_name:
     :param task_attr:
     :return:
     """
     logger.info(f'Cancel task, task_name:{task_name}, task_attr:{task_attr}')
-    canceled, canceled_task_count = engine.delete_task(task_name=task_name, task_attr=task_attr)
-    logger.info(f'Cancel task successfully, canceled:{canceled}, canceled_task_count:{canceled_task_count}')
+    # The deleted task comes with its extra, no extra round trip to find its group
+    task = engine.cancel_task(task_name=task_name, task_attr=task_attr)
+    if task is not None:
+        finish_group_member(task)
+    logger.info(f'Cancel task successfully, canceled:{task is not None}')
@@ -0,0 +1,148 @@
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+
+from .engines import DEFAULT_LEASE_SECONDS, get_worker_id, task_conf
+
+# KEYS: slots
+# ARGV: now, max_concurrency, token, expires_at, key_ex
+# Drop the expired slots, and take a slot if the running tasks are less than max_concurrency
+ACQUIRE_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if not redis.call('ZSCORE', KEYS[1], ARGV[3]) and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+# KEYS: slots
+# ARGV: token
+RELEASE_SLOT_SCRIPT = """
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+# KEYS: slots, ...
+# ARGV: expires_at, key_ex, token, ...
+# Renew the slots still held, the i-th token is in the i-th slots
+RENEW_SLOTS_SCRIPT = """
+local renewed = 0
+for i, key in ipairs(KEYS) do
+    renewed = renewed + redis.call('ZADD', key, 'XX', 'CH', ARGV[1], ARGV[i + 2])
+    redis.call('EXPIRE', key, ARGV[2])
+end
+return renewed
+"""
+
+
+class ConcurrencyLimiter:
+    """
+    Limit the count of running tasks of each task name across workers
+
+    The running tasks of a task name hold the slots in the sorted set `task:concurrency:<task_name>`, scored by
+    the expiry of each slot. The slots are renewed by the heartbeat, so the slots of crashed workers expire
+    like the leases of their tasks.
+
+    The task name failed to take a slot is saturated for `hold_seconds` or until a slot of it is released by
+    current process, the claims of current process skip the saturated task names.
+    """
+
+    def __init__(self, client=None, slot_seconds: int = DEFAULT_LEASE_SECONDS, hold_seconds: float = 1):
+        self._client = client
+        self.slot_seconds = slot_seconds
+        self.hold_seconds = hold_seconds
+        # The saturated task names {task_name: held until (monotonic)}
+        self._saturated = {}
+        # The slots held by current process {token: key}
+        self._slots = {}
+        self._lock = Lock()
+        self._acquire_slot = None
+        self._release_slot = None
+        self._renew_slots = None
+
+    def _register_scripts(self):
+        """
+        Register the scripts on first use, the client is `utils.caches.cache` by default
+        """
+        if self._acquire_slot is not None:
+            return
+        client = self._client
+        if client is None:
+            from utils.caches import cache as client
+        self._acquire_slot = client.register_script(ACQUIRE_SLOT_SCRIPT)
+        self._release_slot = client.register_script(RELEASE_SLOT_SCRIPT)
+        self._renew_slots = client.register_script(RENEW_SLOTS_SCRIPT)
+
+    @staticmethod
+    def _make_key(task_name):
+        return 'task:concurrency:{}'.format(task_name)
+
+    @staticmethod
+    def _make_token(task):
+        return '{}:{}'.format(get_worker_id(), task.pk)
+
+    def _expires_at(self, now: datetime):
+        return '{:.6f}'.format((now + timedelta(seconds=self.slot_seconds)).timestamp())
+
+    def acquire(self, task):
+        """
+        Take a slot for the task, always True if the task has no max_concurrency
+        """
+        if not task.max_concurrency:
+            return True
+        self._register_scripts()
+        now = datetime.now()
+        key, token = self._make_key(task.task_name), self._make_token(task)
+        acquired = self._acquire_slot(
+            keys=[key],
+            args=['{:.6f}'.format(now.timestamp()), task.max_concurrency, token, self._expires_at(now),
+                  self.slot_seconds * 2]
+        )
+        with self._lock:
+            if acquired:
+                self._slots[token] = key
+            else:
+                self._saturated[task.task_name] = time.monotonic() + self.hold_seconds
+        return bool(acquired)
+
+    def saturated_task_names(self):
+        """
+        The task names not to claim
+        """
+        now = time.monotonic()
+        with self._lock:
+            for task_name in [task_name for task_name, until in self._saturated.items() if until <= now]:
+                del self._saturated[task_name]
+            return list(self._saturated)
+
+    def release(self, task):
+        """
+        Give back the slot of the task if held
+        """
+        token = self._make_token(task)
+        with self._lock:
+            key = self._slots.pop(token, None)
+        if key is not None:
+            self._release_slot(keys=[key], args=[token])
+            with self._lock:
+                self._saturated.pop(task.task_name, None)
+
+    def renew(self):
+        """
+        Renew the slots held by current process, called by the heartbeat
+        """
+        with self._lock:
+            slots = list(self._slots.items())
+        if not slots:
+            return 0
+        return self._renew_slots(
+            keys=[key for _, key in slots],
+            args=[self._expires_at(datetime.now()), self.slot_seconds * 2] + [token for token, _ in slots]
+        )
+
+
+concurrency_limiter = ConcurrencyLimiter(
+    slot_seconds=task_conf.get('lease_seconds', DEFAULT_LEASE_SECONDS),
+    hold_seconds=task_conf.get('concurrency_defer_seconds', 1),
+)
@@ -1,4 +1,7 @@
-from enum import Enum
+from enum import Enum, IntEnum
+
+# The priority of task, the higher priority task is claimed first
+DEFAULT_TASK_PRIORITY = 0
 
 
 class TaskStatus(Enum):
@@ -7,3 +10,10 @@ class TaskStatus(Enum):
     RUNNING = 'running'
     SUCCESS = 'success'
     FAILED = 'failed'
+
+
+class UpsertResult(IntEnum):
+    # The task exists but is not waiting, nothing is written
+    SKIPPED = 0
+    INSERTED = 1
+    UPDATED = 2
@@ -1,11 +1,55 @@
-from datetime import datetime
-from django.db.models import F
+import functools
+import operator
+import os
+import socket
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
 
-from ...models import Task
-from .constants import TaskStatus
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+
+from ...fields import offload_payloads, prefetch_payloads
+from ...models import Task, TaskHistory, TaskPayload
+from .constants import TaskStatus, UpsertResult
+from .metrics import task_metrics
+from utils.exceptions import DuplicateEntryForMySQL, DuplicateTask
+from utils.serializers import json_decode, json_encode
 
 #
 DEFAULT_WAITING_TASK_COUNT = 20
+# The count of rows of one INSERT when creating tasks in bulk
+DEFAULT_CREATE_CHUNK_SIZE = 1000
+# The count of rows moved by one batch when archiving tasks
+DEFAULT_ARCHIVE_BATCH_SIZE = 1000
+# The lease of claimed tasks, renewed by the heartbeat of the worker
+DEFAULT_LEASE_SECONDS = 60
+# The expired task is failed after claimed so many times
+DEFAULT_MAX_ATTEMPTS = 3
+# The exc_info of the task failed by lease expired
+LEASE_EXPIRED_EXC_INFO = 'Lease expired, the worker may be crashed'
+# The count of shards of tasks, the shard of task is `crc32(task_name:task_attr) % shard_count`
+DEFAULT_SHARD_COUNT = 64
+
+# Task config
+task_conf = getattr(settings, 'TASK_CONF', {})
+
+# Worker id of current process {pid: worker_id}
+_worker_ids = {}
+
+
+def get_worker_id():
+    """
+    Get the worker id of current process, such as: `hostname:pid:suffix`
+
+    The worker id is regenerated after fork
+    """
+    pid = os.getpid()
+    if pid not in _worker_ids:
+        _worker_ids[pid] = '{}:{}:{}'.format(socket.gethostname(), pid, uuid.uuid4().hex[:8])
+    return _worker_ids[pid]
 
 
 class TaskEngine:
@@ -18,6 +62,14 @@ class TaskEngine:
         """
         pass
 
+    def create_tasks(self, *args, **kwargs):
+        """
+        Create new tasks in bulk
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
     def update_task(self, *args, **kwargs):
         """
         Update task
@@ -26,6 +78,22 @@ class TaskEngine:
         :return:
         """
 
+    def upsert_task(self, *args, **kwargs):
+        """
+        Create task, or update it if it exists and is waiting
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def get_task(self, *args, **kwargs):
+        """
+        Get task by task_name and task_attr
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
     def delete_task(self, *args, **kwargs):
         """
         Delete task
@@ -34,6 +102,22 @@ class TaskEngine:
         :return:
         """
 
+    def cancel_task(self, *args, **kwargs):
+        """
+        Delete task, return the deleted task with its extra, None if not exists
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def get_waiting_task_names(self, *args, **kwargs):
+        """
+        Get the distinct task names of waiting tasks
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
     def get_waiting_tasks(self, *args, **kwargs):
         """
         Get waiting task
@@ -42,6 +126,46 @@ class TaskEngine:
         :return:
         """
 
+    def get_task_payload(self, *args, **kwargs):
+        """
+        Get the task_args and task_kwargs of the claimed task
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def run_task(self, *args, **kwargs):
+        """
+        Set the claimed task running
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def delete_tasks(self, *args, **kwargs):
+        """
+        Delete the completed tasks by (id, version)
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def defer_task(self, *args, **kwargs):
+        """
+        Set the claimed task waiting again with a later run_at, it's not executed
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def reschedule_task(self, *args, **kwargs):
+        """
+        Set the running recurring task waiting for the next firing
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
     def retry_task(self, *args, **kwargs):
         """
         Retry task
@@ -50,6 +174,54 @@ class TaskEngine:
         :return:
         """
 
+    def fail_task(self, *args, **kwargs):
+        """
+        Set task failed
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def release_tasks(self, *args, **kwargs):
+        """
+        Release the claimed tasks, set them waiting
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def renew_leases(self, *args, **kwargs):
+        """
+        Renew the leases of the tasks claimed by current worker
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def reap_tasks(self, *args, **kwargs):
+        """
+        Set the pending/running tasks with expired lease waiting, or failed after max attempts
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def archive_tasks(self, *args, **kwargs):
+        """
+        Move the finished/failed tasks into the history
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
+    def purge_payloads(self, *args, **kwargs):
+        """
+        Delete the offloaded payloads referred by no task
+        :param args:
+        :param kwargs:
+        :return:
+        """
+
 
 class MySQLTaskEngine(TaskEngine):
     """
@@ -68,12 +240,72 @@ class MySQLTaskEngine(TaskEngine):
     - success -> [DELETED]
     - failed -> [DELETED]
 
+    Waiting tasks are claimed by `SELECT ... FOR UPDATE SKIP LOCKED` if the database supports it,
+    otherwise by the optimistic lock of `version`.
+
+    Each claim carries the worker id and a lease, the pending/running tasks whose lease expired
+    are reaped by `reap_tasks`:
+
+    - pending/running -> waiting[LEASE EXPIRED]
+    - pending/running -> failed[LEASE EXPIRED, MAX ATTEMPTS]
     """
 
+    # The payload of tasks is not loaded by the poll
+    payload_fields = ('task_args', 'task_kwargs')
+
+    def __init__(self, skip_locked: bool = True, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                 shard_count: int = DEFAULT_SHARD_COUNT):
+        self.skip_locked = skip_locked
+        self.lease_seconds = lease_seconds
+        self.shard_count = shard_count
+
+    def make_shard(self, task_name, task_attr):
+        """
+        The shard of task, stable across processes and hosts
+        """
+        return zlib.crc32('{}:{}'.format(task_name, task_attr).encode()) % self.shard_count
+
     def create_task(self, task_name, task_attr, **kwargs):
-        task = Task.objects.create(task_name=task_name, task_attr=task_attr, **kwargs)
+        try:
+            task = Task.objects.create(task_name=task_name, task_attr=task_attr,
+                                       shard=self.make_shard(task_name, task_attr), **kwargs)
+        except IntegrityError as e:
+            if e.args and e.args[0] == DuplicateEntryForMySQL.code:
+                raise DuplicateTask(task_name, task_attr) from e
+            raise
         return task
 
+    def create_tasks(self, tasks: list, chunk_size: int = DEFAULT_CREATE_CHUNK_SIZE):
+        """
+        Create tasks by one multi-row INSERT per chunk, the existing tasks are skipped
+
+        :param tasks: [{task_name, task_attr, run_at, status, task_args, ...}, ...]
+        :param chunk_size:
+        :return: The count of inserted and skipped tasks
+        """
+        inserted = 0
+        for i in range(0, len(tasks), chunk_size):
+            # {(task_name, task_attr): task}, the duplicate tasks in the chunk are skipped
+            chunk = {}
+            # The payloads of the chunk are offloaded by one batch
+            rows = [dict(kwargs) for kwargs in tasks[i:i + chunk_size]]
+            offload_payloads(Task, rows)
+            for kwargs in rows:
+                task = Task(shard=self.make_shard(kwargs['task_name'], kwargs['task_attr']), **kwargs)
+                chunk.setdefault((task.task_name, task.task_attr), task)
+            Task.objects.bulk_create(chunk.values(), ignore_conflicts=True)
+
+            # The rows inserted by this chunk have the same trace_id as the chunk
+            rows = Task.objects.filter(
+                task_name__in={task_name for task_name, _ in chunk},
+                task_attr__in={task_attr for _, task_attr in chunk},
+            ).values_list('task_name', 'task_attr', 'trace_id')
+            for task_name, task_attr, trace_id in rows:
+                task = chunk.get((task_name, task_attr))
+                if task is not None and task.trace_id == trace_id:
+                    inserted += 1
+        return inserted, len(tasks) - inserted
+
     def update_task(self, task_name, task_attr, filter_kwargs: dict = None, update_kwargs: dict = None):
         if not filter_kwargs:
             filter_kwargs = dict(task_name=task_name, task_attr=task_attr)
@@ -83,22 +315,154 @@ class MySQLTaskEngine(TaskEngine):
         if not update_kwargs:
             update_kwargs = {}
         update_kwargs.update(updated_at=datetime.now())
+        offload_payloads(Task, [update_kwargs])
 
         rows = Task.objects.filter(**filter_kwargs).update(**update_kwargs)
         return rows
 
+    def upsert_task(self, task_name, task_attr, update_fields: list, **kwargs):
+        """
+        Create task, or update the `update_fields` of it if it exists and is waiting, by one
+        `INSERT ... ON DUPLICATE KEY UPDATE`
+
+        :return: UpsertResult
+        """
+        task = Task(task_name=task_name, task_attr=task_attr, shard=self.make_shard(task_name, task_attr), **kwargs)
+        # The digest of the offloaded payload is updated with it
+        update_fields = list(update_fields) + [
+            Task._meta.get_field(name).digest_field for name in update_fields if name in self.payload_fields
+        ]
+        fields = [field for field in Task._meta.concrete_fields if not field.primary_key]
+        quote_name = connection.ops.quote_name
+        table = quote_name(Task._meta.db_table)
+        status = '{}.{}'.format(table, quote_name('status'))
+        # `VALUES(column)` is deprecated since MySQL 8.0.20, the row alias replaces it since 8.0.19,
+        # MariaDB and the older MySQL only support `VALUES(column)`
+        if not connection.mysql_is_mariadb and connection.mysql_version >= (8, 0, 19):
+            row_alias = ' AS new_task'
+            inserted_value = 'new_task.{}'.format
+        else:
+            row_alias = ''
+            inserted_value = 'VALUES({})'.format
+        # The assignments refer to the current status, status itself is never updated
+        assignments = [
+            '{column} = IF({status} = %s, {value}, {column})'.format(
+                column=column, status=status, value=inserted_value(column)
+            ) for column in (quote_name(Task._meta.get_field(name).column) for name in update_fields + ['updated_at'])
+        ]
+        # The insert id is reset to 0 if the task is not waiting, to tell it from an inserted one. The affected rows
+        # are 1 both for them, as the connection is opened with CLIENT_FOUND_ROWS
+        assignments.append('{pk} = IF({status} = %s, {pk}, {pk} + LAST_INSERT_ID(0))'.format(
+            pk=quote_name(Task._meta.pk.column), status=status
+        ))
+        sql = 'INSERT INTO {table} ({columns}) VALUES ({placeholders}){row_alias} ON DUPLICATE KEY UPDATE ' \
+              '{assignments}'.format(
+                  table=table,
+                  columns=', '.join(quote_name(field.column) for field in fields),
+                  placeholders=', '.join(['%s'] * len(fields)),
+                  row_alias=row_alias,
+                  assignments=', '.join(assignments),
+              )
+        values = [field.get_db_prep_save(field.pre_save(task, add=True), connection) for field in fields]
+        params = values + [TaskStatus.WAITING.value] * len(assignments)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.rowcount == 2:
+                return UpsertResult.UPDATED
+            return UpsertResult.INSERTED if cursor.lastrowid else UpsertResult.SKIPPED
+
+    def get_task(self, task_name, task_attr):
+        return Task.objects.filter(task_name=task_name, task_attr=task_attr).defer(*self.payload_fields).first()
+
     def delete_task(self, task_name, task_attr):
         deleted, rows = Task.objects.filter(task_name=task_name, task_attr=task_attr).delete()
         return deleted, rows
 
-    def get_waiting_tasks(self):
+    def cancel_task(self, task_name, task_attr):
+        with transaction.atomic():
+            task = Task.objects.select_for_update().filter(
+                task_name=task_name, task_attr=task_attr
+            ).only('id', 'task_name', 'task_attr', 'extra').first()
+            if task is None:
+                return None
+            Task.objects.filter(pk=task.pk).delete()
+        return task
+
+    def get_waiting_task_names(self):
+        # A loose index scan of (status, task_name), reading one entry per task name
+        return set(
+            Task.objects.filter(status=TaskStatus.WAITING.value).values_list('task_name', flat=True).distinct()
+        )
+
+    def get_waiting_tasks(self, count: int = DEFAULT_WAITING_TASK_COUNT, run_at_lte: datetime = None,
+                          shards: tuple = None, exclude_task_names: list = None):
+        """
+        Claim the waiting tasks whose run_at <= `run_at_lte`(default now), set them pending
+
+        :param shards: Only claim the tasks in the shard range `[start, end)`, the end None is unbounded
+        :param exclude_task_names: Not claim the tasks of the task names, such as the ones reached max concurrency
+        """
+        if self.skip_locked and connection.features.has_select_for_update_skip_locked:
+            return self._claim_waiting_tasks(count, run_at_lte, shards, exclude_task_names)
+        return self._get_waiting_tasks_with_version(count, run_at_lte, shards, exclude_task_names)
+
+    @staticmethod
+    def _shard_filter(shards):
+        if shards is None:
+            return {}
+        start, end = shards
+        filter_kwargs = dict(shard__gte=start)
+        if end is not None:
+            filter_kwargs.update(shard__lt=end)
+        return filter_kwargs
+
+    def _claim_waiting_tasks(self, count, run_at_lte=None, shards=None, exclude_task_names=None):
+        """
+        Lock a batch of waiting tasks and set them pending in one transaction
+
+        Rows locked by other workers are skipped, so concurrent workers get disjoint batches.
+        """
+        now = datetime.now()
+        worker_id = get_worker_id()
+        with transaction.atomic():
+            waiting_tasks = list(
+                Task.objects.select_for_update(skip_locked=True).filter(
+                    status=TaskStatus.WAITING.value,
+                    run_at__lte=run_at_lte or now,
+                    **self._shard_filter(shards),
+                ).exclude(
+                    task_name__in=exclude_task_names or []
+                ).defer(*self.payload_fields).order_by('-priority', 'run_at')[:count]
+            )
+            if not waiting_tasks:
+                return waiting_tasks
+
+            Task.objects.filter(pk__in=[task.pk for task in waiting_tasks]).update(
+                status=TaskStatus.PENDING.value,
+                worker_id=worker_id,
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                attempts=F('attempts') + 1,
+                version=F('version') + 1,
+                updated_at=now,
+            )
+
+        for task in waiting_tasks:
+            self._set_pending(task, worker_id, now, self.lease_seconds)
+        return waiting_tasks
+
+    def _get_waiting_tasks_with_version(self, count, run_at_lte=None, shards=None, exclude_task_names=None):
         # Waiting tasks
         waiting_tasks = []
 
+        now = datetime.now()
+        worker_id = get_worker_id()
         task_set = Task.objects.filter(
             status=TaskStatus.WAITING.value,
-            run_at__lte=datetime.now(),
-        ).order_by('run_at')[:DEFAULT_WAITING_TASK_COUNT]
+            run_at__lte=run_at_lte or now,
+            **self._shard_filter(shards),
+        ).exclude(
+            task_name__in=exclude_task_names or []
+        ).defer(*self.payload_fields).order_by('-priority', 'run_at')[:count]
 
         # Add optimistic lock
         for task in task_set:
@@ -106,21 +470,816 @@ class MySQLTaskEngine(TaskEngine):
                 pk=task.pk, status=TaskStatus.WAITING.value, version=task.version
             ).update(
                 status=TaskStatus.PENDING.value,
+                worker_id=worker_id,
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                attempts=F('attempts') + 1,
                 version=F('version') + 1,
-                updated_at=datetime.now(),
+                updated_at=now,
             )
             if bool(rows):
+                self._set_pending(task, worker_id, now, self.lease_seconds)
                 waiting_tasks.append(task)
+            else:
+                # Claimed by another worker first
+                task_metrics.incr(task.task_name, 'contention')
 
         return waiting_tasks
 
-    def retry_task(self, task_id, next_run_at, **kwargs):
-        Task.objects.filter(pk=task_id, status=TaskStatus.RUNNING.value).update(
+    @staticmethod
+    def _set_pending(task, worker_id, now, lease_seconds):
+        """
+        Keep the claimed task the same as the updated row
+        """
+        task.status = TaskStatus.PENDING.value
+        task.worker_id = worker_id
+        task.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        task.attempts += 1
+        task.version += 1
+        task.updated_at = now
+
+    def get_task_payload(self, task):
+        """
+        Get the task_args and task_kwargs deferred by the poll, by one query when the task is executed
+        """
+        if not task.get_deferred_fields():
+            return task.task_args, task.task_kwargs
+        # The offloaded payloads are loaded by one query if not cached
+        prefetch_payloads([task.task_args_digest, task.task_kwargs_digest])
+        return Task.objects.filter(pk=task.pk).values_list(*self.payload_fields).get()
+
+    def run_task(self, task):
+        """
+        Set the pending task running, keyed by pk and version
+
+        Return False if the task is not pending or claimed again, maybe it's canceled
+        """
+        now = datetime.now()
+        rows = Task.objects.filter(pk=task.pk, version=task.version, status=TaskStatus.PENDING.value).update(
+            status=TaskStatus.RUNNING.value,
+            version=F('version') + 1,
+            updated_at=now,
+        )
+        if not rows:
+            return False
+        task.status = TaskStatus.RUNNING.value
+        task.version += 1
+        task.updated_at = now
+        return True
+
+    def delete_tasks(self, task_keys: list):
+        """
+        Delete the running tasks by one `DELETE ... WHERE (id = ... AND version = ...) OR ...`
+
+        :param task_keys: [(id, version), ...], the task reaped and claimed again has a new version, it's not deleted
+        """
+        if not task_keys:
+            return 0
+        key_filter = functools.reduce(operator.or_, (Q(pk=pk, version=version) for pk, version in task_keys))
+        deleted, rows = Task.objects.filter(key_filter, status=TaskStatus.RUNNING.value).delete()
+        return deleted
+
+    def defer_task(self, task, run_at):
+        rows = Task.objects.filter(pk=task.pk, version=task.version, status=TaskStatus.PENDING.value).update(
+            status=TaskStatus.WAITING.value,
+            run_at=run_at,
+            worker_id=None,
+            lease_expires_at=None,
+            attempts=F('attempts') - 1,
+            updated_at=datetime.now(),
+        )
+        return rows
+
+    def reschedule_task(self, task, run_at, exc_info=None):
+        """
+        Advance run_at of the recurring task by one narrow UPDATE, keyed by pk and version
+        """
+        rows = Task.objects.filter(pk=task.pk, version=task.version, status=TaskStatus.RUNNING.value).update(
+            status=TaskStatus.WAITING.value,
+            run_at=run_at,
+            worker_id=None,
+            lease_expires_at=None,
+            attempts=0,
+            exc_info=exc_info,
+            updated_at=datetime.now(),
+        )
+        return rows
+
+    def retry_task(self, task, next_run_at, **kwargs):
+        """
+        Set the running task waiting again, keyed by pk and version
+        """
+        return Task.objects.filter(pk=task.pk, version=task.version, status=TaskStatus.RUNNING.value).update(
             status=TaskStatus.WAITING.value,
             run_at=next_run_at,
+            worker_id=None,
+            lease_expires_at=None,
+            attempts=0,
             updated_at=datetime.now(),
             **kwargs
         )
 
+    def fail_task(self, task, exc_info):
+        # The task may be reaped and claimed by another worker
+        Task.objects.filter(pk=task.pk, version=task.version).update(
+            status=TaskStatus.FAILED.value,
+            exc_info=exc_info,
+            lease_expires_at=None,
+            updated_at=datetime.now(),
+        )
+
+    def release_tasks(self, tasks):
+        rows = Task.objects.filter(
+            pk__in=[task.pk for task in tasks], status=TaskStatus.PENDING.value, worker_id=get_worker_id()
+        ).update(
+            status=TaskStatus.WAITING.value,
+            worker_id=None,
+            lease_expires_at=None,
+            # The released tasks are not executed
+            attempts=F('attempts') - 1,
+            updated_at=datetime.now(),
+        )
+        return rows
+
+    def renew_leases(self):
+        now = datetime.now()
+        rows = Task.objects.filter(
+            status__in=[TaskStatus.PENDING.value, TaskStatus.RUNNING.value], worker_id=get_worker_id()
+        ).update(lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+        return rows
+
+    def reap_tasks(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """
+        Reap the tasks whose lease expired, by the index of (status, lease_expires_at)
+
+        :return: The count of tasks set waiting, and the tasks set failed (task_name, task_attr and extra loaded)
+        """
+        now = datetime.now()
+        expired_tasks = Task.objects.filter(
+            status__in=[TaskStatus.PENDING.value, TaskStatus.RUNNING.value], lease_expires_at__lt=now
+        )
+        with transaction.atomic():
+            failed_tasks = list(
+                expired_tasks.filter(attempts__gte=max_attempts).select_for_update()
+                .only('task_name', 'task_attr', 'extra')
+            )
+            if failed_tasks:
+                Task.objects.filter(pk__in=[task.pk for task in failed_tasks]).update(
+                    status=TaskStatus.FAILED.value,
+                    exc_info=LEASE_EXPIRED_EXC_INFO,
+                    lease_expires_at=None,
+                    updated_at=now,
+                )
+        # Bump version, the stale worker can't run the task any more
+        reclaimed = expired_tasks.update(
+            status=TaskStatus.WAITING.value,
+            worker_id=None,
+            lease_expires_at=None,
+            version=F('version') + 1,
+            updated_at=now,
+        )
+        return reclaimed, failed_tasks
+
+    def archive_tasks(self, statuses: list, updated_at_lte: datetime, batch_size: int = DEFAULT_ARCHIVE_BATCH_SIZE,
+                      sleep_seconds: float = 0):
+        """
+        Move the tasks in `statuses` updated before `updated_at_lte` into `utils_task_history`
+
+        Each batch is one `INSERT ... SELECT` and one DELETE in a transaction, the columns are copied as stored, the
+        payloads are not decoded. Sleep between batches to ease the replicas.
+        :return: The count of archived tasks
+        """
+        quote_name = connection.ops.quote_name
+        # The columns of the history copied from the task, `task_id` from `id`
+        columns, select_columns = [], []
+        for field in TaskHistory._meta.concrete_fields:
+            if field.primary_key or field.name == 'archived_at':
+                continue
+            columns.append(quote_name(field.column))
+            source_field = Task._meta.pk if field.name == 'task_id' else Task._meta.get_field(field.name)
+            select_columns.append(quote_name(source_field.column))
+        archived = 0
+        while True:
+            with transaction.atomic():
+                pks = list(
+                    Task.objects.select_for_update().filter(
+                        status__in=statuses, updated_at__lte=updated_at_lte
+                    ).order_by('pk').values_list('pk', flat=True)[:batch_size]
+                )
+                if pks:
+                    sql = 'INSERT INTO {history_table} ({columns}, {archived_at}) SELECT {select_columns}, %s ' \
+                          'FROM {table} WHERE {id} IN ({placeholders})'.format(
+                              history_table=quote_name(TaskHistory._meta.db_table),
+                              columns=', '.join(columns),
+                              archived_at=quote_name(TaskHistory._meta.get_field('archived_at').column),
+                              select_columns=', '.join(select_columns),
+                              table=quote_name(Task._meta.db_table),
+                              id=quote_name(Task._meta.pk.column),
+                              placeholders=', '.join(['%s'] * len(pks)),
+                          )
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, [datetime.now()] + pks)
+                    Task.objects.filter(pk__in=pks).delete()
+            archived += len(pks)
+            if len(pks) < batch_size:
+                return archived
+            if sleep_seconds:
+                time.sleep(sleep_seconds)
+
+    def purge_payloads(self, referenced_at_lte: datetime, batch_size: int = DEFAULT_ARCHIVE_BATCH_SIZE):
+        """
+        Delete the offloaded payloads not stored again since `referenced_at_lte`, and referred by no task or task
+        history, by the indexes of the digest columns
+        :return: The count of purged payloads
+        """
+        purged = 0
+        last_pk = 0
+        while True:
+            payloads = list(
+                TaskPayload.objects.filter(pk__gt=last_pk, referenced_at__lte=referenced_at_lte)
+                .order_by('pk').values_list('pk', 'digest')[:batch_size]
+            )
+            if not payloads:
+                return purged
+            last_pk = payloads[-1][0]
+            digests = {digest for _, digest in payloads}
+            referenced_digests = set()
+            for model in (Task, TaskHistory):
+                for digest_field in ('task_args_digest', 'task_kwargs_digest'):
+                    referenced_digests.update(
+                        model.objects.filter(**{f'{digest_field}__in': digests})
+                        .values_list(digest_field, flat=True).distinct()
+                    )
+            unreferenced_digests = digests - referenced_digests
+            if unreferenced_digests:
+                purged += TaskPayload.objects.filter(
+                    digest__in=unreferenced_digests, referenced_at__lte=referenced_at_lte
+                ).delete()[0]
+
+
+# Drop the lease of the task, the lease is in the sorted set of leases and the set of the worker
+RELEASE_LEASE_FUNCTION = """
+local function release_lease(info_key, id, leases_key, worker_key_prefix)
+    redis.call('ZREM', leases_key, id)
+    local worker_id = redis.call('HGET', info_key, 'worker_id')
+    if worker_id then
+        redis.call('SREM', worker_key_prefix .. worker_id, id)
+    end
+    redis.call('HDEL', info_key, 'lease_expires_at')
+end
+"""
+
+# The waiting task ids of each priority are in `<waiting_prefix><priority>`, scored by `run_at`,
+# and the priorities are in `<waiting_prefix>priorities`
+WAITING_KEY_FUNCTION = """
+local function waiting_key(waiting_prefix, info_key)
+    local priority = redis.call('HGET', info_key, 'priority') or '0'
+    redis.call('ZADD', waiting_prefix .. 'priorities', priority, priority)
+    return waiting_prefix .. priority
+end
+
+-- Remove the task from the waiting key of its stored priority, before the priority may be changed
+local function remove_waiting(waiting_prefix, info_key, id)
+    redis.call('ZREM', waiting_prefix .. (redis.call('HGET', info_key, 'priority') or '0'), id)
+end
+"""
+
+# The count of tasks of each task name is in the hash `names`, the task name is dropped when no task of it
+COUNT_TASK_NAME_FUNCTION = """
+local function count_task_name(names_key, task_name, increment)
+    if task_name and redis.call('HINCRBY', names_key, task_name, increment) <= 0 then
+        redis.call('HDEL', names_key, task_name)
+    end
+end
+"""
+
+# KEYS: seq, idents, waiting_prefix, info_prefix, names
+# ARGV: ident, field, value, ...
+CREATE_TASK_SCRIPT = WAITING_KEY_FUNCTION + COUNT_TASK_NAME_FUNCTION + """
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+local id = redis.call('INCR', KEYS[1])
+local info_key = KEYS[4] .. id
+redis.call('HSET', KEYS[2], ARGV[1], id)
+redis.call('HSET', info_key, 'id', id, unpack(ARGV, 2))
+count_task_name(KEYS[5], redis.call('HGET', info_key, 'task_name'), 1)
+if redis.call('HGET', info_key, 'status') == 'waiting' then
+    redis.call('ZADD', waiting_key(KEYS[3], info_key), redis.call('HGET', info_key, 'run_at'), id)
+end
+return id
+"""
+
+# KEYS: seq, idents, waiting_prefix, info_prefix, names
+# ARGV: task, ..., task is json of [ident, field, value, ...]
+CREATE_TASKS_SCRIPT = WAITING_KEY_FUNCTION + COUNT_TASK_NAME_FUNCTION + """
+local inserted = 0
+for i = 1, #ARGV do
+    local task = cjson.decode(ARGV[i])
+    if redis.call('HEXISTS', KEYS[2], task[1]) == 0 then
+        local id = redis.call('INCR', KEYS[1])
+        local info_key = KEYS[4] .. id
+        redis.call('HSET', KEYS[2], task[1], id)
+        redis.call('HSET', info_key, 'id', id, unpack(task, 2))
+        count_task_name(KEYS[5], redis.call('HGET', info_key, 'task_name'), 1)
+        if redis.call('HGET', info_key, 'status') == 'waiting' then
+            redis.call('ZADD', waiting_key(KEYS[3], info_key), redis.call('HGET', info_key, 'run_at'), id)
+        end
+        inserted = inserted + 1
+    end
+end
+return inserted
+"""
+
+# KEYS: seq, idents, waiting_prefix, info_prefix, names
+# ARGV: ident, create_fields, update_fields, none_fields, fields are json of [field, value, ...],
+# none_fields is json of the names of the fields to remove
+# Return UpsertResult, 1 if created, 2 if updated, 0 if exists but not waiting
+UPSERT_TASK_SCRIPT = WAITING_KEY_FUNCTION + COUNT_TASK_NAME_FUNCTION + """
+local id = redis.call('HGET', KEYS[2], ARGV[1])
+if not id then
+    id = redis.call('INCR', KEYS[1])
+    local info_key = KEYS[4] .. id
+    redis.call('HSET', KEYS[2], ARGV[1], id)
+    redis.call('HSET', info_key, 'id', id, unpack(cjson.decode(ARGV[2])))
+    count_task_name(KEYS[5], redis.call('HGET', info_key, 'task_name'), 1)
+    redis.call('ZADD', waiting_key(KEYS[3], info_key), redis.call('HGET', info_key, 'run_at'), id)
+    return 1
+end
+local info_key = KEYS[4] .. id
+if redis.call('HGET', info_key, 'status') ~= 'waiting' then
+    return 0
+end
+remove_waiting(KEYS[3], info_key, id)
+local none_fields = cjson.decode(ARGV[4])
+if #none_fields > 0 then
+    redis.call('HDEL', info_key, unpack(none_fields))
+end
+redis.call('HSET', info_key, unpack(cjson.decode(ARGV[3])))
+redis.call('ZADD', waiting_key(KEYS[3], info_key), redis.call('HGET', info_key, 'run_at'), id)
+return 2
+"""
+
+# KEYS: idents, waiting_prefix, info_prefix, leases, worker_prefix
+# ARGV: ident, id, status, version, none_fields, field, value, ...
+# none_fields is json of the names of the fields to remove
+# Find task by id if id is not empty, otherwise by ident. Only update the task in `status` if status is not empty,
+# and in `version` if version is not empty. The lease is dropped if the task is not pending or running any more.
+UPDATE_TASK_SCRIPT = RELEASE_LEASE_FUNCTION + WAITING_KEY_FUNCTION + """
+local id = ARGV[2]
+if id == '' then
+    id = redis.call('HGET', KEYS[1], ARGV[1])
+    if not id then
+        return 0
+    end
+end
+local info_key = KEYS[3] .. id
+local status = redis.call('HGET', info_key, 'status')
+if not status or (ARGV[3] ~= '' and status ~= ARGV[3]) then
+    return 0
+end
+if ARGV[4] ~= '' and redis.call('HGET', info_key, 'version') ~= ARGV[4] then
+    return 0
+end
+remove_waiting(KEYS[2], info_key, id)
+local none_fields = cjson.decode(ARGV[5])
+if #none_fields > 0 then
+    redis.call('HDEL', info_key, unpack(none_fields))
+end
+if #ARGV > 5 then
+    redis.call('HSET', info_key, unpack(ARGV, 6))
+end
+status = redis.call('HGET', info_key, 'status')
+if status == 'waiting' then
+    redis.call('ZADD', waiting_key(KEYS[2], info_key), redis.call('HGET', info_key, 'run_at'), id)
+else
+    redis.call('ZREM', waiting_key(KEYS[2], info_key), id)
+end
+if status ~= 'pending' and status ~= 'running' then
+    release_lease(info_key, id, KEYS[4], KEYS[5])
+    if status == 'waiting' then
+        redis.call('HDEL', info_key, 'worker_id')
+    end
+end
+return 1
+"""
+
+# KEYS: idents, info_prefix
+# ARGV: ident
+GET_TASK_SCRIPT = """
+local id = redis.call('HGET', KEYS[1], ARGV[1])
+if not id then
+    return {}
+end
+return redis.call('HGETALL', KEYS[2] .. id)
+"""
+
+# KEYS: idents, waiting_prefix, info_prefix, leases, worker_prefix, names
+# ARGV: ident
+# Return [id, extra] of the deleted task, empty if not exists
+DELETE_TASK_SCRIPT = RELEASE_LEASE_FUNCTION + WAITING_KEY_FUNCTION + COUNT_TASK_NAME_FUNCTION + """
+local id = redis.call('HGET', KEYS[1], ARGV[1])
+if not id then
+    return {}
+end
+local info_key = KEYS[3] .. id
+redis.call('HDEL', KEYS[1], ARGV[1])
+count_task_name(KEYS[6], redis.call('HGET', info_key, 'task_name'), -1)
+redis.call('ZREM', waiting_key(KEYS[2], info_key), id)
+release_lease(info_key, id, KEYS[4], KEYS[5])
+local extra = redis.call('HGET', info_key, 'extra') or '{}'
+redis.call('DEL', info_key)
+return {id, extra}
+"""
+
+# KEYS: idents, info_prefix, leases, worker_prefix, names
+# ARGV: id, version, ...
+# Only delete the running tasks of the version
+DELETE_TASKS_SCRIPT = RELEASE_LEASE_FUNCTION + COUNT_TASK_NAME_FUNCTION + """
+local deleted = 0
+for i = 1, #ARGV, 2 do
+    local id = ARGV[i]
+    local info_key = KEYS[2] .. id
+    local values = redis.call('HMGET', info_key, 'status', 'task_name', 'task_attr', 'version')
+    if values[1] == 'running' and values[4] == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], values[2] .. '#' .. values[3])
+        count_task_name(KEYS[5], values[2], -1)
+        release_lease(info_key, id, KEYS[3], KEYS[4])
+        deleted = deleted + redis.call('DEL', info_key)
+    end
+end
+return deleted
+"""
+
+# KEYS: waiting_prefix, info_prefix, leases, worker
+# ARGV: run_at_lte, count, worker_id, now, lease_expires_at, exclude_task_name, ...
+# Pop the due tasks from the highest priority and set them pending with the lease of the worker, the tasks of
+# the excluded task names are skipped, up to `max_skipped` of them in each priority
+CLAIM_TASKS_SCRIPT = """
+local count = tonumber(ARGV[2])
+local excluded = {}
+for i = 6, #ARGV do
+    excluded[ARGV[i]] = true
+end
+local max_skipped = 1000
+local tasks = {}
+for _, priority in ipairs(redis.call('ZREVRANGE', KEYS[1] .. 'priorities', 0, -1)) do
+    local waiting_key = KEYS[1] .. priority
+    local skipped = 0
+    while #tasks < count and skipped < max_skipped do
+        local ids = redis.call('ZRANGEBYSCORE', waiting_key, '-inf', ARGV[1], 'LIMIT', skipped, count - #tasks)
+        if #ids == 0 then
+            break
+        end
+        for _, id in ipairs(ids) do
+            local info_key = KEYS[2] .. id
+            if #ARGV > 5 and excluded[redis.call('HGET', info_key, 'task_name')] then
+                skipped = skipped + 1
+            else
+                redis.call('ZREM', waiting_key, id)
+                redis.call('HSET', info_key, 'status', 'pending', 'worker_id', ARGV[3], 'updated_at', ARGV[4],
+                           'lease_expires_at', ARGV[5])
+                redis.call('HINCRBY', info_key, 'version', 1)
+                redis.call('HINCRBY', info_key, 'attempts', 1)
+                redis.call('ZADD', KEYS[3], ARGV[5], id)
+                redis.call('SADD', KEYS[4], id)
+                tasks[#tasks + 1] = redis.call('HGETALL', info_key)
+            end
+        end
+    end
+    if #tasks >= count then
+        break
+    end
+end
+return tasks
+"""
+
+# KEYS: names
+TASK_NAMES_SCRIPT = """
+return redis.call('HKEYS', KEYS[1])
+"""
+
+# KEYS: leases, worker, info_prefix
+# ARGV: worker_id, lease_expires_at
+# Renew the leases of the pending/running tasks of the worker
+RENEW_LEASES_SCRIPT = """
+local renewed = 0
+for _, id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    local info_key = KEYS[3] .. id
+    local values = redis.call('HMGET', info_key, 'status', 'worker_id')
+    if (values[1] == 'pending' or values[1] == 'running') and values[2] == ARGV[1] then
+        redis.call('HSET', info_key, 'lease_expires_at', ARGV[2])
+        redis.call('ZADD', KEYS[1], ARGV[2], id)
+        renewed = renewed + 1
+    else
+        redis.call('SREM', KEYS[2], id)
+    end
+end
+return renewed
+"""
+
+# KEYS: leases, waiting_prefix, info_prefix, worker_prefix
+# ARGV: now, max_attempts, exc_info
+# Set the tasks with expired lease waiting, or failed after max attempts.
+# Return {reclaimed, {{id, task_name, task_attr, extra}, ...}} of the failed tasks
+REAP_TASKS_SCRIPT = RELEASE_LEASE_FUNCTION + WAITING_KEY_FUNCTION + """
+local reclaimed, failed = 0, {}
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])) do
+    local info_key = KEYS[3] .. id
+    local values = redis.call('HMGET', info_key, 'status', 'attempts', 'task_name', 'task_attr', 'extra')
+    release_lease(info_key, id, KEYS[1], KEYS[4])
+    if values[1] == 'pending' or values[1] == 'running' then
+        if tonumber(values[2] or 0) >= tonumber(ARGV[2]) then
+            redis.call('HSET', info_key, 'status', 'failed', 'exc_info', ARGV[3], 'updated_at', ARGV[1])
+            table.insert(failed, {id, values[3], values[4], values[5] or '{}'})
+        else
+            redis.call('HSET', info_key, 'status', 'waiting', 'updated_at', ARGV[1])
+            redis.call('HDEL', info_key, 'worker_id')
+            redis.call('HINCRBY', info_key, 'version', 1)
+            redis.call('ZADD', waiting_key(KEYS[2], info_key), redis.call('HGET', info_key, 'run_at'), id)
+            reclaimed = reclaimed + 1
+        end
+    end
+end
+return {reclaimed, failed}
+"""
+
+
+class RedisTaskEngine(TaskEngine):
+    """
+    Task engine base on Redis
+
+    Keys:
+
+    - task:seq: The sequence of task id
+    - task:idents: Hash, `task_name#task_attr` -> task id, keep (task_name, task_attr) unique
+    - task:waiting:<priority>: Sorted set of waiting task ids of the priority, scored by `run_at`
+    - task:waiting:priorities: Sorted set of the priorities, claimed from the highest priority
+    - task:info:<id>: Hash of the task
+    - task:leases: Sorted set of pending/running task ids, scored by `lease_expires_at`
+    - task:worker:<worker_id>: Set of the task ids claimed by the worker
+    - task:names: Hash, task_name -> the count of its tasks
+
+    The status of task is the same as `MySQLTaskEngine`, each transition is done by a lua script atomically.
+    """
+
+    json_fields = ('task_args', 'task_kwargs', 'extra')
+    datetime_fields = ('run_at', 'lease_expires_at', 'created_at', 'updated_at')
+    int_fields = ('id', 'version', 'attempts', 'priority', 'max_concurrency')
+
+    def __init__(self, client=None, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+        if client is None:
+            from utils.caches import cache as client
+        self.client = client
+        #
+        self.seq_key = 'task:seq'
+        self.idents_key = 'task:idents'
+        self.waiting_key_prefix = 'task:waiting:'
+        self.info_key_prefix = 'task:info:'
+        self.leases_key = 'task:leases'
+        self.worker_key_prefix = 'task:worker:'
+        self.names_key = 'task:names'
+        self.lease_seconds = lease_seconds
+        #
+        self._create_task = client.register_script(CREATE_TASK_SCRIPT)
+        self._create_tasks = client.register_script(CREATE_TASKS_SCRIPT)
+        self._update_task = client.register_script(UPDATE_TASK_SCRIPT)
+        self._upsert_task = client.register_script(UPSERT_TASK_SCRIPT)
+        self._get_task = client.register_script(GET_TASK_SCRIPT)
+        self._delete_task = client.register_script(DELETE_TASK_SCRIPT)
+        self._delete_tasks = client.register_script(DELETE_TASKS_SCRIPT)
+        self._claim_tasks = client.register_script(CLAIM_TASKS_SCRIPT)
+        self._get_task_names = client.register_script(TASK_NAMES_SCRIPT)
+        self._renew_leases = client.register_script(RENEW_LEASES_SCRIPT)
+        self._reap_tasks = client.register_script(REAP_TASKS_SCRIPT)
+
+    @staticmethod
+    def _make_ident(task_name, task_attr):
+        # `#` never appears in task_name, which is `module:func`
+        return '{}#{}'.format(task_name, task_attr)
+
+    def _dump(self, fields: dict):
+        """
+        Convert fields to the args of `HSET`, the field with value `None` is ignored, see `_dump_none`
+        """
+        args = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if name in self.json_fields:
+                value = json_encode(value)
+            elif name in self.datetime_fields:
+                value = self._format_timestamp(value)
+            else:
+                value = str(value)
+            args.extend([name, value])
+        return args
+
+    def _dump_none(self, fields: dict):
+        """
+        The names of the fields with value `None`, they are removed from the hash by `HDEL` when updated
+        """
+        return json_encode([name for name, value in fields.items() if value is None])
+
+    def _load(self, values: list):
+        """
+        Convert the result of `HGETALL` to a task
+        """
+        fields = dict(zip(values[::2], values[1::2]))
+        for name, value in fields.items():
+            if name in self.json_fields:
+                fields[name] = json_decode(value)
+            elif name in self.datetime_fields:
+                fields[name] = datetime.fromtimestamp(float(value))
+            elif name in self.int_fields:
+                fields[name] = int(value)
+        return Task(**fields)
+
+    @staticmethod
+    def _make_fields(task_name, task_attr, **kwargs):
+        now = datetime.now()
+        fields = dict(trace_id=uuid.uuid4(), task_name=task_name, task_attr=task_attr, version=0,
+                      created_at=now, updated_at=now)
+        fields.update(kwargs)
+        return fields
+
+    def create_task(self, task_name, task_attr, **kwargs):
+        fields = self._make_fields(task_name, task_attr, **kwargs)
+        task_id = self._create_task(
+            keys=[self.seq_key, self.idents_key, self.waiting_key_prefix, self.info_key_prefix, self.names_key],
+            args=[self._make_ident(task_name, task_attr)] + self._dump(fields)
+        )
+        if not task_id:
+            raise DuplicateTask(task_name, task_attr)
+        return Task(id=task_id, **fields)
+
+    def create_tasks(self, tasks: list, chunk_size: int = DEFAULT_CREATE_CHUNK_SIZE):
+        inserted = 0
+        for i in range(0, len(tasks), chunk_size):
+            args = []
+            for kwargs in tasks[i:i + chunk_size]:
+                fields = self._make_fields(**kwargs)
+                ident = self._make_ident(fields['task_name'], fields['task_attr'])
+                args.append(json_encode([ident] + self._dump(fields)))
+            inserted += self._create_tasks(
+                keys=[self.seq_key, self.idents_key, self.waiting_key_prefix, self.info_key_prefix, self.names_key],
+                args=args
+            )
+        return inserted, len(tasks) - inserted
+
+    @staticmethod
+    def _format_timestamp(value: datetime):
+        return '{:.6f}'.format(value.timestamp())
+
+    def _update(self, fields: dict, task_name=None, task_attr=None, task_id=None, filter_status=None,
+                filter_version=None):
+        """
+        Update the task found by id or (task_name, task_attr)
+        """
+        fields.update(updated_at=datetime.now())
+        ident = self._make_ident(task_name, task_attr) if task_id is None else ''
+        filter_version = '' if filter_version is None else filter_version
+        return self._update_task(
+            keys=[self.idents_key, self.waiting_key_prefix, self.info_key_prefix, self.leases_key,
+                  self.worker_key_prefix],
+            args=[ident, task_id or '', filter_status or '', filter_version,
+                  self._dump_none(fields)] + self._dump(fields)
+        )
+
+    def update_task(self, task_name, task_attr, filter_kwargs: dict = None, update_kwargs: dict = None):
+        # Only support filtering by status
+        filter_status = (filter_kwargs or {}).get('status')
+        return self._update(dict(update_kwargs or {}), task_name=task_name, task_attr=task_attr,
+                            filter_status=filter_status)
+
+    def upsert_task(self, task_name, task_attr, update_fields: list, **kwargs):
+        fields = self._make_fields(task_name, task_attr, **kwargs)
+        update_fields = {name: fields[name] for name in list(update_fields) + ['updated_at']}
+        return UpsertResult(self._upsert_task(
+            keys=[self.seq_key, self.idents_key, self.waiting_key_prefix, self.info_key_prefix, self.names_key],
+            args=[self._make_ident(task_name, task_attr),
+                  json_encode(self._dump(fields)), json_encode(self._dump(update_fields)),
+                  self._dump_none(update_fields)]
+        ))
+
+    def get_task(self, task_name, task_attr):
+        values = self._get_task(
+            keys=[self.idents_key, self.info_key_prefix], args=[self._make_ident(task_name, task_attr)]
+        )
+        return self._load(values) if values else None
+
+    def delete_task(self, task_name, task_attr):
+        rows = 1 if self.cancel_task(task_name, task_attr) is not None else 0
+        return rows, {Task._meta.label: rows}
+
+    def cancel_task(self, task_name, task_attr):
+        values = self._delete_task(
+            keys=[self.idents_key, self.waiting_key_prefix, self.info_key_prefix, self.leases_key,
+                  self.worker_key_prefix, self.names_key],
+            args=[self._make_ident(task_name, task_attr)]
+        )
+        if not values:
+            return None
+        task_id, extra = values
+        return Task(id=int(task_id), task_name=task_name, task_attr=task_attr, extra=json_decode(extra))
+
+    def get_waiting_task_names(self):
+        # The task names of all existing tasks, counted when the tasks are created and deleted, not scanning them
+        return set(self._get_task_names(keys=[self.names_key]))
+
+    def get_waiting_tasks(self, count: int = DEFAULT_WAITING_TASK_COUNT, run_at_lte: datetime = None,
+                          shards: tuple = None, exclude_task_names: list = None):
+        # The claim is atomic, no contention between workers, so the tasks are not sharded
+        now = datetime.now()
+        worker_id = get_worker_id()
+        task_values_list = self._claim_tasks(
+            keys=[self.waiting_key_prefix, self.info_key_prefix, self.leases_key, self.worker_key_prefix + worker_id],
+            args=[self._format_timestamp(run_at_lte or now), count, worker_id, self._format_timestamp(now),
+                  self._format_timestamp(now + timedelta(seconds=self.lease_seconds)),
+                  *(exclude_task_names or [])]
+        )
+        return [self._load(values) for values in task_values_list]
+
+    def get_task_payload(self, task):
+        # The payload is claimed with the task
+        return task.task_args, task.task_kwargs
+
+    def run_task(self, task):
+        fields = dict(status=TaskStatus.RUNNING.value, version=task.version + 1)
+        if not self._update(fields, task_id=task.pk, filter_status=TaskStatus.PENDING.value,
+                            filter_version=task.version):
+            return False
+        task.status = TaskStatus.RUNNING.value
+        task.version += 1
+        task.updated_at = fields['updated_at']
+        return True
+
+    def delete_tasks(self, task_keys: list):
+        if not task_keys:
+            return 0
+        return self._delete_tasks(
+            keys=[self.idents_key, self.info_key_prefix, self.leases_key, self.worker_key_prefix, self.names_key],
+            args=[value for task_key in task_keys for value in task_key]
+        )
+
+    def defer_task(self, task, run_at):
+        fields = dict(status=TaskStatus.WAITING.value, run_at=run_at, attempts=max(task.attempts - 1, 0))
+        return self._update(fields, task_id=task.pk, filter_status=TaskStatus.PENDING.value,
+                            filter_version=task.version)
+
+    def reschedule_task(self, task, run_at, exc_info=None):
+        fields = dict(status=TaskStatus.WAITING.value, run_at=run_at, attempts=0, exc_info=exc_info)
+        return self._update(fields, task_id=task.pk, filter_status=TaskStatus.RUNNING.value,
+                            filter_version=task.version)
+
+    def retry_task(self, task, next_run_at, **kwargs):
+        fields = dict(kwargs, status=TaskStatus.WAITING.value, run_at=next_run_at, attempts=0)
+        return self._update(fields, task_id=task.pk, filter_status=TaskStatus.RUNNING.value,
+                            filter_version=task.version)
+
+    def fail_task(self, task, exc_info):
+        fields = dict(status=TaskStatus.FAILED.value, exc_info=exc_info)
+        # The task may be reaped and claimed by another worker
+        self._update(fields, task_id=task.pk, filter_version=task.version)
+
+    def release_tasks(self, tasks):
+        rows = 0
+        for task in tasks:
+            # The released tasks are not executed
+            fields = dict(status=TaskStatus.WAITING.value, attempts=max(task.attempts - 1, 0))
+            rows += self._update(fields, task_id=task.pk, filter_status=TaskStatus.PENDING.value,
+                                 filter_version=task.version)
+        return rows
+
+    def renew_leases(self):
+        worker_id = get_worker_id()
+        lease_expires_at = datetime.now() + timedelta(seconds=self.lease_seconds)
+        return self._renew_leases(
+            keys=[self.leases_key, self.worker_key_prefix + worker_id, self.info_key_prefix],
+            args=[worker_id, self._format_timestamp(lease_expires_at)]
+        )
+
+    def reap_tasks(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        reclaimed, failed = self._reap_tasks(
+            keys=[self.leases_key, self.waiting_key_prefix, self.info_key_prefix, self.worker_key_prefix],
+            args=[self._format_timestamp(datetime.now()), max_attempts, LEASE_EXPIRED_EXC_INFO]
+        )
+        failed_tasks = [
+            Task(id=int(task_id), task_name=task_name, task_attr=task_attr, extra=json_decode(extra))
+            for task_id, task_name, task_attr, extra in failed
+        ]
+        return reclaimed, failed_tasks
+
+
+def get_engine():
+    """
+    Get the task engine by `TASK_CONF['engine']`, `mysql` or `redis`
+    """
+    name = task_conf.get('engine', 'mysql')
+    lease_seconds = task_conf.get('lease_seconds', DEFAULT_LEASE_SECONDS)
+    if name == 'redis':
+        return RedisTaskEngine(lease_seconds=lease_seconds)
+    return MySQLTaskEngine(skip_locked=task_conf.get('skip_locked', True), lease_seconds=lease_seconds,
+                           shard_count=task_conf.get('shard_count', DEFAULT_SHARD_COUNT))
+
 
-engine = MySQLTaskEngine()
+engine = get_engine()
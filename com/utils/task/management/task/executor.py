@@ -1,13 +1,27 @@
+import asyncio
 import datetime
+import functools
+import inspect
 import logging
+import os
 import time
 import traceback
-from importlib import import_module
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
 
 from ...models import Task
+from ...schedules import MisfirePolicy
+from .concurrency import concurrency_limiter
 from .constants import TaskStatus
-from .engines import engine
+from .api import finish_group_member
+from .engines import DEFAULT_MAX_ATTEMPTS, engine, get_worker_id, task_conf
+from .metrics import task_metrics
+from .registry import task_registry
+from .sharding import shard_membership
+from .timerwheel import TimerWheel
+from .wakeup import IdleBackoff, idle_sleep_seconds_max, idle_sleep_seconds_min, task_wakeup
+from utils.processutils import ProcessSupervisor
 from utils.threadutils import thread_ctx
 
 #
@@ -15,33 +29,220 @@ logger = logging.getLogger(__name__)
 
 # Sleep time
 executor_idle_sleep_seconds = 2
-executor_start_interval = 0.5
 # Thread count
 default_thread_count = 4
+# Worker process count
+default_worker_count = os.cpu_count() or 1
+# Wait timeout for getting task from work queue
+executor_get_task_timeout = 0.5
+# The max count of tasks in flight on the event loop
+default_concurrency = 100
+# Prefetch the tasks due within the look-ahead seconds into the timer wheel, disabled if 0
+lookahead_seconds = task_conf.get('lookahead_seconds', 0)
+lookahead_max_tasks = task_conf.get('lookahead_max_tasks', 100)
+timer_tick_seconds = 0.05
+# Delete the successful tasks in batches
+complete_batch_size = task_conf.get('complete_batch_size', 1)
+complete_flush_seconds = task_conf.get('complete_flush_seconds', 1)
+# Renew the leases of claimed tasks and reap the expired leases every heartbeat
+heartbeat_seconds = task_conf.get('heartbeat_seconds', 10)
+max_attempts = task_conf.get('max_attempts', DEFAULT_MAX_ATTEMPTS)
+# Export the metrics of the process to redis every heartbeat, kept for 3 heartbeats
+metrics_enabled = task_conf.get('metrics', False)
+# Each node (worker process) claims the tasks in its own shard range
+sharding_enabled = task_conf.get('sharding', False)
 #
 # Status
 is_running = False
 # Signal
 stop_signal = False
-# task map {task_name: task_func, ...}
-task_func_map = {}
+# Task dispatcher
+_dispatcher = None
+# Worker process supervisor
+_supervisor = None
 
 
 def stop_task_executor():
     global stop_signal, is_running
     stop_signal = True
     is_running = False
+    if _dispatcher is not None:
+        _dispatcher.stop()
+    if _supervisor is not None:
+        _supervisor.stop()
 
 
-def import_task_func(task_name):
-    module_name, func_name = task_name.split(':')
-    task_func = getattr(import_module(module_name), func_name)
-    task_func_map[task_name] = task_func
-    logger.info(f'Import task func successfully. task_name: {task_name}')
+def preload_task_funcs(module_names=None):
+    """
+    Import the task modules (default `TASK_CONF['modules']`) and the task funcs of the waiting tasks
+    before executing, so the first task doesn't wait for importing
+
+    Return the task names whose task func can't be imported
+    """
+    if module_names is None:
+        module_names = task_conf.get('modules', [])
+    task_registry.import_modules(module_names)
+    return task_registry.resolve(sorted(engine.get_waiting_task_names()))
+
+
+def make_idle_backoff():
+    # Poll with the fixed idle sleep if not woken up by the added tasks
+    max_seconds = idle_sleep_seconds_max if task_wakeup.enabled else idle_sleep_seconds_min
+    return IdleBackoff(min_seconds=idle_sleep_seconds_min, max_seconds=max_seconds)
+
+
+def is_coroutine_task_func(task_func):
+    return getattr(task_func, 'is_coroutine', False) or inspect.iscoroutinefunction(task_func)
 
+
+def is_recurring_task_func(task_func):
+    return getattr(task_func, 'schedule', None) is not None
+
+
+def start_task(task: Task, started_at: datetime.datetime):
+    """
+    Parse task func and set task running
+
+    Return None if the task is not pending (maybe it's canceled), put back by the max concurrency,
+    or skipped by the misfire policy
+    """
+    logger.info(f'Execute task, task info: {task.to_dict()}')
+    task_func = task_registry.get(task.task_name)
+
+    # Skip the misfired firing of the recurring task
+    if (is_recurring_task_func(task_func) and task_func.misfire_policy == MisfirePolicy.SKIP.value
+            and task_func.is_misfired(task.run_at, started_at)):
+        run_at = task_func.schedule.next_run_at(started_at)
+        engine.defer_task(task, run_at=run_at)
+        logger.warning(f'Task is misfired, skip task. task_id: {task.pk}, run_at: {task.run_at}, '
+                       f'next_run_at: {run_at}')
+        return None
+
+    # Put the task back with its run_at if the running tasks of the task name reach the max concurrency,
+    # the task name is skipped by the next claims for a while, the other task names keep flowing
+    if not concurrency_limiter.acquire(task):
+        engine.release_tasks([task])
+        logger.info(f'Task reaches max concurrency, put back task. task_id: {task.pk}, run_at: {task.run_at}')
+        return None
+
+    # Set task running
+    if not engine.run_task(task):
+        concurrency_limiter.release(task)
+        task_metrics.incr(task.task_name, 'contention')
+        logger.warning(f'Task is not pending, execute task failed. task_id: {task.pk}')
+        return None
+    task_metrics.observe_lag(task.task_name, (started_at - task.run_at).total_seconds())
     return task_func
 
 
+def reschedule_task(task: Task, task_func, started_at: datetime.datetime, exc_info=None):
+    """
+    Set the recurring task waiting for the next firing
+    """
+    run_at = task_func.next_run_at(task.run_at, started_at)
+    engine.reschedule_task(task, run_at=run_at, exc_info=exc_info)
+    task_wakeup.notify(run_at)
+    logger.info(f'Reschedule task, task_id: {task.pk}, next_run_at: {run_at}')
+
+
+def complete_task(task: Task, result, started_at: datetime.datetime):
+    """
+    Retry task if the result is a datetime, reschedule the recurring task, otherwise delete it
+    """
+    if result and isinstance(result, datetime.datetime):
+        engine.retry_task(task, next_run_at=result)
+        task_wakeup.notify(result)
+        task_metrics.incr(task.task_name, 'retry')
+        logger.info(f'Retry task, task_id: {task.pk}, next_run_at: {result}')
+        return
+
+    task_metrics.incr(task.task_name, 'success')
+    # Not importing, the task func is registered when the task started, None if it failed to import
+    task_func = task_registry.lookup(task.task_name)
+    if is_recurring_task_func(task_func):
+        logger.info(f'Task func execute successfully. task_id: {task.pk}, executed result: {result}')
+        reschedule_task(task, task_func, started_at)
+        return
+
+    # NOTE: Don't save the successful task
+    # task.status = TaskStatus.SUCCESS.value
+    # task.save()
+    logger.info(f'Task func execute successfully. task info: {task.to_dict()}, executed result: {result}')
+
+    finish_group_member(task)
+    # Delete task
+    completed_tasks.add(task)
+
+
+class CompletedTasks:
+    """
+    Buffer the successful tasks of the process, and delete them by (id, version) in batches
+
+    Flushed when the batch is full or the oldest one has waited `flush_seconds`.
+    """
+
+    def __init__(self, batch_size, flush_seconds):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._task_keys = []
+        self._first_added_at = None
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._task_keys)
+
+    def add(self, task: Task):
+        with self._lock:
+            if not self._task_keys:
+                self._first_added_at = time.monotonic()
+            self._task_keys.append((task.pk, task.version))
+            is_due = (len(self._task_keys) >= self.batch_size
+                      or time.monotonic() - self._first_added_at >= self.flush_seconds)
+        if is_due:
+            self.flush()
+
+    def flush_if_due(self):
+        with self._lock:
+            is_due = bool(self._task_keys) and time.monotonic() - self._first_added_at >= self.flush_seconds
+        if is_due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            task_keys, self._task_keys = self._task_keys, []
+        if not task_keys:
+            return
+        try:
+            deleted_task_count = engine.delete_tasks(task_keys)
+        except Exception as _:
+            logger.exception(f'Delete completed tasks failed. task_keys: {task_keys}')
+            return
+        logger.info(f'Delete completed tasks, count: {len(task_keys)}, deleted: {deleted_task_count}')
+
+
+completed_tasks = CompletedTasks(complete_batch_size, complete_flush_seconds)
+
+
+def fail_task(task: Task, exc_info, started_at: datetime.datetime):
+    """
+    Set task failed, the recurring task is rescheduled with the exc_info
+    """
+    task_metrics.incr(task.task_name, 'failure')
+    # Not importing, the task func is registered when the task started, None if it failed to import
+    task_func = task_registry.lookup(task.task_name)
+    if is_recurring_task_func(task_func):
+        logger.error(f'Task func execute failed. task_id: {task.pk}, exc_info: {exc_info}')
+        reschedule_task(task, task_func, started_at, exc_info=exc_info)
+        return
+
+    task.status = TaskStatus.FAILED.value
+    task.exc_info = exc_info
+    engine.fail_task(task, exc_info=task.exc_info)
+    logger.error(f'Task func execute failed. task info: {task.to_dict()}')
+    finish_group_member(task)
+
+
 class TaskExecutor(Thread):
     """
     Task executor
@@ -51,71 +252,488 @@ class TaskExecutor(Thread):
         """
         Parse task func and execute
         """
+        started_at = datetime.datetime.now()
         try:
-            logger.info(f'Execute task, task info: {task.to_dict()}')
-            task_func = task_func_map.get(task.task_name, None)
-            if not task_func:
-                task_func = import_task_func(task.task_name)
-
-            # Set task running
-            updated_task_count = engine.update_task(
-                task_name=task.task_name, task_attr=task.task_attr,
-                filter_kwargs=dict(status=TaskStatus.PENDING.value),
-                update_kwargs=dict(status=TaskStatus.RUNNING.value)
-            )
-            if not bool(updated_task_count):
-                logger.warning(f'Task is not pending, execute task failed. task_id: {task.pk}')
+            task_func = start_task(task, started_at)
+            if task_func is None:
                 return
+            task_args, task_kwargs = engine.get_task_payload(task)
 
             # Execute task
-            result = task_func(*task.task_args, **task.task_kwargs)
-            if result and isinstance(result, datetime.datetime):
-                engine.retry_task(task_id=task.pk, next_run_at=result)
-                logger.info(f'Retry task, task_id: {task.pk}, next_run_at: {result}')
-                return
+            executed_at = time.monotonic()
+            try:
+                result = task_func(*task_args, **task_kwargs)
+                # Coroutine task func runs on a new event loop of current thread
+                if inspect.isawaitable(result):
+                    result = asyncio.run(result)
+            finally:
+                task_metrics.observe_duration(task.task_name, time.monotonic() - executed_at)
         except Exception as _:
-            task.status = TaskStatus.FAILED.value
-            task.exc_info = traceback.format_exc()
-            task.save()
-            logger.exception(f'Task func execute failed. task info: {task.to_dict()}')
+            fail_task(task, traceback.format_exc(), started_at)
             return
-        else:
-            # NOTE: Don't save the successful task
-            # task.status = TaskStatus.SUCCESS.value
-            # task.save()
-            logger.info(f'Task func execute successfully. task info: {task.to_dict()}, executed result: {result}')
+        finally:
+            concurrency_limiter.release(task)
+
+        complete_task(task, result, started_at)
 
-        # Delete task
-        engine.delete_task(task_name=task.task_name, task_attr=task.task_attr)
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.dispatcher = dispatcher
 
     def run(self):
         """
-        Get tasks and run
+        Get tasks from the work queue and run
         :return:
         """
         logger.info(f'{self.name} start ...')
-        global is_running
-        is_running = True
-        while not stop_signal:
-            waiting_tasks = engine.get_waiting_tasks()
-            if not waiting_tasks:
-                time.sleep(executor_idle_sleep_seconds)
-                continue
-            logger.info(f'Get waiting task count: {len(waiting_tasks)}')
-            for task in waiting_tasks:
+        while True:
+            task = self.dispatcher.get_task()
+            if task is None:
+                break
+            try:
                 # Set trace_id
                 thread_ctx.set('x_trace_id', task.trace_id)
                 self.execute_task(task)
-            # Clear thread_ctx
+            except Exception as _:
+                # Keep the executor alive, the lease of the task expires and it's reaped
+                logger.exception(f'Execute task failed. task_id: {task.pk}')
+            finally:
+                self.dispatcher.task_done()
+                # Clear thread_ctx
+                thread_ctx.clear()
+        completed_tasks.flush()
+        logger.info(f'{self.name} is stopped')
+
+
+class TaskTimer(Thread):
+    """
+    Task timer
+
+    Hold the prefetched tasks in a hierarchical timer wheel, and put each one into the work queue at its run_at.
+    The tasks not fired are released when stopped.
+    """
+
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.dispatcher = dispatcher
+        self.wheel = TimerWheel(tick=timer_tick_seconds)
+        self._lock = Lock()
+        self._stop_event = Event()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.wheel)
+
+    def add(self, task: Task):
+        with self._lock:
+            self.wheel.add(task.run_at.timestamp(), task)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        logger.info(f'{self.name} start ...')
+        while not self._stop_event.wait(timer_tick_seconds):
+            with self._lock:
+                tasks = self.wheel.advance()
+            for task in tasks:
+                self.dispatcher.work_queue.put(task)
+
+        # Release the leases of tasks not fired
+        with self._lock:
+            tasks = self.wheel.pop_all()
+        if tasks:
+            released_task_count = engine.release_tasks(tasks)
+            logger.info(f'Release prefetched tasks, count: {len(tasks)}, released: {released_task_count}')
+        logger.info(f'{self.name} is stopped')
+
+
+class TaskHeartbeat(Thread):
+    """
+    Task heartbeat
+
+    Renew the leases of the tasks claimed by current worker, and reap the tasks whose lease expired,
+    such as the tasks of the crashed workers. Stopped after the dispatcher drained.
+    """
+
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(daemon=True, **kwargs)
+        self.dispatcher = dispatcher
+        self._stop_event = Event()
+
+    def beat(self):
+        renewed_task_count = engine.renew_leases()
+        concurrency_limiter.renew()
+        reclaimed_task_count, failed_tasks = engine.reap_tasks(max_attempts=max_attempts)
+        if reclaimed_task_count or failed_tasks:
+            logger.warning(f'Reap tasks with expired lease, renewed: {renewed_task_count}, '
+                           f'reclaimed: {reclaimed_task_count}, failed: {len(failed_tasks)}')
+        # The failed members finish their groups
+        for task in failed_tasks:
+            finish_group_member(task)
+        if reclaimed_task_count:
+            task_wakeup.notify(datetime.datetime.now())
+        self.update_shards()
+        self.export_metrics()
+
+    def update_shards(self):
+        """
+        Renew the membership of current node, and rebalance the shard range of the dispatcher
+        """
+        if not sharding_enabled:
+            return
+        try:
+            shards = shard_membership.join(get_worker_id())
+        except Exception as _:
+            # Keep claiming the last shard range
+            logger.exception('Update task shards failed')
+            return
+        if shards != self.dispatcher.shards:
+            logger.info(f'Task shards rebalanced: {self.dispatcher.shards} -> {shards}')
+            self.dispatcher.shards = shards
+
+    def leave_shards(self):
+        if not sharding_enabled:
+            return
+        try:
+            shard_membership.leave(get_worker_id())
+        except Exception as _:
+            logger.exception('Leave task shards failed')
+
+    @staticmethod
+    def export_metrics():
+        if not metrics_enabled:
+            return
+        try:
+            task_metrics.export(get_worker_id(), ex=heartbeat_seconds * 3)
+        except Exception as _:
+            logger.exception('Export task metrics failed')
+
+    def run(self):
+        logger.info(f'{self.name} start ...')
+        while not self._stop_event.wait(heartbeat_seconds):
+            if self.dispatcher.is_drained():
+                break
+            try:
+                self.beat()
+            except Exception as _:
+                logger.exception('Task heartbeat failed')
+        # The metrics of the last tasks
+        self.export_metrics()
+        self.leave_shards()
+        logger.info(f'{self.name} is stopped')
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class TaskDispatcher(Thread):
+    """
+    Task dispatcher
+
+    The only poller of the process. It claims waiting tasks in batches sized to the free capacity of
+    the executors, and puts them into a bounded work queue drained by the executors.
+
+    If look-ahead is enabled, the tasks due within `lookahead_seconds` are prefetched into the task timer
+    when there is no backlog, and fired at their run_at exactly.
+    """
+
+    def __init__(self, thread_count, **kwargs):
+        super().__init__(**kwargs)
+        self.thread_count = thread_count
+        self.work_queue = Queue(maxsize=thread_count)
+        self.executors = []
+        # The count of tasks being executed
+        self._busy_count = 0
+        self._lock = Lock()
+        # Set when an executor is free, new tasks are added or stopping
+        self._wakeup_event = Event()
+        self._stopped = False
+        self.backoff = make_idle_backoff()
+        self.timer = TaskTimer(self, name='Task-timer') if lookahead_seconds > 0 else None
+        self.heartbeat = TaskHeartbeat(self, name='Task-heartbeat')
+        # The shard range claimed by the dispatcher, all shards if None
+        self.shards = None
+
+    @property
+    def free_capacity(self):
+        with self._lock:
+            return self.thread_count - self._busy_count - self.work_queue.qsize()
+
+    def get_task(self):
+        """
+        Get a task from the work queue, return None if stopped and the work queue is drained
+        """
+        while True:
+            try:
+                task = self.work_queue.get(timeout=executor_get_task_timeout)
+            except Empty:
+                completed_tasks.flush_if_due()
+                # The task timer may still fire tasks before stopped
+                if self._stopped and (self.timer is None or not self.timer.is_alive()):
+                    return None
+                continue
+            with self._lock:
+                self._busy_count += 1
+            return task
+
+    def task_done(self):
+        with self._lock:
+            self._busy_count -= 1
+        self._wakeup_event.set()
+
+    def wakeup(self, run_at):
+        """
+        Called by the wakeup listener when tasks are added
+        """
+        self.backoff.notify(run_at)
+        self._wakeup_event.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup_event.set()
+        task_wakeup.stop()
+
+    def is_drained(self):
+        """
+        Stopped and all executors exited
+        """
+        return self._stopped and not any(task_executor.is_alive() for task_executor in self.executors)
+
+    def wait(self, timeout):
+        """
+        Sleep until timeout, an executor is free, new tasks are added or stopping
+        """
+        self._wakeup_event.wait(timeout)
+        self._wakeup_event.clear()
+
+    def join(self, timeout=None):
+        """
+        Wait until the dispatcher and all executors stopped
+        """
+        super().join(timeout)
+        if self.timer is not None:
+            self.timer.join(timeout)
+        for task_executor in self.executors:
+            task_executor.join(timeout)
+
+    def start_executors(self):
+        for i in range(self.thread_count):
+            task_executor = TaskExecutor(self, name=f'Task-executor-{i + 1}')
+            task_executor.start()
+            self.executors.append(task_executor)
+
+    def prefetch(self):
+        """
+        Claim the tasks due within look-ahead seconds into the task timer
+        """
+        count = lookahead_max_tasks - len(self.timer)
+        if count <= 0:
+            return
+        run_at_lte = datetime.datetime.now() + datetime.timedelta(seconds=lookahead_seconds)
+        prefetched_tasks = engine.get_waiting_tasks(
+            count=count, run_at_lte=run_at_lte, shards=self.shards,
+            exclude_task_names=concurrency_limiter.saturated_task_names(),
+        )
+        if prefetched_tasks:
+            logger.info(f'Prefetch task count: {len(prefetched_tasks)}')
+        for task in prefetched_tasks:
+            self.timer.add(task)
+
+    def next_idle_timeout(self):
+        timeout = self.backoff.next_timeout()
+        # Prefetch before the tasks in the future are due
+        if self.timer is not None:
+            timeout = min(timeout, lookahead_seconds / 2)
+        return timeout
+
+    def run(self):
+        """
+        Claim tasks and dispatch
+        :return:
+        """
+        logger.info(f'{self.name} start ...')
+        self.start_executors()
+        if self.timer is not None:
+            self.timer.start()
+        # Join the shards before claiming
+        self.heartbeat.update_shards()
+        self.heartbeat.start()
+        task_wakeup.add_listener(self.wakeup)
+        while not self._stopped:
+            count = self.free_capacity
+            if count <= 0:
+                self.wait(executor_idle_sleep_seconds)
+                continue
+            waiting_tasks = engine.get_waiting_tasks(
+                count=count, shards=self.shards, exclude_task_names=concurrency_limiter.saturated_task_names()
+            )
+            if waiting_tasks:
+                logger.info(f'Get waiting task count: {len(waiting_tasks)}')
+                self.backoff.reset()
+                for task in waiting_tasks:
+                    self.work_queue.put(task)
+            # Claim again immediately if the batch is full, there may be more tasks in the backlog
+            if len(waiting_tasks) < count:
+                if self.timer is not None:
+                    self.prefetch()
+                self.wait(self.next_idle_timeout())
+        if self.timer is not None:
+            self.timer.stop()
+        logger.info(f'{self.name} is stopped')
+
+
+class AsyncTaskDispatcher:
+    """
+    Asyncio task dispatcher
+
+    Claim waiting tasks and run them on the event loop, at most `concurrency` tasks in flight.
+    Coroutine task funcs run on the event loop natively, the sync task funcs and the engine calls
+    run on a bounded thread pool.
+    """
+
+    def __init__(self, concurrency, thread_count):
+        self.concurrency = concurrency
+        self.thread_pool = ThreadPoolExecutor(max_workers=thread_count, thread_name_prefix='Task-executor')
+        # Running futures
+        self._futures = set()
+        self._loop = None
+        self._wakeup_event = None
+        self._stopped = False
+        self._drained = False
+        self.backoff = make_idle_backoff()
+        self.heartbeat = TaskHeartbeat(self, name='Task-heartbeat')
+        # The shard range claimed by the dispatcher, all shards if None
+        self.shards = None
+
+    @staticmethod
+    def _call_with_ctx(trace_id, func, *args, **kwargs):
+        if trace_id:
+            thread_ctx.set('x_trace_id', trace_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
             thread_ctx.clear()
-        else:
-            logger.info(f'{self.name} is stopped')
+
+    async def run_in_thread(self, trace_id, func, *args, **kwargs):
+        return await self._loop.run_in_executor(
+            self.thread_pool, functools.partial(self._call_with_ctx, trace_id, func, *args, **kwargs)
+        )
+
+    async def execute_task(self, task: Task):
+        """
+        Parse task func and execute
+        """
+        started_at = datetime.datetime.now()
+        try:
+            task_func = await self.run_in_thread(task.trace_id, start_task, task, started_at)
+            if task_func is None:
+                return
+            task_args, task_kwargs = await self.run_in_thread(task.trace_id, engine.get_task_payload, task)
+
+            # Execute task
+            executed_at = time.monotonic()
+            try:
+                if is_coroutine_task_func(task_func):
+                    result = await task_func(*task_args, **task_kwargs)
+                else:
+                    result = await self.run_in_thread(task.trace_id, task_func, *task_args, **task_kwargs)
+            finally:
+                task_metrics.observe_duration(task.task_name, time.monotonic() - executed_at)
+        except Exception as _:
+            await self.run_in_thread(task.trace_id, fail_task, task, traceback.format_exc(), started_at)
+            return
+        finally:
+            if task.max_concurrency:
+                await self.run_in_thread(task.trace_id, concurrency_limiter.release, task)
+
+        await self.run_in_thread(task.trace_id, complete_task, task, result, started_at)
+
+    def _task_done(self, future):
+        self._futures.discard(future)
+        self._wakeup_event.set()
+        if not future.cancelled() and future.exception() is not None:
+            # The lease of the task expires and it's reaped
+            logger.error('Execute task failed', exc_info=future.exception())
+
+    def wakeup(self, run_at):
+        """
+        Called by the wakeup listener when tasks are added
+        """
+        self.backoff.notify(run_at)
+        self._loop.call_soon_threadsafe(self._wakeup_event.set)
+
+    def stop(self):
+        self._stopped = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup_event.set)
+        task_wakeup.stop()
+
+    def is_drained(self):
+        """
+        Stopped and all tasks in flight are done
+        """
+        return self._drained
+
+    async def wait(self, timeout):
+        """
+        Sleep until timeout, a task is done, new tasks are added or stopping
+        """
+        try:
+            await asyncio.wait_for(self._wakeup_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup_event.clear()
+
+    async def run(self):
+        """
+        Claim tasks and run, return after all tasks in flight are done
+        """
+        logger.info('Task async dispatcher start ...')
+        self._loop = asyncio.get_event_loop()
+        self._wakeup_event = asyncio.Event()
+        task_wakeup.add_listener(self.wakeup)
+        # Join the shards before claiming
+        await self.run_in_thread(None, self.heartbeat.update_shards)
+        self.heartbeat.start()
+        while not self._stopped:
+            count = self.concurrency - len(self._futures)
+            if count <= 0:
+                await self.wait(executor_idle_sleep_seconds)
+                continue
+            waiting_tasks = await self.run_in_thread(
+                None, engine.get_waiting_tasks, count=count, shards=self.shards,
+                exclude_task_names=concurrency_limiter.saturated_task_names(),
+            )
+            if waiting_tasks:
+                logger.info(f'Get waiting task count: {len(waiting_tasks)}')
+                self.backoff.reset()
+                for task in waiting_tasks:
+                    future = asyncio.ensure_future(self.execute_task(task))
+                    future.add_done_callback(self._task_done)
+                    self._futures.add(future)
+            # Claim again immediately if the batch is full, there may be more tasks in the backlog
+            if len(waiting_tasks) < count:
+                timeout = self.backoff.next_timeout()
+                if len(completed_tasks):
+                    timeout = min(timeout, completed_tasks.flush_seconds)
+                await self.wait(timeout)
+            await self.run_in_thread(None, completed_tasks.flush_if_due)
+
+        if self._futures:
+            await asyncio.wait(self._futures)
+        await self.run_in_thread(None, completed_tasks.flush)
+        self._drained = True
+        self.heartbeat.stop()
+        self.thread_pool.shutdown()
+        logger.info('Task async dispatcher is stopped')
 
 
 def run(thread_count=None):
     """
     Start task executor
     """
+    global is_running, _dispatcher
     logger.info('Prepare task executor')
     if is_running:
         logger.info('Task executor is running, not allow start again')
@@ -125,9 +743,59 @@ def run(thread_count=None):
         thread_count = default_thread_count
     logger.info(f'Task executor thread count: {thread_count}')
 
-    for i in range(thread_count):
-        task_executor = TaskExecutor(name=f'Task-executor-{i + 1}')
-        task_executor.start()
-        time.sleep(executor_start_interval)
+    is_running = True
+    _dispatcher = TaskDispatcher(thread_count, name='Task-dispatcher')
+    _dispatcher.start()
 
     logger.info('Start all task executor successfully')
+
+
+def _run_worker_process(thread_count):
+    """
+    Run task executor in a worker process, return after drained
+    """
+    global _supervisor
+    # Only the supervisor forwards stop signal
+    _supervisor = None
+    run(thread_count=thread_count)
+    if _dispatcher is not None:
+        _dispatcher.join()
+
+
+def run_with_processes(worker_count=None, thread_count=None):
+    """
+    Start task executor in prefork worker processes, and wait until all worker processes exited
+
+    Each worker process has its own database connection, task func map and dispatcher.
+    """
+    global _supervisor
+    logger.info('Prepare task executor worker processes')
+    if worker_count is None:
+        worker_count = default_worker_count
+    logger.info(f'Task executor worker process count: {worker_count}')
+
+    _supervisor = ProcessSupervisor(_run_worker_process, worker_count, name='Task-worker', args=(thread_count,))
+    _supervisor.start()
+    _supervisor.join()
+    logger.info('All task executor worker processes are stopped')
+
+
+def run_with_asyncio(concurrency=None, thread_count=None):
+    """
+    Start task executor on an event loop, and wait until stopped
+    """
+    global is_running, _dispatcher
+    logger.info('Prepare task async executor')
+    if is_running:
+        logger.info('Task executor is running, not allow start again')
+        return
+
+    if concurrency is None:
+        concurrency = default_concurrency
+    if thread_count is None:
+        thread_count = default_thread_count
+    logger.info(f'Task async executor concurrency: {concurrency}, thread count: {thread_count}')
+
+    is_running = True
+    _dispatcher = AsyncTaskDispatcher(concurrency, thread_count)
+    asyncio.run(_dispatcher.run())
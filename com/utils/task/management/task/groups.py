@@ -0,0 +1,125 @@
+import datetime
+import logging
+
+from .engines import task_conf
+
+#
+logger = logging.getLogger(__name__)
+
+# The extra key of the member task, the value is the [task_name, task_attr] of the callback task
+GROUP_EXTRA_KEY = 'group'
+# The callback task waits at the run_at until all members finished
+GROUP_CALLBACK_RUN_AT = datetime.datetime(9999, 12, 31)
+# The counter of group expires after the seconds since the latest member run_at, or the last member finished
+DEFAULT_GROUP_EXPIRE_SECONDS = 7 * 24 * 3600
+
+# KEYS: pending, finished
+# ARGV: count, ex
+START_GROUP_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+# KEYS: pending, finished
+# ARGV: member, count, ex
+# Count down the pending members once per member (the member is '' to count down the skipped members),
+# return 1 if no pending member, -1 if the counter doesn't exist (expired or not started).
+# The expiry is only extended, not shortened before the latest member run_at
+FINISH_MEMBER_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+if ARGV[1] == '' or redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('DECRBY', KEYS[1], ARGV[2])
+end
+local ttl = math.max(redis.call('TTL', KEYS[1]), tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[2], ttl)
+if tonumber(redis.call('GET', KEYS[1])) <= 0 then
+    return 1
+end
+return 0
+"""
+
+
+def get_group(task):
+    """
+    The (task_name, task_attr) of the callback task of the group which the task is a member of
+    """
+    group = (task.extra or {}).get(GROUP_EXTRA_KEY)
+    return tuple(group) if group else None
+
+
+class TaskGroups:
+    """
+    Count the pending members of each group
+
+    The count is `task:group:<callback ident>:pending`, and the finished members are in the set
+    `task:group:<callback ident>:finished`, so a member run again (such as reaped after the worker crashed)
+    is counted once. The callback task is created waiting at `GROUP_CALLBACK_RUN_AT`, and set to run now
+    by whoever sees no pending member, moving a waiting task is idempotent, so the callback runs once.
+
+    A member finishes when it's deleted after executed, failed by the reaper, or canceled. The counter never
+    expires before the latest member run_at, a member finished after the counter expired is not counted.
+    """
+
+    def __init__(self, client=None, expire_seconds: int = DEFAULT_GROUP_EXPIRE_SECONDS):
+        self._client = client
+        self.expire_seconds = expire_seconds
+        self._start_group = None
+        self._finish_member = None
+
+    def _register_scripts(self):
+        """
+        Register the scripts on first use, the client is `utils.caches.cache` by default
+        """
+        if self._start_group is not None:
+            return
+        client = self._client
+        if client is None:
+            from utils.caches import cache as client
+        self._start_group = client.register_script(START_GROUP_SCRIPT)
+        self._finish_member = client.register_script(FINISH_MEMBER_SCRIPT)
+
+    @staticmethod
+    def _make_keys(group):
+        prefix = 'task:group:{}:{}:'.format(*group)
+        return [prefix + 'pending', prefix + 'finished']
+
+    def start(self, group, count, last_run_at: datetime.datetime = None):
+        """
+        Start counting before the members are added, so no member sees the group finished early
+
+        :param last_run_at: The latest run_at of the members, the counter expires after it
+        """
+        self._register_scripts()
+        expire_seconds = self.expire_seconds
+        if last_run_at is not None:
+            expire_seconds += max(0, int((last_run_at - datetime.datetime.now()).total_seconds()))
+        self._start_group(keys=self._make_keys(group), args=[count, expire_seconds])
+
+    def _count_down(self, group, member, count):
+        result = self._finish_member(keys=self._make_keys(group), args=[member, count, self.expire_seconds])
+        if result < 0:
+            logger.warning(f'The counter of group is expired or not started, member is not counted. '
+                           f'group: {group}, member: {member}')
+        return result == 1
+
+    def skip(self, group, count):
+        """
+        Count down the members not added, return True if no pending member
+        """
+        self._register_scripts()
+        return self._count_down(group, '', count)
+
+    def finish(self, group, task):
+        """
+        Count down the finished member, return True if no pending member
+        """
+        self._register_scripts()
+        member = '{}:{}'.format(task.task_name, task.task_attr)
+        return self._count_down(group, member, 1)
+
+
+task_groups = TaskGroups(expire_seconds=task_conf.get('group_expire_seconds', DEFAULT_GROUP_EXPIRE_SECONDS))
@@ -0,0 +1,257 @@
+import bisect
+import time
+from threading import Lock
+
+from utils.serializers import json_decode, json_encode
+
+# The upper bounds (seconds) of the histogram buckets, the last bucket is +Inf
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 600, 1800, 3600)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# The counters of each task name
+COUNTER_NAMES = ('success', 'failure', 'retry', 'contention')
+
+# KEYS: snapshot, workers
+# ARGV: worker_id, snapshot, ex, expires_at
+# Save the snapshot of a worker, the worker is listed until its snapshot expires
+EXPORT_SNAPSHOT_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+# KEYS: snapshot_prefix, workers
+# ARGV: now
+# Drop the expired workers, return [worker_id, snapshot, ...] of the others
+COLLECT_SNAPSHOTS_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local snapshots = {}
+for _, worker_id in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    local snapshot = redis.call('GET', KEYS[1] .. worker_id)
+    if snapshot then
+        table.insert(snapshots, worker_id)
+        table.insert(snapshots, snapshot)
+    end
+end
+return snapshots
+"""
+
+
+class Histogram:
+    """
+    Fixed buckets histogram, each observation is a bisect and two additions
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The count of observations of each bucket (not cumulative), the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def to_dict(self):
+        return dict(counts=list(self.counts), sum=self.sum)
+
+
+class TaskMetrics:
+    """
+    The metrics of the tasks executed by current process, by task name
+
+    - lag: The seconds from run_at to started
+    - duration: The seconds of executing the task func
+    - success/failure/retry: The count of task results
+    - contention: The count of tasks claimed or set running by another worker first (the optimistic
+      UPDATE affected 0 rows)
+
+    The snapshot is exported to redis by the heartbeat, and the snapshots of all live workers are read by
+    `collect()` for the `taskmetrics` command and the metrics view. The counters of a worker start from 0
+    when it restarts (a new worker id), so they are exported by worker, not summed across workers.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        # {task_name: {'lag': Histogram, 'duration': Histogram, 'success': int, ...}}
+        self._tasks = {}
+        self._lock = Lock()
+        self._export_snapshot = None
+        self._collect_snapshots = None
+
+    def _register_scripts(self):
+        """
+        Register the scripts on first use, the client is `utils.caches.cache` by default
+        """
+        if self._export_snapshot is not None:
+            return
+        client = self._client
+        if client is None:
+            from utils.caches import cache as client
+        self._export_snapshot = client.register_script(EXPORT_SNAPSHOT_SCRIPT)
+        self._collect_snapshots = client.register_script(COLLECT_SNAPSHOTS_SCRIPT)
+
+    @staticmethod
+    def _make_snapshot_key(worker_id=''):
+        return 'task:metrics:{}'.format(worker_id)
+
+    @staticmethod
+    def _new_task_metrics():
+        metrics = dict(lag=Histogram(LAG_BUCKETS), duration=Histogram(DURATION_BUCKETS))
+        metrics.update((name, 0) for name in COUNTER_NAMES)
+        return metrics
+
+    def _get(self, task_name):
+        # Must be called with the lock held
+        metrics = self._tasks.get(task_name)
+        if metrics is None:
+            metrics = self._tasks[task_name] = self._new_task_metrics()
+        return metrics
+
+    def observe_lag(self, task_name, seconds):
+        with self._lock:
+            self._get(task_name)['lag'].observe(max(seconds, 0.0))
+
+    def observe_duration(self, task_name, seconds):
+        with self._lock:
+            self._get(task_name)['duration'].observe(seconds)
+
+    def incr(self, task_name, counter_name, count=1):
+        with self._lock:
+            self._get(task_name)[counter_name] += count
+
+    def reset(self):
+        with self._lock:
+            self._tasks = {}
+
+    def snapshot(self):
+        """
+        {task_name: {'lag': {'counts': [...], 'sum': ...}, 'duration': {...}, 'success': int, ...}}
+        """
+        with self._lock:
+            return {
+                task_name: {
+                    name: value.to_dict() if isinstance(value, Histogram) else value
+                    for name, value in metrics.items()
+                } for task_name, metrics in self._tasks.items()
+            }
+
+    def export(self, worker_id, ex):
+        """
+        Save the snapshot of current process to redis for `ex` seconds, called by the heartbeat
+        """
+        self._register_scripts()
+        snapshot = self.snapshot()
+        if not snapshot:
+            return
+        self._export_snapshot(
+            keys=[self._make_snapshot_key(worker_id), self._make_snapshot_key('workers')],
+            args=[worker_id, json_encode(snapshot), ex, '{:.6f}'.format(time.time() + ex)]
+        )
+
+    def collect(self):
+        """
+        The snapshots of all live workers, {worker_id: snapshot}
+        """
+        self._register_scripts()
+        values = self._collect_snapshots(
+            keys=[self._make_snapshot_key(), self._make_snapshot_key('workers')],
+            args=['{:.6f}'.format(time.time())]
+        )
+        return {worker_id: json_decode(snapshot) for worker_id, snapshot in zip(values[::2], values[1::2])}
+
+
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for task_name, metrics in snapshot.items():
+            if task_name not in merged:
+                merged[task_name] = json_decode(json_encode(metrics))
+                continue
+            merged_metrics = merged[task_name]
+            for name, value in metrics.items():
+                if isinstance(value, dict):
+                    merged_value = merged_metrics[name]
+                    merged_value['counts'] = [a + b for a, b in zip(merged_value['counts'], value['counts'])]
+                    merged_value['sum'] += value['sum']
+                else:
+                    merged_metrics[name] = merged_metrics.get(name, 0) + value
+    return merged
+
+
+def estimate_quantile(histogram: dict, buckets, quantile):
+    """
+    Estimate the quantile by linear interpolation within the bucket, like `histogram_quantile` of Prometheus
+
+    Return None if no observation, the upper bound of the last finite bucket if it falls into +Inf
+    """
+    total = sum(histogram['counts'])
+    if not total:
+        return None
+    rank = quantile * total
+    cumulative = 0
+    for i, count in enumerate(histogram['counts']):
+        if cumulative + count >= rank and count:
+            if i == len(buckets):
+                return buckets[-1]
+            lower = buckets[i - 1] if i else 0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_bound(bound):
+    return '{:g}'.format(bound)
+
+
+def _iter_series(snapshots):
+    """
+    Yield (labels, metrics) of each worker and task name
+    """
+    for worker_id, snapshot in sorted(snapshots.items()):
+        for task_name, metrics in sorted(snapshot.items()):
+            yield f'worker="{_escape_label(worker_id)}",task_name="{_escape_label(task_name)}"', metrics
+
+
+def render_prometheus(snapshots):
+    """
+    Render the snapshots {worker_id: snapshot} in the Prometheus text exposition format (version 0.0.4)
+
+    The series are labeled by worker, so a counter only resets when its worker restarts, sum them by task_name
+    in the queries.
+    """
+    lines = []
+    for metric_name, key, buckets, help_text in (
+            ('task_lag_seconds', 'lag', LAG_BUCKETS, 'Seconds from run_at to the task started'),
+            ('task_duration_seconds', 'duration', DURATION_BUCKETS, 'Seconds of executing the task func'),
+    ):
+        lines.append(f'# HELP {metric_name} {help_text}')
+        lines.append(f'# TYPE {metric_name} histogram')
+        for label, metrics in _iter_series(snapshots):
+            histogram = metrics[key]
+            cumulative = 0
+            for bound, count in zip(buckets + (None,), histogram['counts']):
+                cumulative += count
+                le = '+Inf' if bound is None else _format_bound(bound)
+                lines.append(f'{metric_name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'{metric_name}_sum{{{label}}} {histogram["sum"]}')
+            lines.append(f'{metric_name}_count{{{label}}} {cumulative}')
+
+    lines.append('# HELP task_runs_total Count of task results')
+    lines.append('# TYPE task_runs_total counter')
+    for label, metrics in _iter_series(snapshots):
+        for result in ('success', 'failure', 'retry'):
+            lines.append(f'task_runs_total{{{label},result="{result}"}} {metrics.get(result, 0)}')
+
+    lines.append('# HELP task_claim_contention_total Count of optimistic updates lost to another worker')
+    lines.append('# TYPE task_claim_contention_total counter')
+    for label, metrics in _iter_series(snapshots):
+        lines.append(f'task_claim_contention_total{{{label}}} {metrics.get("contention", 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+task_metrics = TaskMetrics()
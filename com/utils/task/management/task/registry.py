@@ -0,0 +1,83 @@
+import logging
+from importlib import import_module
+from threading import RLock
+
+#
+logger = logging.getLogger(__name__)
+
+
+class TaskRegistry:
+    """
+    Task registry {task_name: task_func}
+
+    The task func is registered when decorated by `cron_task`, so importing the task modules warms the registry.
+    The task func not registered yet is imported by its task name `module:func` on the first use.
+    """
+
+    def __init__(self):
+        self._task_funcs = {}
+        # Reentrant, importing a task module registers its task funcs
+        self._lock = RLock()
+
+    def __contains__(self, task_name):
+        return task_name in self._task_funcs
+
+    def __len__(self):
+        return len(self._task_funcs)
+
+    def register(self, task_name, task_func):
+        with self._lock:
+            registered_task_func = self._task_funcs.get(task_name)
+            if registered_task_func is not None and registered_task_func is not task_func:
+                logger.warning(f'Task func is registered again, task_name: {task_name}')
+            self._task_funcs[task_name] = task_func
+
+    def get(self, task_name):
+        """
+        Get the task func, import it if not registered
+        """
+        task_func = self._task_funcs.get(task_name)
+        if task_func is not None:
+            return task_func
+        with self._lock:
+            task_func = self._task_funcs.get(task_name)
+            if task_func is None:
+                task_func = self._import(task_name)
+        return task_func
+
+    def lookup(self, task_name):
+        """
+        Get the registered task func without importing, None if not registered
+        """
+        return self._task_funcs.get(task_name)
+
+    def _import(self, task_name):
+        module_name, func_name = task_name.split(':')
+        task_func = getattr(import_module(module_name), func_name)
+        self._task_funcs[task_name] = task_func
+        logger.info(f'Import task func successfully. task_name: {task_name}')
+        return task_func
+
+    def import_modules(self, module_names):
+        """
+        Import the task modules, the task funcs in them are registered
+        """
+        for module_name in module_names:
+            import_module(module_name)
+        logger.info(f'Import task modules successfully. modules: {module_names}, task funcs: {len(self)}')
+
+    def resolve(self, task_names):
+        """
+        Import the task funcs of the task names, return the unresolved task names
+        """
+        unresolved_task_names = []
+        for task_name in task_names:
+            try:
+                self.get(task_name)
+            except (ImportError, AttributeError, ValueError) as _:
+                logger.exception(f'Import task func failed. task_name: {task_name}')
+                unresolved_task_names.append(task_name)
+        return unresolved_task_names
+
+
+task_registry = TaskRegistry()
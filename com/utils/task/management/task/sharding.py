@@ -0,0 +1,85 @@
+import time
+
+from .engines import DEFAULT_LEASE_SECONDS, DEFAULT_SHARD_COUNT, task_conf
+
+# KEYS: nodes
+# ARGV: now, node_id, expires_at, key_ex
+# Drop the expired nodes, add or renew the node, and return all the live nodes
+JOIN_NODE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+
+# KEYS: nodes
+# ARGV: node_id
+LEAVE_NODE_SCRIPT = """
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+
+def get_shard_range(index, node_count, shard_count):
+    """
+    The shard range `[start, end)` of the `index`-th node, the end of the last node is None (unbounded),
+    so the tasks created with a larger shard count are still claimed
+    """
+    start = index * shard_count // node_count
+    end = None if index == node_count - 1 else (index + 1) * shard_count // node_count
+    return start, end
+
+
+class ShardMembership:
+    """
+    The live nodes polling tasks, each node claims the tasks in its own shard range
+
+    The nodes are in the sorted set `task:nodes`, scored by the expiry of each node. Each node renews itself by
+    the heartbeat and gets the shard range by its index in the sorted node ids, so the ranges are rebalanced
+    within a heartbeat when a node joins or leaves. The crashed node expires after `node_seconds`.
+    """
+
+    key = 'task:nodes'
+
+    def __init__(self, client=None, shard_count: int = DEFAULT_SHARD_COUNT, node_seconds: int = DEFAULT_LEASE_SECONDS):
+        self._client = client
+        self.shard_count = shard_count
+        self.node_seconds = node_seconds
+        self._join_node = None
+        self._leave_node = None
+
+    def _register_scripts(self):
+        """
+        Register the scripts on first use, the client is `utils.caches.cache` by default
+        """
+        if self._join_node is not None:
+            return
+        client = self._client
+        if client is None:
+            from utils.caches import cache as client
+        self._join_node = client.register_script(JOIN_NODE_SCRIPT)
+        self._leave_node = client.register_script(LEAVE_NODE_SCRIPT)
+
+    def join(self, node_id):
+        """
+        Add or renew the node, return its shard range
+        """
+        self._register_scripts()
+        now = time.time()
+        node_ids = sorted(self._join_node(
+            keys=[self.key],
+            args=['{:.6f}'.format(now), node_id, '{:.6f}'.format(now + self.node_seconds), self.node_seconds * 2]
+        ))
+        return get_shard_range(node_ids.index(node_id), len(node_ids), self.shard_count)
+
+    def leave(self, node_id):
+        """
+        Remove the node, its shards are taken over by the other nodes at their next heartbeat
+        """
+        self._register_scripts()
+        self._leave_node(keys=[self.key], args=[node_id])
+
+
+shard_membership = ShardMembership(
+    shard_count=task_conf.get('shard_count', DEFAULT_SHARD_COUNT),
+    node_seconds=task_conf.get('heartbeat_seconds', 10) * 3,
+)
@@ -0,0 +1,98 @@
+import time
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel
+
+    The level 0 wheel has `slot_count` slots of `tick` seconds, a slot of level N covers the whole wheel of
+    level N-1. The timers of an upper level slot are cascaded to the lower levels when the slot is reached.
+    Adding a timer and advancing a tick are O(1), no matter how many timers are in the wheel.
+
+    Not thread safe.
+    """
+
+    def __init__(self, tick: float = 0.1, slot_count: int = 64, level_count: int = 3):
+        self.tick = tick
+        self.slot_count = slot_count
+        self.level_count = level_count
+        #
+        self._wheels = [[[] for _ in range(slot_count)] for _ in range(level_count)]
+        # The timers beyond the range of the top level, re-added when the top level is cascaded
+        self._overflow = []
+        # The timers expired when added
+        self._expired = []
+        self._current_tick = self._to_tick(time.time())
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _to_tick(self, timestamp):
+        return int(timestamp / self.tick)
+
+    def _place(self, expire_tick, item):
+        delta = expire_tick - self._current_tick
+        if delta <= 0:
+            self._expired.append(item)
+            return
+        for level in range(self.level_count):
+            if delta < self.slot_count ** (level + 1):
+                slot = (expire_tick // self.slot_count ** level) % self.slot_count
+                self._wheels[level][slot].append((expire_tick, item))
+                return
+        self._overflow.append((expire_tick, item))
+
+    def add(self, expire_at: float, item):
+        """
+        Add a timer expired at the timestamp `expire_at`
+        """
+        self._place(self._to_tick(expire_at), item)
+        self._count += 1
+
+    def _cascade(self, level):
+        """
+        Move the timers of current slot of `level` to lower levels
+        """
+        if level >= self.level_count:
+            timers, self._overflow = self._overflow, []
+        else:
+            slot = (self._current_tick // self.slot_count ** level) % self.slot_count
+            timers, self._wheels[level][slot] = self._wheels[level][slot], []
+        for expire_tick, item in timers:
+            self._place(expire_tick, item)
+
+    def advance(self, now: float = None):
+        """
+        Advance the wheel to `now`, return the expired items
+        """
+        expired, self._expired = self._expired, []
+        target_tick = self._to_tick(time.time() if now is None else now)
+        while self._current_tick < target_tick:
+            self._current_tick += 1
+            # Cascade from the top level if the lower wheel wraps around
+            level = 1
+            while level <= self.level_count and self._current_tick % self.slot_count ** level == 0:
+                level += 1
+            for _level in range(level - 1, 0, -1):
+                self._cascade(_level)
+            slot = self._current_tick % self.slot_count
+            timers, self._wheels[0][slot] = self._wheels[0][slot], []
+            expired.extend(item for _, item in timers)
+            expired.extend(self._expired)
+            self._expired = []
+        self._count -= len(expired)
+        return expired
+
+    def pop_all(self):
+        """
+        Remove and return all the items
+        """
+        items = [item for _, item in self._overflow] + self._expired
+        for wheel in self._wheels:
+            for slot in wheel:
+                items.extend(item for _, item in slot)
+                slot.clear()
+        self._overflow, self._expired = [], []
+        self._count = 0
+        return items
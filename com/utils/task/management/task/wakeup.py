@@ -0,0 +1,162 @@
+import heapq
+import logging
+import time
+from threading import Lock, Thread
+
+from .engines import task_conf
+
+#
+logger = logging.getLogger(__name__)
+
+# Idle sleep time
+idle_sleep_seconds_min = 2
+idle_sleep_seconds_max = task_conf.get('idle_sleep_seconds_max', 10)
+# Wait timeout for receiving wakeup message
+listen_timeout = 1
+# Sleep time after listening failed
+listen_retry_interval = 3
+# Skip notifying for the seconds after notifying failed, such as redis is down, the failure is logged once
+notify_retry_interval = 10
+# The max count of notified run_at kept by the backoff, the latest ones are dropped beyond it
+notified_run_at_max_count = 1024
+
+
+class IdleBackoff:
+    """
+    Exponential backoff of the idle sleep
+
+    The sleep is shortened to the earliest notified `run_at` not passed yet, so a task in the future runs on time.
+    The sleep is doubled only after a full idle sleep, not woken up early or shortened.
+    """
+
+    def __init__(self, min_seconds=idle_sleep_seconds_min, max_seconds=idle_sleep_seconds_max):
+        self.min_seconds = min_seconds
+        self.max_seconds = max(min_seconds, max_seconds)
+        #
+        self._seconds = min_seconds
+        # The heap of notified future run_at (timestamp)
+        self._run_ats = []
+        # The time the last sleep would end if not woken up
+        self._sleep_until = None
+        self._lock = Lock()
+
+    def reset(self):
+        with self._lock:
+            self._seconds = self.min_seconds
+            self._sleep_until = None
+
+    def notify(self, run_at: float):
+        with self._lock:
+            if run_at <= time.time():
+                self._seconds = self.min_seconds
+                return
+            heapq.heappush(self._run_ats, run_at)
+            if len(self._run_ats) > notified_run_at_max_count:
+                self._run_ats = heapq.nsmallest(notified_run_at_max_count // 2, self._run_ats)
+
+    def next_timeout(self):
+        """
+        Get the next sleep time, doubled if the last sleep timed out
+        """
+        with self._lock:
+            now = time.time()
+            # Not doubled if woken up early
+            if self._sleep_until is not None and now >= self._sleep_until:
+                self._seconds = min(self._seconds * 2, self.max_seconds)
+            timeout = self._seconds
+            # The passed run_at are due now
+            due = False
+            while self._run_ats and self._run_ats[0] <= now:
+                heapq.heappop(self._run_ats)
+                due = True
+            if due:
+                timeout = 0
+            elif self._run_ats:
+                timeout = min(timeout, self._run_ats[0] - now)
+            # Only the full idle sleep is doubled next time
+            self._sleep_until = now + timeout if timeout == self._seconds else None
+            return timeout
+
+
+class TaskWakeup:
+    """
+    Wake up the idle task dispatchers by redis pub/sub
+
+    The message is the `run_at` timestamp of added or updated task.
+    """
+
+    channel = 'task:wakeup'
+
+    def __init__(self, enabled: bool = False, client=None):
+        self.enabled = enabled
+        self._client = client
+        #
+        self._notify_failed_at = None
+        self._listeners = []
+        self._thread = None
+        self._stopped = False
+
+    @property
+    def client(self):
+        if self._client is None:
+            from utils.caches import cache
+            self._client = cache
+        return self._client
+
+    def notify(self, run_at=None):
+        """
+        Notify the dispatchers, never raise. Skipped for `notify_retry_interval` seconds after failed, the
+        dispatchers still poll by the idle sleep
+        """
+        if not self.enabled:
+            return
+        failed_at = self._notify_failed_at
+        if failed_at is not None and time.monotonic() - failed_at < notify_retry_interval:
+            return
+        run_at = run_at.timestamp() if run_at else time.time()
+        try:
+            self.client.publish(self.channel, run_at)
+        except Exception as e:
+            self._notify_failed_at = time.monotonic()
+            logger.warning(f'Notify task wakeup failed, skip notifying in {notify_retry_interval}s. error: {e!r}')
+        else:
+            self._notify_failed_at = None
+
+    def add_listener(self, callback):
+        """
+        Call `callback(run_at)` when received a wakeup message, start listening if not started
+        """
+        if not self.enabled:
+            return
+        self._listeners.append(callback)
+        if self._thread is None:
+            self._stopped = False
+            self._thread = Thread(target=self._listen, name='Task-wakeup-listener', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def _listen(self):
+        pubsub = None
+        while not self._stopped:
+            try:
+                if pubsub is None:
+                    pubsub = self.client.pubsub(self.channel)
+                message = pubsub.get_message(timeout=listen_timeout)
+            except Exception as _:
+                logger.exception('Listen task wakeup failed')
+                pubsub = None
+                time.sleep(listen_retry_interval)
+                continue
+            if not message:
+                continue
+            run_at = float(message['data'])
+            for callback in self._listeners:
+                callback(run_at)
+        if pubsub is not None:
+            pubsub.close()
+        self._thread = None
+
+
+task_wakeup = TaskWakeup(enabled=task_conf.get('wakeup', False))
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:06
+
+from django.db import migrations, models
+import utils.serializers
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trace_id', models.UUIDField(default=uuid.uuid4)),
+                ('task_name', models.CharField(max_length=128)),
+                ('task_attr', models.CharField(max_length=64)),
+                ('task_args', models.JSONField(default=list, encoder=utils.serializers.JsonEncoder)),
+                ('task_kwargs', models.JSONField(default=dict, encoder=utils.serializers.JsonEncoder)),
+                ('extra', models.JSONField(default=dict, encoder=utils.serializers.JsonEncoder)),
+                ('run_at', models.DateTimeField()),
+                ('status', models.CharField(max_length=12)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('remark', models.CharField(max_length=128, null=True)),
+                ('exc_info', models.TextField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'utils_task',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['run_at'], name='utils_task_run_at_a8370b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status'], name='utils_task_status_f326fc_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(fields=('task_name', 'task_attr'), name='unique_task_ident'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='worker_id',
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
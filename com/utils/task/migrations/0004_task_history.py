@@ -0,0 +1,59 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:07
+
+from django.db import migrations, models
+import utils.serializers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0003_task_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.BigIntegerField()),
+                ('trace_id', models.UUIDField()),
+                ('task_name', models.CharField(max_length=128)),
+                ('task_attr', models.CharField(max_length=64)),
+                ('task_args', models.JSONField(default=list, encoder=utils.serializers.JsonEncoder)),
+                ('task_kwargs', models.JSONField(default=dict, encoder=utils.serializers.JsonEncoder)),
+                ('extra', models.JSONField(default=dict, encoder=utils.serializers.JsonEncoder)),
+                ('run_at', models.DateTimeField()),
+                ('status', models.CharField(max_length=12)),
+                ('worker_id', models.CharField(max_length=64, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('remark', models.CharField(max_length=128, null=True)),
+                ('exc_info', models.TextField(null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'utils_task_history',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'run_at'], name='utils_task_status_97ccfa_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='utils_task_run_at_a8370b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='utils_task_status_f326fc_idx',
+        ),
+        migrations.AddIndex(
+            model_name='taskhistory',
+            index=models.Index(fields=['task_name', 'task_attr'], name='utils_task__task_na_55b0b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskhistory',
+            index=models.Index(fields=['archived_at'], name='utils_task__archive_a7fadd_idx'),
+        ),
+    ]
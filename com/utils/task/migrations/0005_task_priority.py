@@ -0,0 +1,31 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0004_task_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='max_concurrency',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='priority',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', '-priority', 'run_at'], name='utils_task_status_6b4076_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='utils_task_status_97ccfa_idx',
+        ),
+    ]
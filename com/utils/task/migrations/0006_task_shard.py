@@ -0,0 +1,48 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:22
+
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The tasks updated by one UPDATE statement
+FILL_SHARD_BATCH_SIZE = 1000
+
+
+def fill_shard(apps, schema_editor):
+    """
+    Set the shard of the existing unfinished tasks, the same as `MySQLTaskEngine.make_shard`
+    """
+    Task = apps.get_model('task', 'Task')
+    shard_count = getattr(settings, 'TASK_CONF', {}).get('shard_count', 64)
+    tasks = Task.objects.filter(status__in=['waiting', 'pending', 'running']).only('task_name', 'task_attr')
+    batch = []
+    for task in tasks.iterator(chunk_size=FILL_SHARD_BATCH_SIZE):
+        task.shard = zlib.crc32('{}:{}'.format(task.task_name, task.task_attr).encode()) % shard_count
+        if task.shard:
+            batch.append(task)
+        if len(batch) >= FILL_SHARD_BATCH_SIZE:
+            Task.objects.bulk_update(batch, ['shard'])
+            batch = []
+    if batch:
+        Task.objects.bulk_update(batch, ['shard'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0005_task_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_shard, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'shard', 'run_at'], name='utils_task_status_275e7f_idx'),
+        ),
+    ]
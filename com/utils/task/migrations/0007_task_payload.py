@@ -0,0 +1,51 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:25
+
+from django.db import migrations, models
+import utils.serializers
+import utils.task.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0006_task_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskPayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40, unique=True)),
+                ('data', models.BinaryField()),
+                ('referenced_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'utils_task_payload',
+            },
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='task_args',
+            field=utils.task.fields.PayloadField(default=list, encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='task_kwargs',
+            field=utils.task.fields.PayloadField(default=dict, encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AlterField(
+            model_name='taskhistory',
+            name='task_args',
+            field=utils.task.fields.PayloadField(default=list, encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AlterField(
+            model_name='taskhistory',
+            name='task_kwargs',
+            field=utils.task.fields.PayloadField(default=dict, encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AddIndex(
+            model_name='taskpayload',
+            index=models.Index(fields=['referenced_at'], name='utils_task__referen_4ab981_idx'),
+        ),
+    ]
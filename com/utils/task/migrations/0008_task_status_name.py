@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0007_task_payload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'task_name'], name='utils_task_status_ee1743_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0008_task_status_name'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='task',
+            name='utils_task_status_275e7f_idx',
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'shard', '-priority', 'run_at'], name='utils_task_status_5b06dd_idx'),
+        ),
+    ]
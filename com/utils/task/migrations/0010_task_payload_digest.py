@@ -0,0 +1,83 @@
+# Generated by Django 3.2.5 on 2026-10-18 20:51
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models.fields.json import KeyTextTransform
+import utils.serializers
+import utils.task.fields
+
+# The rows updated by one UPDATE statement
+FILL_DIGEST_BATCH_SIZE = 1000
+
+
+def fill_digest(apps, schema_editor):
+    """
+    Set the digest of the offloaded payloads `{"$blob": <digest>}` of the existing tasks and task histories
+    """
+    for model_name in ('Task', 'TaskHistory'):
+        model = apps.get_model('task', model_name)
+        for field_name in ('task_args', 'task_kwargs'):
+            rows = model.objects.filter(**{f'{field_name}__has_key': utils.task.fields.OFFLOADED_KEY}).annotate(
+                digest=KeyTextTransform(utils.task.fields.OFFLOADED_KEY, field_name)
+            ).values_list('pk', 'digest')
+            # {digest: [pk, ...]}
+            digest_pks = defaultdict(list)
+            for pk, digest in rows.iterator():
+                digest_pks[digest].append(pk)
+            for digest, pks in digest_pks.items():
+                for i in range(0, len(pks), FILL_DIGEST_BATCH_SIZE):
+                    model.objects.filter(pk__in=pks[i:i + FILL_DIGEST_BATCH_SIZE]).update(
+                        **{f'{field_name}_digest': digest}
+                    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0009_task_shard_priority_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='task_args_digest',
+            field=models.CharField(db_index=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='task_kwargs_digest',
+            field=models.CharField(db_index=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='taskhistory',
+            name='task_args_digest',
+            field=models.CharField(db_index=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='taskhistory',
+            name='task_kwargs_digest',
+            field=models.CharField(db_index=True, max_length=40, null=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='task_args',
+            field=utils.task.fields.PayloadField(default=list, digest_field='task_args_digest', encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='task_kwargs',
+            field=utils.task.fields.PayloadField(default=dict, digest_field='task_kwargs_digest', encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AlterField(
+            model_name='taskhistory',
+            name='task_args',
+            field=utils.task.fields.PayloadField(default=list, digest_field='task_args_digest', encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.AlterField(
+            model_name='taskhistory',
+            name='task_kwargs',
+            field=utils.task.fields.PayloadField(default=dict, digest_field='task_kwargs_digest', encoder=utils.serializers.JsonEncoder),
+        ),
+        migrations.RunPython(fill_digest, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ import uuid
 
 from django.db import models
 
+from .fields import PayloadField
 from utils.serializers import JsonEncoder
 
 
@@ -15,12 +16,25 @@ class Task(models.Model):
     trace_id = models.UUIDField(default=uuid.uuid4)
     task_name = models.CharField(max_length=128)
     task_attr = models.CharField(max_length=64)
-    task_args = models.JSONField(default=list, encoder=JsonEncoder)
-    task_kwargs = models.JSONField(default=dict, encoder=JsonEncoder)
+    # The large payload is compressed or offloaded, and deferred by the poll
+    task_args = PayloadField(default=list, encoder=JsonEncoder, digest_field='task_args_digest')
+    task_kwargs = PayloadField(default=dict, encoder=JsonEncoder, digest_field='task_kwargs_digest')
+    # The digest of the offloaded payload, set by the payload field so declared after it
+    task_args_digest = models.CharField(max_length=40, null=True, db_index=True)
+    task_kwargs_digest = models.CharField(max_length=40, null=True, db_index=True)
     extra = models.JSONField(default=dict, encoder=JsonEncoder)
     run_at = models.DateTimeField()
     status = models.CharField(max_length=12)
     version = models.PositiveIntegerField(default=0)
+    # The higher priority task is claimed first
+    priority = models.SmallIntegerField(default=0)
+    # The max count of running tasks of the task name across workers, no limit if null
+    max_concurrency = models.PositiveIntegerField(null=True)
+    # crc32(task_name:task_attr) % shard_count, each node claims the tasks in its shard range if sharding enabled
+    shard = models.PositiveSmallIntegerField(default=0)
+    worker_id = models.CharField(max_length=64, null=True)
+    lease_expires_at = models.DateTimeField(null=True)
+    attempts = models.PositiveIntegerField(default=0)
     remark = models.CharField(max_length=128, null=True)
     exc_info = models.TextField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -31,25 +45,92 @@ class Task(models.Model):
             models.UniqueConstraint(fields=['task_name', 'task_attr'], name='unique_task_ident')
         ]
         indexes = [
-            models.Index(fields=['run_at']),
-            models.Index(fields=['status']),
+            # Poll the waiting tasks: status = 'waiting' AND run_at <= now ORDER BY priority DESC, run_at
+            models.Index(fields=['status', '-priority', 'run_at']),
+            # Poll the waiting tasks of the shard range of the node if sharding enabled, in the same order
+            models.Index(fields=['status', 'shard', '-priority', 'run_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
+            # The distinct task names of the waiting tasks, preloaded at startup
+            models.Index(fields=['status', 'task_name']),
         ]
         db_table = 'utils_task'
 
     def to_dict(self):
-        return dict(
+        # The deferred fields (the payload of the claimed task) are skipped, not loaded for logging
+        deferred_fields = self.get_deferred_fields()
+        data = dict(
             id=self.pk,
             trace_id=str(self.trace_id),
             task_name=self.task_name,
             task_attr=self.task_attr,
-            task_args=self.task_args,
-            task_kwargs=self.task_kwargs,
+            task_args=None if 'task_args' in deferred_fields else self.task_args,
+            task_kwargs=None if 'task_kwargs' in deferred_fields else self.task_kwargs,
             extra=self.extra,
             run_at=str(self.run_at),
             status=self.status,
             version=self.version,
+            priority=self.priority,
+            max_concurrency=self.max_concurrency,
+            shard=self.shard,
+            worker_id=self.worker_id,
+            lease_expires_at=str(self.lease_expires_at) if self.lease_expires_at else None,
+            attempts=self.attempts,
             remark=self.remark,
             exc_info=self.exc_info,
             created_at=str(self.created_at),
             updated_at=str(self.updated_at),
         )
+        return {key: value for key, value in data.items() if key not in deferred_fields}
+
+
+class TaskHistory(models.Model):
+    """
+    Task history model
+
+    The finished/failed tasks archived from `utils_task`, keep the poll of `utils_task` on a small working set
+    """
+    task_id = models.BigIntegerField()
+    trace_id = models.UUIDField()
+    task_name = models.CharField(max_length=128)
+    task_attr = models.CharField(max_length=64)
+    task_args = PayloadField(default=list, encoder=JsonEncoder, digest_field='task_args_digest')
+    task_kwargs = PayloadField(default=dict, encoder=JsonEncoder, digest_field='task_kwargs_digest')
+    task_args_digest = models.CharField(max_length=40, null=True, db_index=True)
+    task_kwargs_digest = models.CharField(max_length=40, null=True, db_index=True)
+    extra = models.JSONField(default=dict, encoder=JsonEncoder)
+    run_at = models.DateTimeField()
+    status = models.CharField(max_length=12)
+    worker_id = models.CharField(max_length=64, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    remark = models.CharField(max_length=128, null=True)
+    exc_info = models.TextField(null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task_name', 'task_attr']),
+            models.Index(fields=['archived_at']),
+        ]
+        db_table = 'utils_task_history'
+
+
+class TaskPayload(models.Model):
+    """
+    Task payload model
+
+    The large task_args/task_kwargs offloaded from `utils_task` and `utils_task_history`, stored once by the digest
+    of the JSON, see `PayloadField`
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    # zlib compressed JSON
+    data = models.BinaryField()
+    # Set when stored again, the payload not referenced since long ago is purged if no task refers to its digest
+    referenced_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['referenced_at']),
+        ]
+        db_table = 'utils_task_payload'
@@ -0,0 +1,147 @@
+import bisect
+import datetime
+from enum import Enum
+
+from utils.exceptions import CodeError
+
+
+class MisfirePolicy(Enum):
+    """
+    What to do with the firing started later than `misfire_grace_seconds` after its run_at
+
+    - run_once: Run it once, the other missed firings are skipped
+    - catch_up: Run all the missed firings one by one
+    - skip: Don't run it, schedule the next firing after now
+    """
+    RUN_ONCE = 'run_once'
+    CATCH_UP = 'catch_up'
+    SKIP = 'skip'
+
+
+class Schedule:
+    def next_run_at(self, after: datetime.datetime) -> datetime.datetime:
+        """
+        The first fire time later than `after`
+        """
+        raise NotImplementedError
+
+
+class Interval(Schedule):
+    """
+    Fire every fixed interval
+
+    Example:
+        Interval(minutes=5)
+    """
+
+    def __init__(self, days=0, hours=0, minutes=0, seconds=0):
+        self.interval = datetime.timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+        if self.interval <= datetime.timedelta(0):
+            raise CodeError('interval must be positive')
+
+    def next_run_at(self, after: datetime.datetime) -> datetime.datetime:
+        return after + self.interval
+
+    def __repr__(self):
+        return f'Interval({self.interval})'
+
+
+class Crontab(Schedule):
+    """
+    Fire at the times matching a cron expression: `minute hour day month weekday`
+
+    Each field supports `*`, `n`, `a-b`, `*/step`, `a-b/step` and lists of them separated by `,`.
+    Weekday is 0-6 from Sunday, 7 is also Sunday. If both day and weekday are restricted, the time
+    matching either is fired, the same as cron.
+
+    The expression is compiled into the sorted allowed values of each field once, the next fire time
+    is found field by field instead of minute by minute.
+
+    Example:
+        Crontab('*/15 9-18 * * 1-5')
+    """
+
+    # (min, max) of each field
+    field_ranges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    # Give up if no fire time within the years, such as `0 0 30 2 *`
+    max_search_years = 8
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise CodeError(f'invalid cron expression: {expression}')
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(field, *field_range) for field, field_range in zip(fields, self.field_ranges)
+        ]
+        self.weekdays = sorted({weekday % 7 for weekday in weekdays})
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+        self._day_set = set(self.days)
+        self._weekday_set = set(self.weekdays)
+
+    @staticmethod
+    def _parse_field(field, min_value, max_value):
+        values = set()
+        for part in field.split(','):
+            value_range, _, step = part.partition('/')
+            if value_range == '*':
+                start, end = min_value, max_value
+            elif '-' in value_range:
+                start, end = (int(value) for value in value_range.split('-', 1))
+            else:
+                start = int(value_range)
+                end = max_value if step else start
+            step = int(step) if step else 1
+            if not (min_value <= start <= end <= max_value) or step <= 0:
+                raise CodeError(f'invalid cron field: {field}')
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    @staticmethod
+    def _next_value(values, value):
+        """
+        The first allowed value >= value, None if no such value
+        """
+        i = bisect.bisect_left(values, value)
+        return values[i] if i < len(values) else None
+
+    def _match_day(self, date: datetime.date):
+        # date.weekday() is 0 for Monday, cron weekday is 0 for Sunday
+        day_matched = date.day in self._day_set
+        weekday_matched = (date.weekday() + 1) % 7 in self._weekday_set
+        if self.day_restricted and self.weekday_restricted:
+            return day_matched or weekday_matched
+        return day_matched and weekday_matched
+
+    def next_run_at(self, after: datetime.datetime) -> datetime.datetime:
+        run_at = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        max_year = run_at.year + self.max_search_years
+        while run_at.year <= max_year:
+            month = self._next_value(self.months, run_at.month)
+            if month is None:
+                run_at = run_at.replace(year=run_at.year + 1, month=1, day=1, hour=0, minute=0)
+                continue
+            if month != run_at.month:
+                run_at = run_at.replace(month=month, day=1, hour=0, minute=0)
+
+            if not self._match_day(run_at.date()):
+                run_at = (run_at + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+
+            hour = self._next_value(self.hours, run_at.hour)
+            if hour is None:
+                run_at = (run_at + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if hour != run_at.hour:
+                run_at = run_at.replace(hour=hour, minute=0)
+
+            minute = self._next_value(self.minutes, run_at.minute)
+            if minute is None:
+                run_at = (run_at + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            return run_at.replace(minute=minute)
+        raise CodeError(f'no fire time of cron expression: {self.expression}')
+
+    def __repr__(self):
+        return f'Crontab({self.expression!r})'
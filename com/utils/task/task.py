@@ -1,18 +1,44 @@
 import datetime
+import functools
 import os
 import sys
 import inspect
 
 from .management.task import api as taskapi
+from .management.task.constants import DEFAULT_TASK_PRIORITY
+from .management.task.registry import task_registry
+from .schedules import MisfirePolicy, Schedule
 from utils.exceptions import CodeError
 
+# The firing started later than the seconds after its run_at is misfired
+DEFAULT_MISFIRE_GRACE_SECONDS = 60
+
 
 class CronTask:
-    def __init__(self, task_func):
+    def __init__(
+            self,
+            task_func,
+            priority: int = DEFAULT_TASK_PRIORITY,
+            max_concurrency: int = None,
+            schedule: Schedule = None,
+            misfire_policy: str = MisfirePolicy.RUN_ONCE.value,
+            misfire_grace_seconds: int = DEFAULT_MISFIRE_GRACE_SECONDS,
+    ):
         self._check_task_func(task_func)
         self.task_func = task_func
         self.task_name = self._gen_task_name(task_func)
+        # The higher priority task is claimed first
+        self.priority = priority
+        # The max count of running tasks of the task name across workers, no limit if None
+        self.max_concurrency = max_concurrency
+        # The recurring task is rescheduled by the schedule after each firing instead of deleted
+        self.schedule = schedule
+        self.misfire_policy = MisfirePolicy(misfire_policy).value
+        self.misfire_grace = datetime.timedelta(seconds=misfire_grace_seconds)
         self.task_func._cron_task = True
+        task_registry.register(self.task_name, self)
+        # `async def` task func is executed on an event loop
+        self.is_coroutine = inspect.iscoroutinefunction(task_func)
 
     def __call__(self, *args, **kwargs):
         return self.task_func(*args, **kwargs)
@@ -20,9 +46,9 @@ class CronTask:
     @staticmethod
     def _check_task_func(task_func):
         """
-        Check task func
+        Check task func, both function and coroutine function are allowed
         """
-        if not inspect.isfunction(task_func):
+        if not (inspect.isfunction(task_func) or inspect.iscoroutinefunction(task_func)):
             raise CodeError('task func required')
 
     def _gen_task_name(self, task_func):
@@ -35,6 +61,27 @@ class CronTask:
             module_name = os.path.splitext(os.path.basename(main_file))[0]
         return '{}:{}'.format(module_name, task_func.__name__)
 
+    def is_misfired(self, run_at: datetime.datetime, started_at: datetime.datetime):
+        return started_at - run_at > self.misfire_grace
+
+    def next_run_at(self, run_at: datetime.datetime, started_at: datetime.datetime, now: datetime.datetime = None):
+        """
+        The run_at of the next firing after the firing of `run_at` started at `started_at`
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        if self.misfire_policy == MisfirePolicy.CATCH_UP.value:
+            return self.schedule.next_run_at(run_at)
+
+        # The misfired firing is run once at `started_at`
+        next_run_at = self.schedule.next_run_at(started_at if self.is_misfired(run_at, started_at) else run_at)
+        if next_run_at > now:
+            return next_run_at
+        # The next firing passed while running
+        if self.misfire_policy == MisfirePolicy.RUN_ONCE.value:
+            return now
+        return self.schedule.next_run_at(now)
+
     def cron_task(
             self,
             task_attr,
@@ -42,17 +89,34 @@ class CronTask:
             extra: dict = None,
             remark: str = None
     ):
+        # The recurring task is fired by the schedule if not set run_at
+        if run_at is None and self.schedule is not None:
+            run_at = self.schedule.next_run_at(datetime.datetime.now())
         return _TaskController(task_name=self.task_name,
-                               task_attr=task_attr, run_at=run_at, extra=extra, remark=remark)
+                               task_attr=task_attr, run_at=run_at, extra=extra, remark=remark,
+                               priority=self.priority, max_concurrency=self.max_concurrency)
+
+    def cron_tasks(
+            self,
+            run_at: datetime.datetime = None,
+            extra: dict = None,
+            remark: str = None
+    ):
+        if run_at is None and self.schedule is not None:
+            run_at = self.schedule.next_run_at(datetime.datetime.now())
+        return _BulkTaskController(task_name=self.task_name, run_at=run_at, extra=extra, remark=remark,
+                                   priority=self.priority, max_concurrency=self.max_concurrency)
 
 
 class _TaskController:
-    def __init__(self, task_name, task_attr, run_at, extra, remark):
+    def __init__(self, task_name, task_attr, run_at, extra, remark, priority, max_concurrency):
         self.task_name = task_name
         self.task_attr = task_attr
         self.run_at = run_at
         self.extra = extra
         self.remark = remark
+        self.priority = priority
+        self.max_concurrency = max_concurrency
         #
         self.task_args = None
         self.task_kwargs = None
@@ -69,7 +133,9 @@ class _TaskController:
                          task_args=self.task_args,
                          task_kwargs=self.task_kwargs,
                          extra=self.extra,
-                         remark=self.remark
+                         remark=self.remark,
+                         priority=self.priority,
+                         max_concurrency=self.max_concurrency
                          )
 
     def update(self):
@@ -82,8 +148,120 @@ class _TaskController:
                             remark=self.remark
                             )
 
+    def upsert(self):
+        """
+        Add the task, or move it if it's waiting
+        """
+        return taskapi.upsert_task(task_name=self.task_name,
+                                   task_attr=self.task_attr,
+                                   run_at=self.run_at,
+                                   task_args=self.task_args,
+                                   task_kwargs=self.task_kwargs,
+                                   extra=self.extra,
+                                   remark=self.remark,
+                                   priority=self.priority,
+                                   max_concurrency=self.max_concurrency
+                                   )
+
     def cancel(self):
         taskapi.cancel_task(self.task_name, self.task_attr)
 
 
-cron_task = CronTask
+class _BulkTaskController:
+    """
+    Add tasks of the same task func in bulk
+
+    Example:
+        controller = send_sms.cron_tasks(run_at=run_at)
+        for user_id in user_ids:
+            controller.params(f'user:{user_id}', user_id)
+        inserted, skipped = controller.add()
+    """
+
+    def __init__(self, task_name, run_at, extra, remark, priority, max_concurrency):
+        self.task_name = task_name
+        self.run_at = run_at
+        self.extra = extra
+        self.remark = remark
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        #
+        self.tasks = []
+
+    def params(self, task_attr, *args, **kwargs):
+        self.tasks.append(dict(task_attr=task_attr, task_args=args, task_kwargs=kwargs))
+        return self
+
+    def make_tasks(self):
+        return [
+            dict(task_name=self.task_name, run_at=self.run_at, extra=self.extra, remark=self.remark,
+                 priority=self.priority, max_concurrency=self.max_concurrency, **task)
+            for task in self.tasks
+        ]
+
+    def add(self, chunk_size=None):
+        return taskapi.add_tasks(self.make_tasks(), chunk_size=chunk_size)
+
+
+class _GroupController:
+    """
+    Add the member tasks of a group, and the callback task run once after all the members finished
+
+    Example:
+        members = send_sms.cron_tasks()
+        for user_id in user_ids:
+            members.params(f'user:{user_id}', user_id)
+        inserted, skipped = group(members, callback=report.cron_task('sms:20240101').params('20240101')).add()
+    """
+
+    def __init__(self, members, callback):
+        self.members = members
+        self.callback = callback
+
+    def add(self, chunk_size=None):
+        tasks = [task for members in self.members for task in members.make_tasks()]
+        callback = dict(task_name=self.callback.task_name, task_attr=self.callback.task_attr,
+                        task_args=self.callback.task_args, task_kwargs=self.callback.task_kwargs,
+                        extra=self.callback.extra, remark=self.callback.remark,
+                        priority=self.callback.priority, max_concurrency=self.callback.max_concurrency)
+        return taskapi.add_group(tasks, callback, chunk_size=chunk_size)
+
+
+def group(*members: _BulkTaskController, callback: _TaskController):
+    """
+    Group the member tasks of one or more task funcs with a callback task, see `_GroupController`
+    """
+    return _GroupController(members, callback)
+
+
+def cron_task(
+        task_func=None,
+        *,
+        priority: int = DEFAULT_TASK_PRIORITY,
+        max_concurrency: int = None,
+        schedule: Schedule = None,
+        misfire_policy: str = MisfirePolicy.RUN_ONCE.value,
+        misfire_grace_seconds: int = DEFAULT_MISFIRE_GRACE_SECONDS,
+):
+    """
+    Decorate task func, with or without options
+
+    Example:
+        @cron_task
+        def send_sms(user_id):
+            ...
+
+        @cron_task(priority=-10, max_concurrency=2)
+        def report(day):
+            ...
+
+        @cron_task(schedule=Crontab('0 3 * * *'), misfire_policy='skip')
+        def clean():
+            ...
+        clean.cron_task('daily').add()
+    """
+    options = dict(priority=priority, max_concurrency=max_concurrency, schedule=schedule,
+                   misfire_policy=misfire_policy, misfire_grace_seconds=misfire_grace_seconds)
+    if task_func is None:
+        return functools.partial(CronTask, **options)
+    return CronTask(task_func, **options)
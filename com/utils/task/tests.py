@@ -0,0 +1,60 @@
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from utils.redis import Cache as RedisCache
+from .management.task.constants import TaskStatus, UpsertResult
+from .management.task.engines import RedisTaskEngine
+
+
+class RedisTaskEngineTest(SimpleTestCase):
+    """
+    Run against the redis of `REDIS_CONF`, the keys are isolated by a random key prefix
+    """
+
+    def setUp(self):
+        self.client = RedisCache(**settings.REDIS_CONF, key_prefix=f'test-{uuid.uuid4().hex}')
+        self.engine = RedisTaskEngine(self.client)
+
+    def tearDown(self):
+        for key in self.client._redis.scan_iter(self.client._make_key('*')):
+            self.client._redis.delete(key)
+
+    def create_task(self, task_attr, priority=0):
+        return self.engine.create_task(
+            'tests:task', task_attr, status=TaskStatus.WAITING.value, run_at=datetime.now() - timedelta(seconds=1),
+            task_args=[], task_kwargs={}, priority=priority
+        )
+
+    def test_claim_after_priority_updated(self):
+        self.create_task('a')
+        self.assertEqual(self.engine.update_task('tests:task', 'a', update_kwargs={'priority': 5}), 1)
+        tasks = self.engine.get_waiting_tasks(count=10)
+        self.assertEqual([(task.task_attr, task.priority) for task in tasks], [('a', 5)])
+        # The task is not left in the waiting key of the old priority
+        self.assertEqual(self.engine.get_waiting_tasks(count=10), [])
+
+    def test_claim_after_priority_upserted(self):
+        self.create_task('a')
+        result = self.engine.upsert_task(
+            'tests:task', 'a', update_fields=['priority'], status=TaskStatus.WAITING.value,
+            run_at=datetime.now() - timedelta(seconds=1), task_args=[], task_kwargs={}, priority=5
+        )
+        self.assertEqual(result, UpsertResult.UPDATED)
+        tasks = self.engine.get_waiting_tasks(count=10)
+        self.assertEqual([(task.task_attr, task.priority) for task in tasks], [('a', 5)])
+        self.assertEqual(self.engine.get_waiting_tasks(count=10), [])
+
+    def test_exc_info_cleared_when_rescheduled(self):
+        self.create_task('a')
+        task, = self.engine.get_waiting_tasks(count=10)
+        self.assertTrue(self.engine.run_task(task))
+        self.assertTrue(self.engine.retry_task(task, datetime.now() - timedelta(seconds=1), exc_info='Traceback'))
+        task, = self.engine.get_waiting_tasks(count=10)
+        self.assertEqual(task.exc_info, 'Traceback')
+        self.assertTrue(self.engine.run_task(task))
+        self.assertTrue(self.engine.reschedule_task(task, datetime.now() - timedelta(seconds=1), exc_info=None))
+        task, = self.engine.get_waiting_tasks(count=10)
+        self.assertIsNone(task.exc_info)
@@ -0,0 +1,11 @@
+from django.http.response import HttpResponse
+
+from .management.task.metrics import render_prometheus, task_metrics
+
+
+def task_metrics_view(request):
+    """
+    The task metrics of all workers for Prometheus to scrape
+    """
+    return HttpResponse(render_prometheus(task_metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')